@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from typing import Iterable, List
+
+import aiohttp
+import backoff
+
+from metadata_cache import get_metadata_cache
+from singleflight import AsyncSingleFlight
+from utils import METADATA_URL, RANK_AND_SHARE, LEADERBOARD, OVERALL, cut_leaderboard
+
+logger = logging.getLogger(__name__)
+
+# throttling and upstream failures, other 4xx answers are final
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRYABLE_STATUSES
+    # a pooled keep-alive connection closed by the server is worth a second attempt
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ServerDisconnectedError))
+
+
+class AsyncPolkamonClient:
+    """
+    asyncio client for the polkamon endpoints sharing one keep-alive connection pool
+
+    usage:
+        async with AsyncPolkamonClient() as client:
+            metadata = await client.get_many_metadata(ids)
+    """
+    def __init__(self,
+                 max_in_flight: int = 50,
+                 max_connections: int = 100,
+                 timeout: float = 10,
+                 keepalive_timeout: float = 60,
+                 use_cache: bool = True):
+        self.max_in_flight = max_in_flight
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.use_cache = use_cache
+        self._session = None
+        self._semaphore = None
+        self.metadata_flight = AsyncSingleFlight()
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def open(self):
+        if self._session is None:
+            # created here so they bind to the running loop
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections,
+                                               keepalive_timeout=self.keepalive_timeout),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @backoff.on_exception(backoff.expo, (aiohttp.ClientError, asyncio.TimeoutError), max_tries=3,
+                          giveup=lambda e: not is_retryable(e))
+    async def get_json(self, url: str):
+        return await self.fetch_json(url)
+
+    async def fetch_json(self, url: str):
+        """ single attempt, for callers reacting to throttling themselves """
+        self.open()
+        async with self._semaphore:
+            async with self._session.get(url) as res:
+                if res.status != 200:
+                    raise aiohttp.ClientResponseError(res.request_info, res.history,
+                                                      status=res.status, message=res.reason)
+                return await res.json(content_type=None)
+
+    async def _fetch_metadata(self, m_id: str) -> dict:
+        metadata = await self.get_json(METADATA_URL.format(id=m_id))
+        if self.use_cache:
+            get_metadata_cache().put(m_id, metadata)
+        return metadata
+
+    async def get_metadata(self, m_id: str) -> dict:
+        m_id = str(m_id)
+        if self.use_cache:
+            metadata = get_metadata_cache().get(m_id)
+            if metadata is not None:
+                return metadata
+        return await self.metadata_flight.do(m_id, self._fetch_metadata, m_id)
+
+    async def get_many_metadata(self, ids: Iterable[str], return_exceptions: bool = True) -> List[dict]:
+        """
+        :return: metadata in the order of ids, failed lookups are returned as exceptions
+            unless return_exceptions is False
+        """
+        return await asyncio.gather(*(self.get_metadata(str(i)) for i in ids),
+                                    return_exceptions=return_exceptions)
+
+    async def get_share_on_score(self, score: int) -> float:
+        res = await self.get_json(RANK_AND_SHARE.format(score=score))
+        return float(res['share']) / 100
+
+    async def get_total_scores(self) -> int:
+        foo_score = 1_000_000
+        return int(foo_score / await self.get_share_on_score(foo_score))
+
+    async def get_leaderboard(self, anchor_rank: int = 10):
+        if anchor_rank > 100:
+            raise NotImplementedError(f"not support over {100}")
+
+        res = await self.get_json(LEADERBOARD.format(limit=min(100, anchor_rank + 3)))
+        return cut_leaderboard(res, anchor_rank)
+
+    async def get_overall_stats(self):
+        return await self.get_json(OVERALL)
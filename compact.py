@@ -0,0 +1,146 @@
+import sys
+from array import array
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from datatypes import Metadata, Attribute, Rarity, Type, Horn, Color
+from scoring import RARITY_COLUMNS, rarity_scores
+from snapshot import SNAPSHOT_PATH, iter_snapshot
+
+GLITTER_FLAG = 1
+SPECIAL_FLAG = 2
+
+
+class Codes:
+    """ string intern table, trait tables are seeded with the enum values so their codes are stable """
+    def __init__(self, seed: Iterable[str] = ()):
+        self.values = []
+        self.codes = {}
+        for value in seed:
+            self.encode(value)
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, code: int) -> str:
+        return self.values[code]
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.values) + sum(sys.getsizeof(v) for v in self.values)
+
+
+class MetadataStore:
+    """
+    struct-of-arrays store of the collection metadata, a few dozen bytes per token
+
+    traits and names are interned as small int codes, birthday is kept as an epoch.
+    Tokens are returned as regular Metadata, equal to the appended ones.
+    """
+    def __init__(self):
+        self.ids = array('Q')
+        self.names = array('H')
+        self.images = array('I')
+        self.types = array('B')
+        self.horns = array('B')
+        self.colors = array('B')
+        self.flags = array('B')
+        self.birthdays = array('q')
+        self.rarity = {c: array('d') for c in RARITY_COLUMNS}
+        self.name_codes = Codes(t.value for t in Type)
+        self.image_codes = Codes()
+        self.type_codes = Codes(t.value for t in Type)
+        self.horn_codes = Codes(h.value for h in Horn)
+        self.color_codes = Codes(c.value for c in Color)
+        self._order = None
+
+    def _append(self, token_id, name, image, type, horn, color, glitter, special, birthday, rarity):
+        self.ids.append(int(token_id))
+        self.names.append(self.name_codes.encode(name))
+        self.images.append(self.image_codes.encode(image))
+        self.types.append(self.type_codes.encode(type))
+        self.horns.append(self.horn_codes.encode(horn))
+        self.colors.append(self.color_codes.encode(color))
+        self.flags.append((GLITTER_FLAG if glitter else 0) | (SPECIAL_FLAG if special else 0))
+        self.birthdays.append(birthday)
+        for c in RARITY_COLUMNS:
+            self.rarity[c].append(getattr(rarity, c))
+        self._order = None
+        return len(self.ids) - 1
+
+    def append(self, meta: Metadata) -> int:
+        """ :return: position of the token in the store """
+        attributes = meta.attributes
+        return self._append(meta.id, meta.name, meta.image, attributes.type, attributes.horn,
+                            attributes.color, attributes.glitter, attributes.special,
+                            attributes.born, meta.rarity)
+
+    def extend(self, metas: Iterable[Metadata]):
+        for meta in metas:
+            self.append(meta)
+
+    @classmethod
+    def from_snapshot(cls, path: str = SNAPSHOT_PATH):
+        store = cls()
+        store.extend(iter_snapshot(path))
+        return store
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> Metadata:
+        flags = self.flags[i]
+        return Metadata(
+            id=str(self.ids[i]),
+            name=self.name_codes.decode(self.names[i]),
+            image=self.image_codes.decode(self.images[i]),
+            attributes=Attribute(born=self.birthdays[i],
+                                 type=self.type_codes.decode(self.types[i]),
+                                 horn=self.horn_codes.decode(self.horns[i]),
+                                 color=self.color_codes.decode(self.colors[i]),
+                                 glitter=bool(flags & GLITTER_FLAG),
+                                 special=bool(flags & SPECIAL_FLAG)),
+            rarity=Rarity(**{c: self.rarity[c][i] for c in RARITY_COLUMNS}))
+
+    def __iter__(self) -> Iterator[Metadata]:
+        return (self[i] for i in range(len(self)))
+
+    def position(self, token_id: int) -> int:
+        """ :return: position of the token, -1 if not stored """
+        ids = np.frombuffer(self.ids, dtype=np.uint64) if len(self.ids) else np.empty(0, np.uint64)
+        if self._order is None:
+            self._order = np.argsort(ids, kind='stable')
+        i = int(np.searchsorted(ids, np.uint64(token_id), sorter=self._order))
+        if i < len(self._order) and ids[self._order[i]] == token_id:
+            return int(self._order[i])
+        return -1
+
+    def get(self, token_id: int) -> Metadata:
+        i = self.position(token_id)
+        return self[i] if i >= 0 else None
+
+    def __contains__(self, token_id) -> bool:
+        return self.position(int(token_id)) >= 0
+
+    def rarity_scores(self) -> np.ndarray:
+        """ scores of every stored token, in store order """
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+        probabilities = np.column_stack([np.frombuffer(self.rarity[c], dtype=np.float64)
+                                         for c in RARITY_COLUMNS])
+        flags = np.frombuffer(self.flags, dtype=np.uint8)
+        baby_horn = np.frombuffer(self.horns, dtype=np.uint8) == self.horn_codes.encode(Horn.BABY_HORN.value)
+        return rarity_scores(probabilities, (flags & SPECIAL_FLAG) > 0, baby_horn)
+
+    def nbytes(self) -> int:
+        columns = (self.ids, self.names, self.images, self.types, self.horns, self.colors,
+                   self.flags, self.birthdays, *self.rarity.values())
+        tables = (self.name_codes, self.image_codes, self.type_codes, self.horn_codes, self.color_codes)
+        return sum(c.itemsize * len(c) for c in columns) + sum(t.nbytes() for t in tables)
+
+    def bytes_per_token(self) -> float:
+        return self.nbytes() / len(self) if len(self) else 0.0
@@ -1,10 +1,18 @@
 from dataclasses import dataclass
-from functools import reduce
+from functools import reduce, cached_property
 from enum import Enum
 
 from datetime import datetime
 import pytz
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+BIRTHDAY_TZ = pytz.timezone("Etc/GMT+7")
+BIRTHDAY_FORMAT = '%Y-%m-%d'
+
 
 @dataclass
 class Rarity:
@@ -26,33 +34,43 @@ class Rarity:
 
 @dataclass
 class Attribute:
-    birthday: str
+    born: int
     type: str
     horn: str
     color: str
     glitter: bool
     special: bool
 
-    @classmethod
-    def __array_to_dict(cls, attributes: list):
-        attributes_dict = {
-            attr['trait_type']: attr['value']
-            for attr in attributes
-        }
-        return attributes_dict
+    # trait_type of the metadata attributes -> field, other traits are skipped
+    TRAIT_FIELDS = {
+        'Birthday': 'born',
+        'Type': 'type',
+        'Horn': 'horn',
+        'Color': 'color',
+        'Glitter': 'glitter',
+        'Special': 'special',
+    }
 
     @classmethod
     def from_metadata(cls, metadata: dict):
-        attributes = cls.__array_to_dict(metadata['attributes'])
+        trait_fields = cls.TRAIT_FIELDS
+        attributes = {}
+        for attr in metadata['attributes']:
+            field = trait_fields.get(attr['trait_type'])
+            if field is not None:
+                attributes[field] = attr['value']
         return cls(
-            birthday=datetime
-                .fromtimestamp(attributes['Birthday'], tz=pytz.timezone("Etc/GMT+7"))
-                .strftime('%Y-%m-%d'),
-            color=attributes['Color'],
-            horn=attributes['Horn'],
-            type=attributes['Type'],
-            glitter=(attributes['Glitter'] == 'Yes'),
-            special=(attributes['Special'] == 'Yes'))
+            born=attributes['born'],
+            color=attributes['color'],
+            horn=attributes['horn'],
+            type=attributes['type'],
+            glitter=(attributes['glitter'] == 'Yes'),
+            special=(attributes['special'] == 'Yes'))
+
+    @cached_property
+    def birthday(self) -> str:
+        """ formatted on first access, most callers only need the score """
+        return datetime.fromtimestamp(self.born, tz=BIRTHDAY_TZ).strftime(BIRTHDAY_FORMAT)
 
 
 RARITY_SCORE_MAX_CAP = 1_000_000
@@ -66,6 +84,10 @@ class Metadata:
     attributes: Attribute
     rarity: Rarity
 
+    # rarity fields the score is computed on, by token kind
+    RARITY_FIELDS = tuple(f for f in Rarity.__dataclass_fields__.keys() if f not in ['background'])
+    SPECIAL_RARITY_FIELDS = tuple(f for f in RARITY_FIELDS if f not in ['color'])
+
     @classmethod
     def from_metadata(cls, metadata: dict):
         try:
@@ -80,30 +102,25 @@ class Metadata:
                    attributes=Attribute.from_metadata(metadata),
                    rarity=rarity)
 
-    @property
-    def rarity_score(self) -> float:
-        if not self.attributes.special:
-            rarity_fields = (
-                f
-                for f in self.rarity.__dataclass_fields__.keys()
-                if f not in ['background']
-            )
-        else:
-            rarity_fields = (
-                f
-                for f in self.rarity.__dataclass_fields__.keys()
-                if f not in ['color', 'background']
-            )
+    @classmethod
+    def from_json(cls, raw):
+        """ :param raw: metadata json as bytes or str, decoded with orjson when installed """
+        return cls.from_metadata(json_loads(raw))
+
+    @cached_property
+    def rarity_score(self) -> int:
+        """ computed on first access and kept on the instance """
+        rarity = self.rarity
         if self.attributes.special:
             try:
-                rarity_score = reduce(lambda r, k: r * ((1 / getattr(self.rarity, k) - 1) / 8 + 1),
-                                      rarity_fields,
+                rarity_score = reduce(lambda r, k: r * ((1 / getattr(rarity, k) - 1) / 8 + 1),
+                                      self.SPECIAL_RARITY_FIELDS,
                                       1) * 40
             except ArithmeticError:
                 rarity_score = 0
         else:
-            rarity_score = reduce(lambda r, k: r * (1 / getattr(self.rarity, k)),
-                                  rarity_fields,
+            rarity_score = reduce(lambda r, k: r * (1 / getattr(rarity, k)),
+                                  self.RARITY_FIELDS,
                                   1) * 0.0325
             if self.attributes.horn == Horn.BABY_HORN.value:
                 rarity_score = rarity_score * 5  # 20% spiral horn
@@ -111,13 +128,47 @@ class Metadata:
         return min(RARITY_SCORE_MAX_CAP, int(rarity_score))
 
 
+# Traits subclass -> {input: resolved member or None}
+_TRAIT_INDEXES = {}
+# inputs resolved by scanning are remembered up to this many entries per trait
+TRAIT_INDEX_MAX_SIZE = 4096
+
+
 class Traits(Enum):
     @classmethod
-    def of(cls, i: str):
+    def _scan(cls, i: str):
         for mem in cls.__members__.values():
             if i in mem.value or i in mem.value.lower().replace(" ", ""):
                 return mem
-        raise NotImplementedError(f"not found {i}")
+        return None
+
+    @classmethod
+    def _index(cls) -> dict:
+        index = _TRAIT_INDEXES.get(cls)
+        if index is None:
+            # exact and normalized values resolve to what the scan returns for them,
+            # an earlier member containing the value wins like in the scan
+            index = {
+                alias: cls._scan(alias)
+                for mem in cls.__members__.values()
+                for alias in (mem.value, mem.value.lower().replace(" ", ""))
+            }
+            _TRAIT_INDEXES[cls] = index
+        return index
+
+    @classmethod
+    def of(cls, i: str):
+        index = cls._index()
+        try:
+            mem = index[i]
+        except KeyError:
+            # prefix / substring inputs
+            mem = cls._scan(i)
+            if len(index) < TRAIT_INDEX_MAX_SIZE:
+                index[i] = mem
+        if mem is None:
+            raise NotImplementedError(f"not found {i}")
+        return mem
 
     def __str__(self):
         return self.value
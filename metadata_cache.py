@@ -0,0 +1,153 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Callable, Iterable, Optional
+
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+METADATA_CACHE_PATH = os.getenv("METADATA_CACHE_PATH", "cache/metadata.sqlite")
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "50000"))
+
+
+def is_opened(metadata: dict) -> bool:
+    """ metadata of an opened monster never changes, so it is the only one worth caching """
+    return bool(metadata) and 'attributes' in metadata
+
+
+class MetadataCache:
+    """
+    read-through metadata cache: in-memory LRU in front of a sqlite table keyed by token id
+    """
+    def __init__(self, path: str = METADATA_CACHE_PATH, maxsize: int = METADATA_CACHE_SIZE):
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lru = LRUCache(maxsize=maxsize)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS metadata (id TEXT PRIMARY KEY, body TEXT NOT NULL)")
+        self._db.commit()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _load(self, m_id: str) -> Optional[dict]:
+        row = self._db.execute("SELECT body FROM metadata WHERE id = ?", (m_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, m_id: str) -> Optional[dict]:
+        m_id = str(m_id)
+        with self._lock:
+            metadata = self._lru.get(m_id)
+            if metadata is not None:
+                self.memory_hits += 1
+                return metadata
+
+            metadata = self._load(m_id)
+            if metadata is not None:
+                self.disk_hits += 1
+                self._lru[m_id] = metadata
+                return metadata
+
+            self.misses += 1
+            return None
+
+    def put(self, m_id: str, metadata: dict):
+        if not is_opened(metadata):
+            return
+        m_id = str(m_id)
+        with self._lock:
+            self._lru[m_id] = metadata
+            self._db.execute("INSERT OR REPLACE INTO metadata (id, body) VALUES (?, ?)",
+                             (m_id, json.dumps(metadata)))
+            self._db.commit()
+
+    def get_or_fetch(self, m_id: str, fetch: Callable[[str], dict]) -> dict:
+        metadata = self.get(m_id)
+        if metadata is None:
+            metadata = fetch(str(m_id))
+            self.put(m_id, metadata)
+        return metadata
+
+    def warm(self, ids: Iterable[str] = None, fetch: Callable[[str], dict] = None) -> int:
+        """
+        pre-load the memory tier
+        :param ids: token ids to warm, all stored tokens (up to the LRU size) if omitted
+        :param fetch: when given, tokens not stored on disk are fetched and stored
+        :return: number of warmed tokens
+        """
+        warmed = 0
+        with self._lock:
+            if ids is None:
+                rows = self._db.execute("SELECT id, body FROM metadata ORDER BY rowid DESC LIMIT ?",
+                                        (self._lru.maxsize,))
+                for m_id, body in rows:
+                    self._lru[m_id] = json.loads(body)
+                    warmed += 1
+                return warmed
+
+        for m_id in map(str, ids):
+            with self._lock:
+                metadata = self._load(m_id)
+                if metadata is not None:
+                    self._lru[m_id] = metadata
+                    warmed += 1
+                    continue
+            if fetch is None:
+                continue
+            try:
+                self.put(m_id, fetch(m_id))
+                warmed += 1
+            except Exception as e:
+                logger.warning(f"cannot warm {m_id}: {e}")
+        return warmed
+
+    def values(self) -> Iterable[dict]:
+        """ every stored metadata, read in one pass from disk """
+        with self._lock:
+            rows = self._db.execute("SELECT body FROM metadata").fetchall()
+        return (json.loads(body) for body, in rows)
+
+    def ids(self) -> Iterable[str]:
+        with self._lock:
+            return [r[0] for r in self._db.execute("SELECT id FROM metadata")]
+
+    def __contains__(self, m_id) -> bool:
+        m_id = str(m_id)
+        with self._lock:
+            return m_id in self._lru or self._db.execute(
+                "SELECT 1 FROM metadata WHERE id = ?", (m_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0,
+            'memory_size': len(self._lru),
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache()
+        return _metadata_cache
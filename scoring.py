@@ -0,0 +1,61 @@
+from typing import Iterable, Tuple
+
+import numpy as np
+
+from datatypes import Horn, Metadata, RARITY_SCORE_MAX_CAP
+
+# column order of the probabilities matrix, same as Rarity fields
+RARITY_COLUMNS = ('horn', 'color', 'background', 'glitter', 'type')
+_HORN, _COLOR, _BACKGROUND, _GLITTER, _TYPE = range(len(RARITY_COLUMNS))
+
+
+def rarity_scores(probabilities: np.ndarray, special: np.ndarray, horn: np.ndarray) -> np.ndarray:
+    """
+    batch counterpart of Metadata.rarity_score, same results for every token
+
+    :param probabilities: (n, 5) initialProbabilities in RARITY_COLUMNS order
+    :param special: (n,) special flags
+    :param horn: (n,) horn names, or baby horn flags if boolean
+    :return: (n,) int64 scores
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64).reshape(-1, len(RARITY_COLUMNS))
+    special = np.asarray(special, dtype=bool)
+    horn = np.asarray(horn)
+    baby_horn = horn if horn.dtype == bool else horn == Horn.BABY_HORN.value
+
+    regular_columns = probabilities[:, (_HORN, _COLOR, _GLITTER, _TYPE)]
+    if np.any(regular_columns[~special] == 0):
+        raise ZeroDivisionError("float division by zero")
+    special_columns = probabilities[:, (_HORN, _GLITTER, _TYPE)]
+    # the scalar score falls back to 0 on ArithmeticError
+    special_zero = np.any(special_columns == 0, axis=1) & special
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # multiplications run column by column in the scalar order so rounding matches exactly
+        regular = np.ones(len(probabilities))
+        for column in regular_columns.T:
+            regular = regular * (1 / column)
+        regular = regular * 0.0325
+        regular = np.where(baby_horn, regular * 5, regular)
+
+        special_score = np.ones(len(probabilities))
+        for column in special_columns.T:
+            special_score = special_score * ((1 / column - 1) / 8 + 1)
+        special_score = special_score * 40
+
+    scores = np.where(special, np.where(special_zero, 0, special_score), regular)
+    return np.minimum(RARITY_SCORE_MAX_CAP, np.trunc(scores)).astype(np.int64)
+
+
+def to_columns(metas: Iterable[Metadata]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ :return: probabilities, special flags and horn names of the tokens """
+    metas = list(metas)
+    probabilities = np.array([[getattr(m.rarity, c) for c in RARITY_COLUMNS] for m in metas],
+                             dtype=np.float64).reshape(-1, len(RARITY_COLUMNS))
+    special = np.fromiter((m.attributes.special for m in metas), dtype=bool, count=len(metas))
+    horn = np.array([m.attributes.horn for m in metas], dtype=object)
+    return probabilities, special, horn
+
+
+def rarity_scores_of(metas: Iterable[Metadata]) -> np.ndarray:
+    return rarity_scores(*to_columns(metas))
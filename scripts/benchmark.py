@@ -0,0 +1,183 @@
+import argparse
+import json
+import timeit
+import tracemalloc
+from datetime import datetime
+
+import pytz
+
+from hexbytes import HexBytes
+from termcolor import colored
+
+from compact import MetadataStore
+from datatypes import Metadata, Rarity, Type, Horn, Color
+import scvfeed.config as config
+from scvfeed.matcher import RuleMatcher
+from scvfeed.decoder import PMON_TOKEN_TOPIC, TradeSide, decode_offers
+
+SAMPLE_PRICE = int(0.5 * 1E18)
+SAMPLE_METADATA = {"boosterId": 10000000440771, "id": "10001322311",
+                   "image": "https://assets.polkamon.com/images/Unimons_T04C05H08B04G01.jpg",
+                   "name": "Uniturtle",
+                   "initialProbabilities": {"horn": 0.16, "color": 0.2, "background": 1,
+                                            "glitter": 0.01, "type": 0.06},
+                   "attributes": [{"trait_type": "Type", "value": "Uniturtle"},
+                                  {"trait_type": "Horn", "value": "Candy Cane"},
+                                  {"trait_type": "Color", "value": "Red"},
+                                  {"trait_type": "Background", "value": "Mountain Range"},
+                                  {"trait_type": "Opening Network", "value": "Binance Smart Chain"},
+                                  {"trait_type": "Glitter", "value": "No"},
+                                  {"trait_type": "Special", "value": "No"},
+                                  {"display_type": "date", "trait_type": "Birthday",
+                                   "value": 1630645436},
+                                  {"display_type": "number", "trait_type": "Booster",
+                                   "value": 10000000440771}]}
+
+
+def report(name: str, number: int, **candidates):
+    print(colored(name, "yellow"))
+    baseline = None
+    for label, fn in candidates.items():
+        per_call = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        baseline = baseline or per_call
+        print(f"  {label:<24} {per_call * 1E6:10.2f} us  x{baseline / per_call:.1f}")
+
+
+class UncachedMetadata(Metadata):
+    """ recomputes the score on every access, as before memoization """
+    rarity_score = property(Metadata.rarity_score.func)
+
+
+def match_offer(meta: Metadata, rules: tuple = config.rules):
+    price_in_bnb = SAMPLE_PRICE / 1E18
+    for rule in rules:
+        try:
+            if rule.is_worth_buying(price_in_bnb, meta):
+                break
+        except Exception:
+            pass
+    return meta.rarity_score
+
+
+def bench_rarity(number: int):
+    meta = Metadata.from_metadata(SAMPLE_METADATA)
+    fields = {f: getattr(meta, f) for f in meta.__dataclass_fields__}
+    report("rarity score per offer (rules + alert)", number,
+           uncached=lambda: match_offer(UncachedMetadata(**fields)),
+           memoized=lambda: match_offer(Metadata(**fields)))
+
+
+def sample_metas(count: int):
+    for i in range(count):
+        raw = {**SAMPLE_METADATA, 'id': str(10001000000 + i),
+               'initialProbabilities': {**SAMPLE_METADATA['initialProbabilities'], 'horn': 1 / (i % 97 + 2)}}
+        yield Metadata.from_metadata(raw)
+
+
+def allocated(build) -> tuple:
+    tracemalloc.start()
+    try:
+        obj = build()
+        return obj, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(number: int):
+    metas = list(sample_metas(number))
+    # strings of the sample are shared, copied here as every parsed token owns its own
+    _, objects = allocated(lambda: [Metadata.from_metadata({
+        **SAMPLE_METADATA, 'id': m.id, 'image': m.image[:-1] + m.image[-1], 'name': m.name[:-1] + m.name[-1]})
+        for m in metas])
+    store = MetadataStore()
+    store.extend(metas)
+    print(colored(f"memory per token over {number:,} tokens", "yellow"))
+    print(f"  {'Metadata objects':<24} {objects / number:10.1f} B")
+    print(f"  {'MetadataStore':<24} {store.bytes_per_token():10.1f} B")
+
+
+def legacy_parse(metadata: dict):
+    """ parsing before the fast path: full attribute dict, timezone lookup and eager birthday """
+    attributes = {attr['trait_type']: attr['value'] for attr in metadata['attributes']}
+    birthday = datetime.fromtimestamp(attributes['Birthday'], tz=pytz.timezone("Etc/GMT+7")).strftime('%Y-%m-%d')
+    return (metadata['id'], metadata['name'], metadata['image'], birthday,
+            attributes['Color'], attributes['Horn'], attributes['Type'],
+            attributes['Glitter'] == 'Yes', attributes['Special'] == 'Yes', Rarity.from_metadata(metadata))
+
+
+def bench_parse(number: int):
+    raw = json.dumps(SAMPLE_METADATA).encode()
+    report("metadata parsing", number,
+           legacy=lambda: legacy_parse(json.loads(raw)),
+           from_metadata=lambda: Metadata.from_metadata(json.loads(raw)),
+           from_json=lambda: Metadata.from_json(raw))
+
+
+def bench_traits(number: int):
+    def scan(cls, i: str):
+        for mem in cls.__members__.values():
+            if i in mem.value or i in mem.value.lower().replace(" ", ""):
+                return mem
+
+    lookups = ((Type, "Baby Uniaqua"), (Horn, "Wicked Spear"), (Color, "Black"))
+    report("trait lookups of one rule check", number,
+           scan=lambda: [scan(cls, i) for cls, i in lookups],
+           indexed=lambda: [cls.of(i) for cls, i in lookups])
+
+
+def bench_rules(number: int):
+    rules = config.rules * 100
+    matcher = RuleMatcher(rules)
+    fields = {f: getattr(Metadata.from_metadata(SAMPLE_METADATA), f) for f in Metadata.__dataclass_fields__}
+    report(f"first matching rule of {len(rules):,} rules", max(1, number // 100),
+           sequential=lambda: match_offer(Metadata(**fields), rules),
+           compiled=lambda: matcher.match(SAMPLE_PRICE, Metadata(**fields)))
+
+
+def sample_logs(count: int) -> list:
+    return [{'topics': [HexBytes('0x' + '11' * 32), HexBytes('0x' + '22' * 32), HexBytes(PMON_TOKEN_TOPIC),
+                        HexBytes((10001000000 + i).to_bytes(32, 'big'))],
+             'data': '0x{:064x}{:064x}{:064x}'.format(SAMPLE_PRICE + i, 1, 50000 + i),
+             'transactionHash': HexBytes(i.to_bytes(32, 'big')),
+             'blockNumber': 11000000 + i // 10,
+             'logIndex': i % 10} for i in range(count)]
+
+
+def legacy_decode(evt):
+    """ hex string slicing of the log, as before the binary decoder """
+    if evt['topics'][2].hex() == PMON_TOKEN_TOPIC:
+        token_id = int.from_bytes(evt['topics'][3], 'big')
+        data = evt['data'].replace('0x', '')
+        price_hexstr, side_hexstr, _ = [data[i:i + 64] for i in range(0, len(data), 64)]
+        side = TradeSide.of(int(f"0x{side_hexstr}", 16))
+        price = int(f"0x{price_hexstr}", 16)
+        return token_id, side, price, evt['transactionHash'].hex()
+
+
+def bench_decode(number: int):
+    logs = sample_logs(100)
+    report(f"decoding a batch of {len(logs)} EvNewOffer logs", max(1, number // 100),
+           legacy=lambda: [legacy_decode(e) for e in logs],
+           binary=lambda: decode_offers(logs))
+
+
+BENCHMARKS = {
+    'rarity': bench_rarity,
+    'memory': bench_memory,
+    'parse': bench_parse,
+    'traits': bench_traits,
+    'rules': bench_rules,
+    'decode': bench_decode,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="hot path microbenchmarks")
+    parser.add_argument("names", nargs="*", help=f"any of {', '.join(BENCHMARKS)}, all when omitted")
+    parser.add_argument("--number", type=int, default=10000)
+
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks {', '.join(unknown)}")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](args.number)
@@ -6,7 +6,7 @@ from datatypes import Metadata
 
 
 def main(args: list):
-    metadata = get_metadata(args.id)
+    metadata = get_metadata(args.id, use_cache=not args.no_cache)
     meta = Metadata.from_metadata(metadata)
     print(colored(f"Rarity score: {meta.rarity_score}", "green"))
     print(colored(f"Birthday: {meta.attributes.birthday}", "yellow"))
@@ -15,6 +15,7 @@ def main(args: list):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--id", required=True)
+    parser.add_argument("--no-cache", action="store_true", help="bypass the local metadata cache")
 
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import logging
+import time
+
+import aiohttp
+from termcolor import colored
+from tqdm import tqdm
+
+from aio_utils import AsyncPolkamonClient
+from snapshot import SNAPSHOT_PATH, SnapshotWriter, snapshot_ids, failed_ids
+from utils import METADATA_URL
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                    level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+THROTTLED_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AdaptiveLimiter:
+    """
+    additive increase / multiplicative decrease concurrency limit,
+    throttling answers halve the limit and pause new requests for a while
+    """
+    def __init__(self, initial: int = 10, minimum: int = 1, maximum: int = 100,
+                 increase_every: int = 20, cooldown: float = 2):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_every = increase_every
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._successes = 0
+        self._paused_until = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    async def release(self, throttled: bool = False):
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self._successes = 0
+                self.limit = max(self.minimum, self.limit // 2)
+                self._paused_until = time.monotonic() + self.cooldown
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_every and self.limit < self.maximum:
+                    self._successes = 0
+                    self.limit += 1
+            self._condition.notify_all()
+
+
+def is_throttled(error: Exception) -> bool:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in THROTTLED_STATUSES
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+async def crawl_one(client: AsyncPolkamonClient, limiter: AdaptiveLimiter,
+                    writer: SnapshotWriter, m_id: int, progress: tqdm):
+    await limiter.acquire()
+    throttled = False
+    try:
+        # not retried here, the limiter has to see throttling answers first
+        metadata = await client.fetch_json(METADATA_URL.format(id=m_id))
+    except Exception as e:
+        throttled = is_throttled(e)
+        writer.write_failure(m_id, repr(e))
+    else:
+        # unopened monsters are stored raw as well, readers of the snapshot skip them
+        metadata.setdefault('id', str(m_id))
+        writer.write(metadata)
+    finally:
+        await limiter.release(throttled)
+        progress.update()
+        progress.set_postfix(concurrency=limiter.limit)
+
+
+async def crawl(ids: list, writer: SnapshotWriter, concurrency: int, max_concurrency: int):
+    # created inside the running loop, asyncio primitives bind to it on python 3.9
+    limiter = AdaptiveLimiter(initial=concurrency, maximum=max_concurrency)
+    async with AsyncPolkamonClient(max_in_flight=limiter.maximum,
+                                   max_connections=limiter.maximum,
+                                   use_cache=False) as client:
+        with tqdm(total=len(ids), unit="token") as progress:
+            pending = set()
+            for m_id in ids:
+                # keep the task set small instead of scheduling the whole range up front
+                if len(pending) >= limiter.maximum * 2:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.add(asyncio.ensure_future(crawl_one(client, limiter, writer, m_id, progress)))
+            if pending:
+                await asyncio.wait(pending)
+
+
+def ids_to_crawl(out: str, start: int, end: int, retry_failed: bool = False) -> list:
+    """ ids missing from the snapshot, or only the failed ones """
+    if retry_failed:
+        return sorted(failed_ids(out))
+    done = snapshot_ids(out)
+    return [i for i in range(start, end + 1) if i not in done]
+
+
+def main(args):
+    ids = ids_to_crawl(args.out, args.start, args.end, args.retry_failed)
+    print(colored(f"Crawling {len(ids):,} tokens into {args.out}", "yellow"))
+
+    started_at = time.monotonic()
+    with SnapshotWriter(args.out) as writer:
+        asyncio.run(crawl(ids, writer, args.concurrency, args.max_concurrency))
+    elapsed = time.monotonic() - started_at
+
+    remaining = failed_ids(args.out)
+    print(colored(f"Done in {elapsed:.1f}s, {len(remaining):,} failed tokens "
+                  f"(rerun with --retry-failed)", "green" if not remaining else "red"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="snapshot the collection metadata, resumable")
+    parser.add_argument("--start", type=int, default=10000000001)
+    parser.add_argument("--end", type=int, default=10001600000, help="inclusive")
+    parser.add_argument("--out", default=SNAPSHOT_PATH)
+    parser.add_argument("--concurrency", type=int, default=10, help="initial concurrency")
+    parser.add_argument("--max-concurrency", type=int, default=100)
+    parser.add_argument("--retry-failed", action="store_true", help="only crawl previously failed tokens")
+
+    main(parser.parse_args())
@@ -1,18 +1,21 @@
-from typing import Iterable
+from typing import Iterable, Union
 import os
 import logging
 import time
-import requests
-import backoff
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import web3_utils
-from enum import Enum
 from utils import get_metadata
 from datatypes import Metadata
 from scvfeed.models import Rule
-from scvfeed.config import rules
-import threading
-import queue
+from scvfeed.matcher import RuleMatcher
+from scvfeed.config import rules, TOKEN_ALLOWLIST
+from scvfeed.blocksearch import new_offer_topics
+from scvfeed.decoder import TradeSide, decode_offers
+from scvfeed.dedup import DedupIndex
+from scvfeed.blocksearch import BlockClock
+from scvfeed import metrics
+from scvfeed.sender import TelegramSender
 
 # Enable logging
 log_filename = datetime.now().strftime('log/scvfeed_%Y%m%d.log')
@@ -28,58 +31,44 @@ TELEGRAM_CHAT_ID = {
 }
 SCV_CONTRACT = '0x9437E3E2337a78D324c581A4bFD9fe22a1aDBf04'
 
-# notification pool
-messages = queue.Queue()
-
 # get your api_id, api_hash, token
 # from telegram as described above
 api_id = os.getenv('API_ID')
 api_hash = os.getenv('API_HASH')
 bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
+sender = TelegramSender(bot_token)
 
 
-class TradeSide(Enum):
-    SELL = 1
-    BUY = 2
-
-    @classmethod
-    def of(cls, side: int):
-        return cls.SELL if side == cls.SELL.value else cls.BUY
+# logs left after the node side topic filter
+event_counts = {'kept': 0, 'discarded': 0}
+# offers already handled, across polls and filter recreations
+dedup = DedupIndex()
+block_clock = BlockClock(web3_utils.web3.eth.get_block)
+# block timestamps are looked up off the polling loop
+lag_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="block-lag")
+METRICS_PORT = int(os.getenv("SCV_METRICS_PORT", "9108"))
+METRICS_LOG_INTERVAL = int(os.getenv("SCV_METRICS_LOG_INTERVAL", "300"))
 
-    def __str__(self):
-        return 'SELL' if self == TradeSide.SELL else 'BUY'
 
-
-# EvNewOffer (
-#   index_topic_1 address user,
-#   index_topic_2 address nft,
-#   index_topic_3 uint256 tokenId,
-#   uint256 price,
-#   uint8 side,
-#   uint256 id
-# )
-PMON_TOKEN_TOPIC = '0x00000000000000000000000085f0e02cb992aa1f9f47112f815f519ef1a59e2d'
-METHOD_TOPIC = web3_utils.web3.sha3(text='EvNewOffer(address,address,uint256,uint256,uint8,uint256)').hex()
+def stage_timer(stage: str):
+    return metrics.registry.histogram("scv_stage_seconds", "time spent on an offer per step", stage=stage).time()
 
 
 def get_filter_event():
     scv_filter_event = web3_utils.web3.eth.filter({
-        "address": SCV_CONTRACT, "topics": [METHOD_TOPIC]})
+        "address": SCV_CONTRACT, "topics": new_offer_topics(TOKEN_ALLOWLIST)})
     return scv_filter_event
 
 
-def get_matched_rule(price: int, metadata: Metadata, rul3s: Iterable[Rule]) -> Rule:
-    price_in_bnb = price / 1E18
+matcher = RuleMatcher(rules)
 
-    for rule in rul3s:
-        try:
-            if rule.is_worth_buying(price_in_bnb, metadata):
-                logger.info(f"worth buying monster {rule}")
-                return rule
-        except Exception as e:
-            logger.error(f"encountered exception {rule}\n{e}")
-            pass
-    return None
+
+def get_matched_rule(price: int, metadata: Metadata, rul3s: Union[RuleMatcher, Iterable[Rule]]) -> Rule:
+    rul3s = rul3s if isinstance(rul3s, RuleMatcher) else RuleMatcher(rul3s)
+    rule = rul3s.match(price, metadata)
+    if rule:
+        logger.info(f"worth buying monster {rule}")
+    return rule
 
 
 def get_color_by_spb(spb: int) -> str:
@@ -115,37 +104,16 @@ def on_start_intro() -> str:
     return f"{header}\n{body}"
 
 
-@backoff.on_exception(backoff.constant,
-                      interval=1,
-                      max_tries=3,
-                      exception=(requests.exceptions.RequestException, ))
-def send_msg(msg, parse_mode=''):
-    params = (
-        f'chat_id={TELEGRAM_CHAT_ID[os.getenv("TID", "scvfeed")]}',
-        f'text={msg}',
-        f'parse_mode={parse_mode}'
-    )
-    requests.get("https://api.telegram.org/bot{}/sendMessage?{}".format(bot_token, '&'.join(params)))
-
-
-class Notifier(threading.Thread):
-    def __init__(self, name):
-        threading.Thread.__init__(self)
-        self.name = name
-
-    def run(self) -> None:
-        while True:
-            try:
-                while not messages.empty():
-                    msg = messages.get_nowait()
-                    try:
-                        send_msg(msg, parse_mode='html')
-                    except Exception as e:
-                        logger.error(f"failed to send {msg}: {e}")
-                        pass
-                time.sleep(0.1)
-            except KeyboardInterrupt as e:
-                raise KeyboardInterrupt from e
+def send_msg(msg, parse_mode=None, urgent=False, on_sent=None):
+    sender.send(TELEGRAM_CHAT_ID[os.getenv("TID", "scvfeed")], msg, parse_mode=parse_mode,
+                urgent=urgent, on_sent=on_sent)
+
+
+def record_notify_lag(detected_at: float):
+    def on_sent(sent_at: float):
+        metrics.registry.histogram("scv_detect_to_notify_seconds", "offer received to alert sent") \
+            .observe(sent_at - detected_at)
+    return on_sent
 
 
 class FilterNotFoundError(Exception):
@@ -153,54 +121,56 @@ class FilterNotFoundError(Exception):
     pass
 
 
-def new_event_handler(evt):
-    logger.debug(f"processing {evt}")
-    token_topic = evt['topics'][2].hex()
-    if token_topic == PMON_TOKEN_TOPIC:
-        token_id = int.from_bytes(evt['topics'][3], 'big')
-        data = evt['data'].replace('0x', '')
-        price_hexstr, side_hexstr, _ = [data[i:i + 64] for i in range(0, len(data), 64)]
-        side = TradeSide.of(int(f"0x{side_hexstr}", 16))
-        price = int(f"0x{price_hexstr}", 16)
-        tx = evt['transactionHash'].hex()
-        logger.info("new event %s %d with price %.2f, tx %s", side, token_id, price, tx)
-        return side, token_id, price
-    return None, None, None
-
-
 def get_sell_event(evt_filter):
     try:
-        new_entries = evt_filter.get_new_entries()
+        with stage_timer("get_new_entries"):
+            new_entries = evt_filter.get_new_entries()
     except Exception as e:
         logger.exception(str(e))
         raise FilterNotFoundError from e
-    # to avoid duplicated event emit
-    pre_token_id = None
-    for e in new_entries:
+    offers = decode_offers(new_entries)
+    event_counts['kept'] += len(offers)
+    event_counts['discarded'] += len(new_entries) - len(offers)
+    for offer in offers:
+        if dedup.seen(offer.tx, offer.log_index):
+            continue
+        logger.info("new event %s %d with price %d, tx %s", offer.side, offer.token_id, offer.price, offer.tx)
+        if offer.side == TradeSide.SELL:
+            yield offer
+
+
+def record_block_lag(offers: list, detected_at: float):
+    lag = metrics.registry.histogram("scv_block_to_detect_seconds", "block timestamp to offer received")
+    for block_number in {o.block_number for o in offers}:
         try:
-            side, token_id, price = new_event_handler(e)
+            lag.observe(block_clock.lag(block_number, detected_at))
         except Exception as e:
-            logging.exception(str(e))
-            continue
-        if side == TradeSide.SELL and token_id != pre_token_id:
-            pre_token_id = token_id
-            yield side, token_id, price
+            logger.debug(f"cannot get timestamp of block {block_number}: {e}")
 
 
 def main():
-    messages.put_nowait(on_start_intro())
+    send_msg(on_start_intro())
     scv_filter_event = get_filter_event()
     while True:
         try:
             time.sleep(1)
-            for side, token_id, price in get_sell_event(scv_filter_event):
-                meta = Metadata.from_metadata(get_metadata(str(token_id)))
-                matched_rule = get_matched_rule(price, meta, rules)
+            detected_at = time.time()
+            offers = []
+            for offer in get_sell_event(scv_filter_event):
+                offers.append(offer)
+                with stage_timer("get_metadata"):
+                    meta = Metadata.from_metadata(get_metadata(str(offer.token_id)))
+                with stage_timer("get_matched_rule"):
+                    matched_rule = get_matched_rule(offer.price, meta, matcher)
                 if matched_rule:
                     try:
-                        messages.put_nowait(to_html(meta, price, meta.rarity_score, matched_rule))
+                        send_msg(to_html(meta, offer.price, meta.rarity_score, matched_rule), parse_mode='html',
+                                 urgent=True, on_sent=record_notify_lag(detected_at))
                     except Exception as e:
                         logging.exception(str(e))
+            # after the alerts are queued, blocks are looked up once each without delaying the next poll
+            if offers:
+                lag_executor.submit(record_block_lag, offers, detected_at)
 
         except FilterNotFoundError as e:
             logger.error(f"cannot get new entries: {e}")
@@ -218,11 +188,16 @@ def main():
 
 
 if __name__ == '__main__':
-    telegram_thread = Notifier("telegram")
-    telegram_thread.start()
-    time.sleep(1)
+    metrics.registry.collect("scv_dedup", dedup.stats)
+    metrics.registry.collect("scv_events", lambda: event_counts)
+    metrics.registry.collect("scv_sender", sender.stats)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    metrics.log_summary(METRICS_LOG_INTERVAL)
     try:
         main()
     except KeyboardInterrupt as exc:
         logging.exception(str(exc))
         logging.info("graceful shutdown")
+    finally:
+        sender.close(timeout=10)
@@ -8,11 +8,15 @@ from telegram import ParseMode
 from utils import (
     get_metadata,
     get_datatype_from_list,
-    get_total_scores,
+    warm_metadata_cache,
+)
+from stats_cache import (
     get_leaderboard,
-    get_share_on_score,
     get_weekly_birthday_snapshot,
+    start_refresher,
 )
+from share_model import share_model
+from scvfeed import metrics
 from datatypes import Metadata, Color, Type, Horn, Glitter
 from helpers import SCVFilterBuilder, OSFilterBuilder
 from enum import Enum
@@ -29,6 +33,10 @@ PRODUCTION = os.environ.get('PRODUCTION', False)
 WEBHOOK_PORT = int(os.environ.get('PORT', '8443'))
 APP_NAME = os.environ.get('APP_NAME', 'https://pmon-helper.herokuapp.com/')
 TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
+# live order book of SCV listings for /floor, same settings as the feed
+ORDERBOOK = os.environ.get('SCV_ORDERBOOK', '0') == '1'
+# prometheus text on http://127.0.0.1:<port>/metrics, off by default
+METRICS_PORT = int(os.environ.get('SCV_METRICS_PORT', '0'))
 
 # url with desc
 DescUrl = namedtuple('DescUrl', ('desc', 'url'))
@@ -77,7 +85,9 @@ Commands
   /total    - get total collector staking scores
   /lb <to_rank (optional)>  - get leaderboard
   /rw <score> <pool_per_week>  - calculate reward per week
+  /model  - share model drift against rankAndShare
   /openstats  - open booster stats
+  /floor <type/color/horn/glitter ...>  - cheapest SCV listings
 """
 
 # https://core.telegram.org/bots/api#html-style
@@ -164,9 +174,36 @@ class BotHandlers:
             parse_mode=ParseMode.HTML,
             disable_web_page_preview=True)
 
+    @staticmethod
+    def get_floor(update, context):
+        if order_book_watcher is None:
+            update.message.reply_text("order book is disabled")
+            return
+        if not order_book_watcher.synced.is_set():
+            update.message.reply_text("order book is syncing, try again later")
+            return
+        from scvfeed.orderbook import filter_key
+
+        attrs = update.message.text.split(" ")[1:]
+        glitter = Glitter.YES if any(a.lower() == "glitter" for a in attrs) else None
+        scv = SCVFilterBuilder(type=get_datatype_from_list(Type, attrs),
+                               horn=get_datatype_from_list(Horn, attrs),
+                               color=get_datatype_from_list(Color, attrs),
+                               glitter=glitter)
+        listings = order_book_watcher.order_book.cheapest(filter_key(scv), 5)
+        if not listings:
+            update.message.reply_text(f"no {scv.name or 'monster'} listed")
+            return
+        lines = map(lambda l: "{:.3f} BNB {}".format(
+            l.price / 1E18, to_html(DescUrl(desc=f"#{l.token_id}", url=SCV_URL.url), id=l.token_id)), listings)
+        update.message.reply_text(
+            f"{scv.name or 'All'} floor\n" + "\n".join(lines),
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True)
+
     @staticmethod
     def get_total_staking_score(update, context):
-        total_scores = "{:,}".format(get_total_scores())
+        total_scores = "{:,}".format(share_model.total_scores())
         update.message.reply_text(f"total staking scores: {total_scores}")
 
     @staticmethod
@@ -190,12 +227,24 @@ class BotHandlers:
     @staticmethod
     def calc_reward(update, context):
         score, pool_per_week = map(lambda x: int(x), update.message.text.split(" ")[1:])
-        share = get_share_on_score(score)
+        share = share_model.share(score)
         update.message.reply_text("{:,} score gains "
                                   "{:.2f} $pmon per week "
                                   "(pool: {:,} $pmon)".format(
             score, pool_per_week * share, pool_per_week))
 
+    @staticmethod
+    def get_share_model_stats(update, context):
+        stats = share_model.stats()
+        if stats['drift'] is None:
+            update.message.reply_text("share model is not fitted yet")
+            return
+        update.message.reply_text(
+            "total scores: {:,}\n"
+            "drift: {:.2%} (max {:.2%})\n"
+            "fitted {:.0f}s ago, {} refresh errors".format(
+                stats['total_scores'], stats['drift'], stats['max_drift'], stats['age'], stats['refresh_errors']))
+
     @staticmethod
     def get_open_booster_stats(update, context):
         stats, total = get_weekly_birthday_snapshot()
@@ -229,12 +278,31 @@ class BotHandlers:
         update.message.reply_text(f"Invalid {update.message.text}")
 
 
+order_book_watcher = None
+
+
 def main():
     """Start the bot."""
+    global order_book_watcher
     # Create the Updater and pass it your bot's token.
     # Make sure to set use_context=True to use the new context based callbacks
     # Post version 12 this will no longer be necessary
     updater = Updater(TELEGRAM_BOT_TOKEN, use_context=True)
+    logger.info("warmed %d cached metadata", warm_metadata_cache())
+    share_model.schedule(start_refresher())
+    metrics.registry.collect("share_model", share_model.stats)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    if ORDERBOOK:
+        # web3 is only installed where the order book is enabled
+        from scvfeed.orderbook import watcher_from_config
+        from scvfeed.exceptions import AbiError
+
+        try:
+            order_book_watcher = watcher_from_config()
+            order_book_watcher.start()
+        except AbiError as e:
+            logger.error(f"order book not started: {e}")
 
     # Get the dispatcher to register handlers
     dp = updater.dispatcher
@@ -248,6 +316,8 @@ def main():
     dp.add_handler(CommandHandler("lb", BotHandlers.get_leaderboard))
     dp.add_handler(CommandHandler("rw", BotHandlers.calc_reward))
     dp.add_handler(CommandHandler("openstats", BotHandlers.get_open_booster_stats))
+    dp.add_handler(CommandHandler("model", BotHandlers.get_share_model_stats))
+    dp.add_handler(CommandHandler("floor", BotHandlers.get_floor, pass_args=True))
 
     # log all errors
     dp.add_error_handler(BotHandlers.error)
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+import aiohttp
+from tqdm import tqdm
+
+from scripts.crawler import AdaptiveLimiter, crawl_one, ids_to_crawl, is_throttled
+from snapshot import SnapshotWriter, failed_ids, iter_snapshot, snapshot_ids, truncate_partial_line
+
+OPENED = {'id': '3', 'name': 'Black Unichick', 'image': 'https://example.org/3.png', 'attributes': [
+    {'trait_type': 'Birthday', 'value': 0}, {'trait_type': 'Type', 'value': 'Unichick'},
+    {'trait_type': 'Horn', 'value': 'Baby Horn'}, {'trait_type': 'Color', 'value': 'Black'},
+    {'trait_type': 'Glitter', 'value': 'No'}, {'trait_type': 'Special', 'value': 'No'}]}
+
+
+def response_error(status: int) -> aiohttp.ClientResponseError:
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+class ClientStandIn:
+    """ answers per token id: metadata, or an exception raised on the single attempt """
+    def __init__(self, answers: dict):
+        self.answers = answers
+        self.calls = []
+
+    async def fetch_json(self, url: str):
+        m_id = int(url.rsplit('id=', 1)[-1])
+        self.calls.append(m_id)
+        answer = self.answers[m_id]
+        if isinstance(answer, Exception):
+            raise answer
+        return dict(answer)
+
+
+class AdaptiveLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_halve_on_throttling_and_grow_on_success(self):
+        limiter = AdaptiveLimiter(initial=8, maximum=9, increase_every=2, cooldown=0.05)
+        await limiter.acquire()
+        await limiter.release(throttled=True)
+        assert limiter.limit == 4
+
+        started = asyncio.get_running_loop().time()
+        await limiter.acquire()
+        # new requests wait for the cooldown after throttling
+        assert asyncio.get_running_loop().time() - started >= 0.04
+        await limiter.release()
+        for _ in range(2):
+            await limiter.acquire()
+            await limiter.release()
+        assert limiter.limit == 5
+
+        limiter = AdaptiveLimiter(initial=1, minimum=1)
+        await limiter.acquire()
+        await limiter.release(throttled=True)
+        assert limiter.limit == 1
+
+    async def test_in_flight_bounded_by_limit(self):
+        limiter = AdaptiveLimiter(initial=2)
+        peak = 0
+
+        async def request():
+            nonlocal peak
+            await limiter.acquire()
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+            await limiter.release()
+
+        await asyncio.gather(*(request() for _ in range(10)))
+        assert peak == 2 and limiter.in_flight == 0
+
+    def test_throttled_errors(self):
+        assert is_throttled(response_error(429)) and is_throttled(response_error(503))
+        assert is_throttled(asyncio.TimeoutError())
+        assert not is_throttled(response_error(404)) and not is_throttled(ValueError())
+
+
+class CrawlTest(unittest.IsolatedAsyncioTestCase):
+    async def test_only_fetch_errors_are_failures(self):
+        client = ClientStandIn({1: {'id': '1', 'name': 'unopened booster'}, 2: response_error(429),
+                                3: OPENED, 4: {'name': 'no id'}})
+        limiter = AdaptiveLimiter(initial=4, cooldown=0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metadata.jsonl')
+            with SnapshotWriter(path) as writer, tqdm(disable=True) as progress:
+                for m_id in (1, 2, 3, 4):
+                    await crawl_one(client, limiter, writer, m_id, progress)
+
+            assert client.calls == [1, 2, 3, 4]
+            assert limiter.limit == 2
+            assert snapshot_ids(path) == {1, 3, 4} and failed_ids(path) == {2}
+            assert [m.id for m in iter_snapshot(path)] == ['3']
+
+
+class ResumeTest(unittest.TestCase):
+    def test_resume_and_retry_failed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metadata.jsonl')
+            assert ids_to_crawl(path, 1, 5) == [1, 2, 3, 4, 5]
+            with SnapshotWriter(path) as writer:
+                writer.write({'id': '2'})
+                writer.write({'id': 4})
+                writer.write_failure(3, "timeout")
+                writer.write_failure(5, "timeout")
+                # retried later with success
+                writer.write({'id': '5'})
+            with open(path, 'a') as f:
+                f.write('{"id": "1", "trunc')
+
+            assert ids_to_crawl(path, 1, 5) == [1, 3]
+            assert ids_to_crawl(path, 1, 5, retry_failed=True) == [3]
+
+    def test_resume_after_cut_off_write(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metadata.jsonl')
+            with SnapshotWriter(path) as writer:
+                writer.write({'id': '1'})
+                writer.write_failure(2, "timeout")
+            for p in (path, path + '.failed'):
+                with open(p, 'a') as f:
+                    f.write('{"id": "9", "trunc')
+
+            with SnapshotWriter(path) as writer:
+                writer.write({'id': '3'})
+                writer.write_failure(4, "timeout")
+            assert snapshot_ids(path) == {1, 3} and failed_ids(path) == {2, 4}
+
+            with open(path, 'w') as f:
+                f.write('x' * 10000)
+            truncate_partial_line(path, chunk=16)
+            assert os.path.getsize(path) == 0
@@ -1,12 +1,19 @@
 import typing
+import functools
 import requests
 import json
+import time
+import backoff
+from concurrent.futures import ThreadPoolExecutor
 from web3 import Web3
 import os
 import logging
-from enum import Enum
-from dataclasses import dataclass
-from scvfeed.exceptions import FilterNotFoundError
+from scvfeed import metrics
+from scvfeed.exceptions import FilterNotFoundError, AbiError
+from scvfeed.checkpoint import Checkpoint
+from scvfeed.dedup import DedupIndex
+from scvfeed.subscription import LogSubscription
+from scvfeed.decoder import PMON_TOKEN_TOPIC, TradeSide, OfferInfo, decode_offers
 
 
 logger = logging.getLogger(__name__)
@@ -19,94 +26,241 @@ stake_abi = [{"name": "stake",
               "type": "function"}]
 
 
+@functools.lru_cache(maxsize=8)
 def get_bsc_abi(address: str):
     abi_endpoint = f"https://api.bscscan.com/api?module=contract&action=getabi&address={address}"
-    abi = json.loads(requests.get(abi_endpoint).json()['result'])
+    result = requests.get(abi_endpoint).json()['result']
+    try:
+        abi = json.loads(result)
+    except ValueError as e:
+        # bscscan answers a message in place of the abi, e.g. for unverified contracts
+        raise AbiError(f"no abi for {address}: {result}") from e
     return abi
 
 
-PMON_TOKEN_TOPIC = '0x00000000000000000000000085f0e02cb992aa1f9f47112f815f519ef1a59e2d'
+def abi_entry(abi: list, kind: str, name: str) -> dict:
+    """ :param kind: event or function """
+    for entry in abi:
+        if entry.get('type') == kind and entry.get('name') == name:
+            return entry
+    raise AbiError(f"{kind} {name} not in the contract abi")
 
 
-class TradeSide(Enum):
-    SELL = 1
-    BUY = 2
+def abi_signature(entry: dict) -> str:
+    types = [i['type'] for i in entry['inputs']]
+    if any(t.startswith('tuple') for t in types):
+        raise AbiError(f"struct arguments of {entry['name']} are not supported")
+    return f"{entry['name']}({','.join(types)})"
 
-    @classmethod
-    def of(cls, side: int):
-        return cls.SELL if side == cls.SELL.value else cls.BUY
 
-    def __str__(self):
-        return 'SELL' if self == TradeSide.SELL else 'BUY'
+NEW_OFFER_EVT = 'EvNewOffer(address,address,uint256,uint256,uint8,uint256)'
+NEW_OFFER_TOPIC = Web3.sha3(text=NEW_OFFER_EVT).hex()
+
+
+def token_topic(token_id: int) -> str:
+    return '0x{:064x}'.format(token_id)
+
+
+def new_offer_topics(token_ids: typing.Iterable[int] = None) -> list:
+    """
+    node side filter of EvNewOffer logs: polkamon offers only, of the given tokens if any
+    topics are [signature, user, nft, tokenId], None matches anything and a list any of its items
+    """
+    topics = [NEW_OFFER_TOPIC, None, PMON_TOKEN_TOPIC]
+    if token_ids:
+        topics.append([token_topic(t) for t in token_ids])
+    return topics
 
 
 BSC_PROVIDER = os.getenv("BSC_PROVIDER", "wss://bsc-ws-node.nariox.org:443")
 
 
-@dataclass
-class OfferInfo:
-    token_id: int
-    side: TradeSide
-    price: int
-    tx: str
+def block_ranges(start: int, end: int, size: int) -> typing.List[typing.Tuple[int, int]]:
+    """ inclusive [from, to] ranges of at most `size` blocks covering start..end """
+    return [(first, min(first + size - 1, end)) for first in range(start, end + 1, size)]
+
+
+def fetch_logs(get_logs: typing.Callable, log_filter: dict, start: int, end: int,
+               chunk_blocks: int = 2000, workers: int = 4) -> list:
+    """
+    eth_getLogs over start..end split in chunks fetched in parallel
+    :return: logs in chain order
+    """
+    @backoff.on_exception(backoff.expo, Exception, max_tries=5)
+    def get_chunk(block_range):
+        return get_logs({**log_filter, 'fromBlock': block_range[0], 'toBlock': block_range[1]})
 
-    def __eq__(self, other):
-        return self.tx == other.tx
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(get_chunk, block_ranges(start, end, chunk_blocks))
+        return [log for chunk in chunks for log in chunk]
+
+
+class BlockClock:
+    """ timestamps of recent blocks, looked up once each """
+    def __init__(self, get_block: typing.Callable, maxsize: int = 1024):
+        self.get_block = get_block
+        self.timestamp = functools.lru_cache(maxsize=maxsize)(self._timestamp)
+
+    def _timestamp(self, block_number: int) -> int:
+        return self.get_block(block_number)['timestamp']
+
+    def lag(self, block_number: int, at: float = None) -> float:
+        """ seconds from the block to `at`, now by default """
+        return (at if at is not None else time.time()) - self.timestamp(block_number)
 
 
-# EvNewOffer (
-#   index_topic_1 address user,
-#   index_topic_2 address nft,
-#   index_topic_3 uint256 tokenId,
-#   uint256 price,
-#   uint8 side,
-#   uint256 id
-# )
 class ScvBlockSearch:
     CONTRACT = '0x9437E3E2337a78D324c581A4bFD9fe22a1aDBf04'
-    NEW_OFFER_EVT = 'EvNewOffer(address,address,uint256,uint256,uint8,uint256)'
+    NEW_OFFER_EVT = NEW_OFFER_EVT
     TOKEN_DECIMAL = 1E18
+    POLL_INTERVAL = 0.5
+    # seconds a subscription read waits for the first pushed log
+    PUSH_WAIT = 1
+    # the node drops filters not polled for a few minutes, poll it even while subscribed
+    FILTER_KEEPALIVE = 60
 
-    def __init__(self, provider):
-        if 'wss' in provider:
+    def __init__(self, provider, token_ids: typing.Iterable[int] = None, checkpoint: Checkpoint = None,
+                 backfill_provider: str = None, chunk_blocks: int = 2000, workers: int = 4,
+                 max_backfill_blocks: int = 28800, subscribe: bool = False, dedup: DedupIndex = None):
+        """
+        :param checkpoint: when given, offers missed since its position are backfilled before live ones
+        :param backfill_provider: http endpoint for parallel eth_getLogs, a websocket provider
+                                  serves a single request at a time
+        :param max_backfill_blocks: older gaps are skipped, 28800 blocks is about a day on bsc
+        :param subscribe: with a websocket provider, take logs pushed by eth_subscribe and
+                          poll the filter only while the subscription is down
+        :param dedup: offers already let through, shared across reconnects
+        """
+        if provider.startswith('ws'):
             self.web3 = Web3(Web3.WebsocketProvider(provider))
         else:
             self.web3 = Web3(Web3.HTTPProvider(provider))
-        self.scv_filter = self.web3.eth.filter({
+        self.backfill_web3 = Web3(Web3.HTTPProvider(backfill_provider)) if backfill_provider else self.web3
+        self.token_ids = tuple(token_ids) if token_ids else ()
+        # positions are tracked in memory without a checkpoint file, overlapping sources are deduplicated
+        self.checkpoint = checkpoint if checkpoint is not None else Checkpoint(None)
+        self.dedup = dedup if dedup is not None else DedupIndex()
+        self.chunk_blocks = chunk_blocks
+        self.workers = workers
+        self.kept = 0
+        self.discarded = 0
+        self.duplicates = 0
+        self.backfill_blocks = 0
+        self.backfill_seconds = 0.0
+        self.backfilled = 0
+        self.log_filter = {
             "address": self.CONTRACT,
-            "topics": [Web3.sha3(text=self.NEW_OFFER_EVT).hex()]
-        })
-
-    @classmethod
-    def _handle_new_evt(cls, evt) -> OfferInfo:
-        logger.debug(f"processing {evt}")
-        token_topic = evt['topics'][2].hex()
-        if token_topic == PMON_TOKEN_TOPIC:
-            token_id = int.from_bytes(evt['topics'][3], 'big')
-            data = evt['data'].replace('0x', '')
-            price_hexstr, side_hexstr, _ = [data[i:i + 64] for i in range(0, len(data), 64)]
-            side = TradeSide.of(int(f"0x{side_hexstr}", 16))
-            price = int(f"0x{price_hexstr}", 16)
-            tx = evt['transactionHash'].hex()
-            logger.info("new event %s %d with price %.2f, tx %s", side, token_id, price, tx)
-            return OfferInfo(token_id=token_id, side=side, price=price, tx=tx)
-        return OfferInfo(0, TradeSide.SELL, 0, '')
+            "topics": new_offer_topics(self.token_ids)
+        }
+        # live logs are collected from here, the gap up to the current head is backfilled
+        self.scv_filter = self.web3.eth.filter(self.log_filter)
+        self._polled_at = time.monotonic()
+        self._backfill_range = None
+        if checkpoint is not None and checkpoint.block is not None:
+            head = self.web3.eth.block_number
+            start = max(checkpoint.block, head - max_backfill_blocks)
+            if start > checkpoint.block:
+                logger.warning("gap of %d blocks since the checkpoint, backfill the last %d only",
+                               head - checkpoint.block, max_backfill_blocks)
+            if start <= head:
+                self._backfill_range = (start, head)
 
-    def get_sell_event(self) -> typing.Generator:
+        self.subscription = None
+        self._subscriptions_seen = 0
+        if subscribe and provider.startswith('ws'):
+            self.subscription = LogSubscription(provider, self.log_filter)
+            self.subscription.start()
+
+    @property
+    def poll_interval(self) -> float:
+        """ pause between get_sell_event calls, reads of a live subscription wait by themselves """
+        if self.subscription is not None and self.subscription.connected.is_set():
+            return 0
+        return self.POLL_INTERVAL
+
+    def close(self):
+        if self.subscription is not None:
+            self.subscription.stop()
+
+    def backfill(self) -> typing.List[OfferInfo]:
+        """ offers of the gap between the checkpoint and the live filter, once """
+        if self._backfill_range is None:
+            return []
+        start, end = self._backfill_range
+        started_at = time.monotonic()
+        logs = fetch_logs(self.backfill_web3.eth.get_logs, self.log_filter, start, end,
+                          chunk_blocks=self.chunk_blocks, workers=self.workers)
+        elapsed = time.monotonic() - started_at
+        self._backfill_range = None
+        self.backfill_blocks += end - start + 1
+        self.backfill_seconds += elapsed
+        self.backfilled += len(logs)
+        logger.info("backfilled blocks %d..%d, %d logs in %.1fs (%.0f blocks/s)",
+                    start, end, len(logs), elapsed, (end - start + 1) / elapsed if elapsed else 0)
+        return decode_offers(logs)
+
+    def _poll(self) -> list:
+        self._polled_at = time.monotonic()
         try:
-            new_entries = self.scv_filter.get_new_entries()
+            with metrics.registry.histogram("scv_stage_seconds", stage="get_new_entries").time():
+                return self.scv_filter.get_new_entries()
         except Exception as e:
             logger.exception(str(e))
             raise FilterNotFoundError from e
 
-        # to avoid duplicated event emit
-        last_offer_info = OfferInfo(0, TradeSide.SELL, 0, '')
-        for e in new_entries:
-            try:
-                offer_info = self._handle_new_evt(e)
-            except Exception as e:
-                logging.exception(str(e))
-                continue
-            if offer_info.side == TradeSide.SELL and offer_info != last_offer_info:
-                last_offer_info = offer_info
-                yield offer_info
+    def _new_entries(self) -> list:
+        subscription = self.subscription
+        if subscription is None:
+            return self._poll()
+        entries = []
+        if subscription.connected.is_set() and subscription.subscriptions == self._subscriptions_seen:
+            entries = subscription.get_logs(timeout=self.PUSH_WAIT)
+            # renewed while waiting, logs pushed since must not advance the checkpoint past the gap
+            if subscription.connected.is_set() and subscription.subscriptions == self._subscriptions_seen:
+                if time.monotonic() - self._polled_at > self.FILTER_KEEPALIVE:
+                    entries += self._poll()
+                return entries
+        # subscription down or just renewed, the filter has what was not pushed meanwhile
+        self._subscriptions_seen = subscription.subscriptions
+        return entries + self._poll() + subscription.get_logs()
+
+    def get_sell_event(self) -> typing.Generator:
+        # backfilled offers go first, live ones they overlap are dropped by the checkpoint
+        # on failure nothing is consumed and the backfill is retried on next call
+        backfilled = self.backfill()
+        new_entries = self._new_entries()
+
+        offers = decode_offers(new_entries)
+        self.kept += len(offers)
+        self.discarded += len(new_entries) - len(offers)
+        # pushed and polled logs may interleave
+        offers.sort(key=lambda o: (o.block_number, o.log_index))
+        offers = backfilled + offers
+
+        try:
+            for offer_info in offers:
+                # replays behind the checkpoint (backfill, reconnects) and repeats of reorgs or overlapping sources
+                if self.checkpoint.is_processed(offer_info.block_number, offer_info.log_index) \
+                        or self.dedup.seen(offer_info.tx, offer_info.log_index):
+                    self.duplicates += 1
+                    continue
+                self.checkpoint.advance(offer_info.block_number, offer_info.log_index)
+                logger.info("new event %s %d with price %d, tx %s",
+                            offer_info.side, offer_info.token_id, offer_info.price, offer_info.tx)
+                if offer_info.side == TradeSide.SELL:
+                    yield offer_info
+        finally:
+            self.checkpoint.save()
+
+    def stats(self) -> dict:
+        return {
+            'kept': self.kept,
+            'discarded': self.discarded,
+            'duplicates': self.duplicates,
+            'dedup': self.dedup.stats(),
+            'checkpoint': self.checkpoint.position,
+            'backfill_blocks': self.backfill_blocks,
+            'backfilled': self.backfilled,
+            'backfill_blocks_per_second': self.backfill_blocks / self.backfill_seconds if self.backfill_seconds else 0,
+            'subscription': self.subscription.stats() if self.subscription is not None else None,
+        }
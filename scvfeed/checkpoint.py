@@ -0,0 +1,61 @@
+import os
+import json
+import logging
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    position (block number, log index) of the last processed log, persisted in a small json file
+    the file is replaced atomically so a crash leaves either the old or the new position,
+    without path the position is kept in memory only
+    """
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.position: Optional[Tuple[int, int]] = self._load()
+        self._saved = self.position
+
+    def _load(self) -> Optional[Tuple[int, int]]:
+        if self.path is None:
+            return None
+        try:
+            with open(self.path, 'r') as f:
+                record = json.load(f)
+            return int(record['block']), int(record['log_index'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"ignore unreadable checkpoint {self.path}: {e}")
+            return None
+
+    @property
+    def block(self) -> Optional[int]:
+        return self.position[0] if self.position else None
+
+    def is_processed(self, block: int, log_index: int) -> bool:
+        return self.position is not None and (block, log_index) <= self.position
+
+    def advance(self, block: int, log_index: int):
+        if not self.is_processed(block, log_index):
+            self.position = (block, log_index)
+
+    def detached(self) -> 'Checkpoint':
+        """ in-memory copy of the position, advancing it leaves this checkpoint and its file alone """
+        checkpoint = Checkpoint(None)
+        checkpoint.position = self.position
+        return checkpoint
+
+    def save(self):
+        if self.path is None or self.position is None or self.position == self._saved:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'block': self.position[0], 'log_index': self.position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._saved = self.position
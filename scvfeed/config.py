@@ -42,8 +42,58 @@ rules = (
          max_price_bnb=15),
 )
 
+# rules above are used until this file is loaded
+RULES_PATH = os.getenv("SCV_RULES_PATH", "conf/rules.yml")
+RULES_RELOAD_INTERVAL = int(os.getenv("SCV_RULES_RELOAD_INTERVAL", "5"))
+
 BSC_PROVIDER = os.getenv("BSC_PROVIDER", "wss://bsc-ws-node.nariox.org:443")
+# comma separated, raced against each other when several, the first one keeps the checkpoint
+BSC_PROVIDERS = [p.strip() for p in os.getenv("BSC_PROVIDERS", BSC_PROVIDER).split(",") if p.strip()]
+PROVIDER_MAX_LAG = float(os.getenv("SCV_PROVIDER_MAX_LAG", "2"))
+PROVIDER_COOLDOWN = int(os.getenv("SCV_PROVIDER_COOLDOWN", "300"))
+# listings seen in pending transactions, off unless a websocket node is given
+MEMPOOL_PROVIDER = os.getenv("SCV_MEMPOOL_PROVIDER")
+MEMPOOL_FULL_TX = os.getenv("SCV_MEMPOOL_FULL_TX", "0") == "1"
+MEMPOOL_PENDING_TTL = int(os.getenv("SCV_MEMPOOL_PENDING_TTL", "120"))
+# hashes waiting for a lookup without SCV_MEMPOOL_FULL_TX, the oldest are dropped beyond it
+MEMPOOL_LOOKUP_QUEUE = int(os.getenv("SCV_MEMPOOL_LOOKUP_QUEUE", "256"))
+# name of the listing function, read with its arguments from the contract abi,
+# the only function taking a token id and a price when empty
+LISTING_METHOD = os.getenv("SCV_LISTING_METHOD", "").strip()
+# comma separated roles of its arguments (nft, token_id, price, side, _), guessed from their names when empty
+LISTING_ARGS = [a.strip() for a in os.getenv("SCV_LISTING_ARGS", "").split(",") if a.strip()]
+# live order book of listings, for floor prices in alerts and the bot
+ORDERBOOK = os.getenv("SCV_ORDERBOOK", "0") == "1"
+# comma separated names of the events closing an offer, read with the offer id position from the contract abi,
+# every event carrying the offer id when empty
+CLOSING_EVTS = [e.strip() for e in os.getenv("SCV_CLOSING_EVTS", "").split(",") if e.strip()]
+ORDERBOOK_FROM_BLOCK = int(os.environ["SCV_ORDERBOOK_FROM_BLOCK"]) if os.getenv("SCV_ORDERBOOK_FROM_BLOCK") else None
+# about a month of bsc blocks replayed on start when no first block is given
+ORDERBOOK_SYNC_BLOCKS = int(os.getenv("SCV_ORDERBOOK_SYNC_BLOCKS", "864000"))
+# comma separated token ids, only their offers are sent by the node when set
+TOKEN_ALLOWLIST = tuple(int(t) for t in os.getenv("SCV_TOKEN_ALLOWLIST", "").split(",") if t.strip())
+# offers missed while disconnected or stopped are backfilled from the last processed log
+CHECKPOINT_PATH = os.getenv("SCV_CHECKPOINT_PATH", "cache/scvfeed_checkpoint.json")
+BSC_BACKFILL_PROVIDER = os.getenv("BSC_BACKFILL_PROVIDER", "https://bsc-dataseed.binance.org/")
+BACKFILL_CHUNK_BLOCKS = int(os.getenv("SCV_BACKFILL_CHUNK_BLOCKS", "2000"))
+BACKFILL_WORKERS = int(os.getenv("SCV_BACKFILL_WORKERS", "4"))
+BACKFILL_MAX_BLOCKS = int(os.getenv("SCV_BACKFILL_MAX_BLOCKS", "28800"))
+# logs pushed by eth_subscribe over a websocket provider, filter polling stays the fallback
+SUBSCRIBE = os.getenv("SCV_SUBSCRIBE", "1") == "1"
+# bounded queue of every pipeline stage, and how many offers are enriched at once
+PIPELINE_QUEUE_SIZE = int(os.getenv("SCV_PIPELINE_QUEUE_SIZE", "1000"))
+ENRICH_CONCURRENCY = int(os.getenv("SCV_ENRICH_CONCURRENCY", "20"))
+PIPELINE_STATS_INTERVAL = int(os.getenv("SCV_PIPELINE_STATS_INTERVAL", "60"))
+# prometheus text on http://127.0.0.1:<port>/metrics, 0 to disable, and latency summaries in the log
+METRICS_PORT = int(os.getenv("SCV_METRICS_PORT", "9108"))
+METRICS_LOG_INTERVAL = int(os.getenv("SCV_METRICS_LOG_INTERVAL", "300"))
+# offers already alerted, kept across restarts when a path is set
+DEDUP_SIZE = int(os.getenv("SCV_DEDUP_SIZE", "100000"))
+DEDUP_PATH = os.getenv("SCV_DEDUP_PATH")
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# messages per minute and burst allowed per group chat, telegram answers 429 above about 20 per minute
+TELEGRAM_GROUP_RATE = float(os.getenv("SCV_TELEGRAM_GROUP_RATE", "20"))
+TELEGRAM_BURST = int(os.getenv("SCV_TELEGRAM_BURST", "3"))
 TELEGRAM_CHAT_ID = {
     'scvfeed': -1001597613597,
     'hihifeed': -1001532402384,
@@ -0,0 +1,125 @@
+import typing
+import logging
+from enum import Enum
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# EvNewOffer (
+#   index_topic_1 address user,
+#   index_topic_2 address nft,
+#   index_topic_3 uint256 tokenId,
+#   uint256 price,
+#   uint8 side,
+#   uint256 id
+# )
+PMON_TOKEN_TOPIC = '0x00000000000000000000000085f0e02cb992aa1f9f47112f815f519ef1a59e2d'
+PMON_TOKEN = bytes.fromhex(PMON_TOKEN_TOPIC[2:])
+WORD = 32
+WORD_MASK = (1 << 8 * WORD) - 1
+PRICE_SHIFT = 2 * 8 * WORD
+SIDE_SHIFT = 8 * WORD
+# log index of offers seen in pending transactions, not mined yet
+PENDING_LOG_INDEX = -1
+
+
+class TradeSide(Enum):
+    SELL = 1
+    BUY = 2
+
+    @classmethod
+    def of(cls, side: int):
+        return cls.SELL if side == cls.SELL.value else cls.BUY
+
+    def __str__(self):
+        return 'SELL' if self == TradeSide.SELL else 'BUY'
+
+
+@dataclass(eq=False)
+class OfferInfo:
+    __slots__ = ('token_id', 'side', 'price', 'tx', 'offer_id', 'block_number', 'log_index')
+    token_id: int
+    side: TradeSide
+    price: int
+    tx: str
+    offer_id: int
+    block_number: int
+    log_index: int
+
+    def __eq__(self, other):
+        return isinstance(other, OfferInfo) and self.tx == other.tx and self.log_index == other.log_index
+
+    def __hash__(self):
+        return hash((self.tx, self.log_index))
+
+    @property
+    def confirmed(self) -> bool:
+        return self.log_index != PENDING_LOG_INDEX
+
+
+_SELL, _BUY = TradeSide.SELL, TradeSide.BUY
+
+
+def as_bytes(value) -> bytes:
+    """ web3 gives HexBytes, raw json-rpc gives 0x strings """
+    if value.__class__ is str:
+        return bytes.fromhex(value[2:] if value.startswith('0x') else value)
+    return value
+
+
+def _offer(token, data: memoryview, tx: str, block_number: int, log_index: int) -> OfferInfo:
+    if len(data) < 3 * WORD:
+        raise ValueError(f"EvNewOffer data of {len(data)} bytes")
+    # price, side and id words read in one go
+    words = int.from_bytes(data[:3 * WORD], 'big')
+    return OfferInfo(int.from_bytes(token, 'big'),
+                     _SELL if (words >> SIDE_SHIFT) & 0xff == 1 else _BUY,
+                     words >> PRICE_SHIFT,
+                     tx,
+                     words & WORD_MASK,
+                     block_number,
+                     log_index)
+
+
+def _decode_json_rpc(log: dict) -> typing.Optional[OfferInfo]:
+    """ logs straight from json-rpc (eth_subscribe) have every field hex encoded """
+    topics = log['topics']
+    if bytes.fromhex(topics[2][2:]) != PMON_TOKEN:
+        return None
+    return _offer(bytes.fromhex(topics[3][2:]),
+                  memoryview(as_bytes(log['data'])),
+                  log['transactionHash'],
+                  int(log.get('blockNumber') or '0x0', 16),
+                  int(log.get('logIndex') or '0x0', 16))
+
+
+def decode_offer(log) -> typing.Optional[OfferInfo]:
+    """
+    decode a web3 (HexBytes) or raw json-rpc log
+    :return: None for offers of other nfts
+    :raise ValueError: on truncated logs
+    """
+    topics = log['topics']
+    if topics[2].__class__ is str:
+        return _decode_json_rpc(log)
+    if topics[2] != PMON_TOKEN:
+        return None
+    return _offer(topics[3],
+                  memoryview(as_bytes(log['data'])),
+                  '0x' + bytes.hex(log['transactionHash']),
+                  log.get('blockNumber') or 0,
+                  log.get('logIndex') or 0)
+
+
+def decode_offers(logs: typing.Iterable) -> typing.List[OfferInfo]:
+    """ polkamon offers of a batch of logs, broken logs are logged and skipped """
+    offers = []
+    for log in logs:
+        try:
+            offer = decode_offer(log)
+        except Exception as e:
+            logger.exception(f"cannot decode {log}: {e}")
+            continue
+        if offer is not None:
+            offers.append(offer)
+    return offers
@@ -0,0 +1,116 @@
+import os
+import sys
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DedupKey = Tuple[str, int]
+
+
+class DedupIndex:
+    """
+    (tx hash, log index) of the latest offers, an offer is let through once
+
+    the oldest keys are evicted past `maxsize`. With a path, new keys are appended to it
+    and reloaded on start, the file is compacted once it holds twice `maxsize` lines.
+    """
+    def __init__(self, maxsize: int = 100000, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.path = path
+        self._keys: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._file = None
+        self._lines = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            end = 0
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # truncated last line left by a crash, new keys must not be glued onto it
+                        break
+                    end += len(line)
+                    self._lines += 1
+                    try:
+                        tx, log_index = line.decode().split()
+                        self._remember((tx, int(log_index)))
+                    except ValueError:
+                        continue
+            if end < os.path.getsize(self.path):
+                os.truncate(self.path, end)
+            if self._lines > 2 * self.maxsize:
+                self._compact()
+        self._file = open(self.path, 'a')
+
+    def _compact(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            f.writelines(f"{tx} {log_index}\n" for tx, log_index in self._keys)
+        os.replace(tmp, self.path)
+        self._lines = len(self._keys)
+
+    def _remember(self, key: DedupKey):
+        self._keys[key] = None
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+            self.evicted += 1
+
+    def seen(self, tx: str, log_index: int) -> bool:
+        """ :return: whether the key was already let through, it is recorded otherwise """
+        key = (tx, log_index)
+        with self._lock:
+            if key in self._keys:
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._remember(key)
+            if self._file is not None:
+                self._file.write(f"{tx} {log_index}\n")
+                self._file.flush()
+                self._lines += 1
+                if self._lines > 2 * self.maxsize:
+                    self._file.close()
+                    self._compact()
+                    self._file = open(self.path, 'a')
+            return False
+
+    def __contains__(self, key: DedupKey) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def nbytes(self) -> int:
+        """ approximate memory held by the index """
+        size = sys.getsizeof(self._keys)
+        if self._keys:
+            tx, log_index = next(iter(self._keys))
+            size += len(self._keys) * (sys.getsizeof((tx, log_index)) + sys.getsizeof(tx) + sys.getsizeof(log_index))
+        return size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._keys),
+            'hits': self.hits,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'evicted': self.evicted,
+            'bytes': self.nbytes(),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
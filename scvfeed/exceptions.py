@@ -1,3 +1,18 @@
 class FilterNotFoundError(Exception):
     """ new entry filter not found """
     pass
+
+
+class InvalidRuleError(Exception):
+    """ rule file cannot be loaded """
+    pass
+
+
+class SubscriptionError(Exception):
+    """ node refused the log subscription """
+    pass
+
+
+class AbiError(Exception):
+    """ contract abi is unavailable or lacks an expected entry """
+    pass
@@ -0,0 +1,91 @@
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from datatypes import Type, Horn, Color, Attribute, Metadata
+from scvfeed.models import Rule
+
+logger = logging.getLogger(__name__)
+
+
+def _resolve(trait, value: str):
+    """ :return: trait member, None when it cannot be resolved so only unconstrained rules match """
+    try:
+        return trait.of(value)
+    except NotImplementedError:
+        return None
+
+
+class RuleMatcher:
+    """
+    rules compiled into per-trait bitmasks, bit i is set when rule i admits the trait value
+
+    an offer is only checked against the rules admitting all its traits, in declared order,
+    cheap price checks run before the score. The first matching rule is the same as
+    evaluating Rule.is_worth_buying one by one.
+    """
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = tuple(rules)
+        self._compiled = tuple((r, r.max_price_bnb, r.min_score_per_bnb) for r in self.rules)
+        self.type_masks = self._trait_masks(Type, 'type')
+        self.horn_masks = self._trait_masks(Horn, 'horn')
+        self.color_masks = self._trait_masks(Color, 'color')
+        self.glitter_masks = self._flag_masks('glitter')
+        self.special_masks = self._flag_masks('special')
+        self._candidates: Dict[int, tuple] = {}
+
+    def _mask(self, admits) -> int:
+        mask = 0
+        for i, rule in enumerate(self.rules):
+            if admits(rule):
+                mask |= 1 << i
+        return mask
+
+    def _trait_masks(self, trait, field: str) -> dict:
+        # an empty tuple such as SFType.ALL does not constrain
+        masks = {None: self._mask(lambda r: not getattr(r, field))}
+        for mem in trait:
+            masks[mem] = self._mask(lambda r: not getattr(r, field) or mem in getattr(r, field))
+        return masks
+
+    def _flag_masks(self, field: str) -> dict:
+        return {
+            flag: self._mask(lambda r: getattr(r, field) is None or getattr(r, field) == flag)
+            for flag in (True, False)
+        }
+
+    def candidates(self, attributes: Attribute) -> Tuple[tuple, ...]:
+        """ :return: (rule, max_price_bnb, min_score_per_bnb) of the rules admitting the traits """
+        mask = (self.type_masks[_resolve(Type, attributes.type)]
+                & self.horn_masks[_resolve(Horn, attributes.horn)]
+                & self.color_masks[_resolve(Color, attributes.color)]
+                & self.glitter_masks[bool(attributes.glitter)]
+                & self.special_masks[bool(attributes.special)])
+        candidates = self._candidates.get(mask)
+        if candidates is None:
+            candidates = self._candidates[mask] = tuple(
+                c for i, c in enumerate(self._compiled) if mask >> i & 1)
+        return candidates
+
+    def match(self, price: int, metadata: Metadata) -> Optional[Rule]:
+        price_in_bnb = price / 1E18
+        if not price_in_bnb:
+            # score per bnb is undefined, no rule can be evaluated
+            return None
+
+        score = None
+        for rule, max_price_bnb, min_score_per_bnb in self.candidates(metadata.attributes):
+            if max_price_bnb is not None and not price_in_bnb < max_price_bnb:
+                continue
+            if score is None:
+                try:
+                    score = metadata.rarity_score
+                except Exception as e:
+                    logger.error(f"cannot score {metadata.id}\n{e}")
+                    return None
+            if min_score_per_bnb is not None and not score / price_in_bnb > min_score_per_bnb:
+                continue
+            return rule
+        return None
+
+    def __len__(self) -> int:
+        return len(self.rules)
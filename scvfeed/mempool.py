@@ -0,0 +1,267 @@
+import time
+import typing
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from eth_abi import decode_abi
+from web3 import Web3
+
+import scvfeed.config as config
+from scvfeed.blocksearch import ScvBlockSearch, get_bsc_abi, abi_entry, abi_signature
+from scvfeed.decoder import PMON_TOKEN_TOPIC, PENDING_LOG_INDEX, TradeSide, OfferInfo, as_bytes
+from scvfeed.exceptions import AbiError
+from scvfeed.subscription import Subscription
+
+logger = logging.getLogger(__name__)
+
+PMON_TOKEN_ADDRESS = '0x' + PMON_TOKEN_TOPIC[-40:]
+LISTING_ROLES = ('nft', 'token_id', 'price', 'side', '_')
+
+
+def _hex(value) -> str:
+    if isinstance(value, str):
+        return value
+    return '0x' + bytes.hex(value)
+
+
+class ListingDecoder:
+    """
+    input of a listing call -> unconfirmed OfferInfo
+
+    :param signature: e.g. newOffer(address,uint256,uint256,uint8)
+    :param roles: meaning of each argument, any of nft, token_id, price, side, or _ to ignore it
+    """
+    def __init__(self, signature: str, roles: typing.Sequence[str]):
+        self.signature = signature
+        self.selector = bytes(Web3.keccak(text=signature)[:4])
+        arguments = signature[signature.index('(') + 1:signature.rindex(')')]
+        self.types = [t.strip() for t in arguments.split(',')] if arguments else []
+        self.roles = tuple(r.strip() for r in roles)
+        if len(self.roles) != len(self.types):
+            raise ValueError(f"{len(self.roles)} roles for {len(self.types)} arguments of {signature}")
+        unknown = set(self.roles) - set(LISTING_ROLES)
+        if unknown or not {'token_id', 'price'} <= set(self.roles):
+            raise ValueError(f"roles of {signature} need token_id and price, unknown {', '.join(unknown)}")
+
+    def decode(self, tx_hash: str, calldata) -> typing.Optional[OfferInfo]:
+        """ :return: None for other calls and other nfts """
+        data = as_bytes(calldata)
+        if data[:4] != self.selector:
+            return None
+        values = dict(zip(self.roles, decode_abi(self.types, data[4:])))
+        if 'nft' in values and values['nft'].lower() != PMON_TOKEN_ADDRESS:
+            return None
+        return OfferInfo(token_id=values['token_id'],
+                         side=TradeSide.of(values['side']) if 'side' in values else TradeSide.SELL,
+                         price=values['price'],
+                         tx=tx_hash,
+                         offer_id=0,
+                         block_number=0,
+                         log_index=PENDING_LOG_INDEX)
+
+
+def argument_role(argument: dict) -> str:
+    """ role of a listing call argument guessed from its abi name and type """
+    name = argument['name'].lower().strip('_')
+    if argument['type'] == 'address':
+        return 'nft' if 'nft' in name or name in ('token', 'collection', 'contract') else '_'
+    if not argument['type'].startswith('uint'):
+        return '_'
+    if name in ('tokenid', 'nftid', 'id'):
+        return 'token_id'
+    if 'price' in name:
+        return 'price'
+    if name == 'side':
+        return 'side'
+    return '_'
+
+
+def listing_decoder(abi: list, name: str = '', roles: typing.Sequence[str] = ()) -> ListingDecoder:
+    """
+    decoder of the listing function of the contract abi: the given one, or else the only
+    function taking a token id and a price. Roles default to the ones of the argument names
+
+    :raise AbiError: the function is not in the abi or its arguments cannot be told apart
+    """
+    if name:
+        entries = [abi_entry(abi, 'function', name)]
+    else:
+        entries = [e for e in abi if e.get('type') == 'function'
+                   and {'token_id', 'price'} <= {argument_role(i) for i in e.get('inputs', [])}]
+    if len(entries) != 1:
+        found = ', '.join(e['name'] for e in entries) or 'none'
+        raise AbiError(f"cannot tell the listing function from the contract abi, found {found}")
+    entry = entries[0]
+    if not roles:
+        roles = [argument_role(i) for i in entry['inputs']]
+        named = [r for r in roles if r != '_']
+        if len(named) != len(set(named)):
+            raise AbiError(f"ambiguous arguments of {entry['name']}: {', '.join(roles)}")
+    try:
+        return ListingDecoder(abi_signature(entry), roles)
+    except ValueError as e:
+        raise AbiError(str(e)) from e
+
+
+def decoder_from_config() -> ListingDecoder:
+    """ :raise AbiError: the listing function cannot be read from the contract abi """
+    decoder = listing_decoder(get_bsc_abi(ScvBlockSearch.CONTRACT), config.LISTING_METHOD, config.LISTING_ARGS)
+    logger.info("pending listings decoded from %s as %s", decoder.signature, ", ".join(decoder.roles))
+    return decoder
+
+
+class MempoolWatcher:
+    """
+    sell listings sent to the SCV contract, handed over before they are mined
+
+    pending transactions are pushed by eth_subscribe("newPendingTransactions"), as full
+    transactions when the node supports it, as hashes looked up in a thread pool otherwise.
+    Hashes wait for a lookup in a queue of `lookup_queue`, the oldest are dropped when it is full
+    since their listing, if any, is about to be mined.
+    Listings stay pending until `reconcile` sees their mined log or `pending_ttl` expires.
+    """
+    LAG_SMOOTHING = 0.2
+
+    def __init__(self, provider: str, contract: str, decoder: ListingDecoder, full_tx: bool = False,
+                 pending_ttl: float = 120, lookup_workers: int = 8, lookup_queue: int = 256):
+        self.contract = contract.lower()
+        self.decoder = decoder
+        self.pending_ttl = pending_ttl
+        params = ["newPendingTransactions", True] if full_tx else ["newPendingTransactions"]
+        self.subscription = Subscription(provider, params)
+        if provider.startswith('ws'):
+            self.web3 = Web3(Web3.WebsocketProvider(provider))
+        else:
+            self.web3 = Web3(Web3.HTTPProvider(provider))
+        self.lookup_workers = lookup_workers
+        self._lookups: deque = deque(maxlen=lookup_queue)
+        self._lookups_ready = threading.Condition()
+        self._lookup_threads: typing.List[threading.Thread] = []
+        # tx hash -> first seen, of listings handed over and not mined yet
+        self._pending: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._on_offer = None
+        self.transactions = 0
+        self.detected = 0
+        self.confirmed = 0
+        self.expired = 0
+        self.lookup_errors = 0
+        self.lookups_dropped = 0
+        # moving average of seconds between detection and the mined log
+        self.head_start = 0.0
+
+    def start(self, on_offer: typing.Callable[[OfferInfo], typing.Any]) -> threading.Thread:
+        self._on_offer = on_offer
+        self.subscription.start()
+        thread = threading.Thread(target=self._consume, name="mempool", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+        self.subscription.stop()
+        with self._lookups_ready:
+            self._lookups.clear()
+            self._lookups_ready.notify_all()
+
+    def _consume(self):
+        while not self._stop.is_set():
+            for item in self.subscription.get_items(timeout=1):
+                self.transactions += 1
+                if isinstance(item, str):
+                    self.enqueue_lookup(item)
+                else:
+                    self.inspect(item)
+            self._expire()
+
+    def enqueue_lookup(self, tx_hash: str):
+        with self._lookups_ready:
+            if len(self._lookups) == self._lookups.maxlen:
+                self.lookups_dropped += 1
+            self._lookups.append(tx_hash)
+            if len(self._lookup_threads) < self.lookup_workers:
+                thread = threading.Thread(target=self._look_up, name=f"mempool-lookup-{len(self._lookup_threads)}",
+                                          daemon=True)
+                self._lookup_threads.append(thread)
+                thread.start()
+            self._lookups_ready.notify()
+
+    def _look_up(self):
+        while True:
+            with self._lookups_ready:
+                while not self._lookups and not self._stop.is_set():
+                    self._lookups_ready.wait()
+                if self._stop.is_set():
+                    return
+                tx_hash = self._lookups.popleft()
+            self._lookup(tx_hash)
+
+    def _lookup(self, tx_hash: str):
+        try:
+            tx = self.web3.eth.get_transaction(tx_hash)
+        except Exception as e:
+            # dropped or not propagated to this node yet
+            with self._lock:
+                self.lookup_errors += 1
+            logger.debug(f"cannot look up {tx_hash}: {e}")
+            return
+        self.inspect(tx)
+
+    def inspect(self, tx) -> typing.Optional[OfferInfo]:
+        """ hands over the sell listing of a pending transaction, once """
+        if not tx or not tx.get('to') or tx['to'].lower() != self.contract:
+            return None
+        tx_hash = _hex(tx['hash'])
+        try:
+            offer = self.decoder.decode(tx_hash, tx['input'])
+        except Exception as e:
+            logger.warning(f"cannot decode listing {tx_hash}: {e}")
+            return None
+        if offer is None or offer.side != TradeSide.SELL:
+            return None
+        with self._lock:
+            if tx_hash in self._pending:
+                return None
+            self._pending[tx_hash] = time.monotonic()
+            self.detected += 1
+        logger.info("pending listing %d with price %d, tx %s", offer.token_id, offer.price, tx_hash)
+        if self._on_offer is not None:
+            self._on_offer(offer)
+        return offer
+
+    def reconcile(self, offer: OfferInfo) -> bool:
+        """ :return: whether the mined offer was already handed over while pending """
+        with self._lock:
+            seen_at = self._pending.pop(offer.tx, None)
+            if seen_at is None:
+                return False
+            self.confirmed += 1
+            self.head_start += self.LAG_SMOOTHING * (time.monotonic() - seen_at - self.head_start)
+        return True
+
+    def _expire(self):
+        deadline = time.monotonic() - self.pending_ttl
+        with self._lock:
+            while self._pending:
+                tx_hash, seen_at = next(iter(self._pending.items()))
+                if seen_at > deadline:
+                    break
+                self._pending.popitem(last=False)
+                self.expired += 1
+                logger.info(f"pending listing {tx_hash} never mined")
+
+    def stats(self) -> dict:
+        return {
+            'transactions': self.transactions,
+            'detected': self.detected,
+            'confirmed': self.confirmed,
+            'expired': self.expired,
+            'pending': len(self._pending),
+            'head_start': self.head_start,
+            'lookup_errors': self.lookup_errors,
+            'lookups_queued': len(self._lookups),
+            'lookups_dropped': self.lookups_dropped,
+            'subscription': self.subscription.stats(),
+        }
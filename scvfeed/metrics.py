@@ -0,0 +1,218 @@
+import re
+import time
+import typing
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a cached lookup to a slow node
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    """ observations counted in cumulative buckets, quantiles are estimated from the bucket bounds """
+    def __init__(self, buckets: typing.Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at)
+
+    def quantile(self, q: float) -> float:
+        """ upper bound of the bucket holding the q-th observation, inf past the last bucket """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return 0.0
+
+    def cumulative(self) -> typing.List[typing.Tuple[float, int]]:
+        seen = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            result.append((bound, seen))
+        return result
+
+
+class Registry:
+    """
+    metrics by name and labels, plus `stats()` of components flattened into gauges on collection
+
+    usage:
+        with registry.histogram("scv_stage_seconds", "time spent per stage", stage="enrich").time():
+            ...
+    """
+    def __init__(self):
+        self._metrics: typing.Dict[str, typing.Tuple[str, str, dict]] = {}
+        self._collectors: typing.Dict[str, typing.Callable[[], dict]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, factory: typing.Callable, name: str, help: str, labels: dict):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            _, known_help, children = self._metrics.setdefault(name, (kind, help, {}))
+            if help and not known_help:
+                self._metrics[name] = (kind, help, children)
+            metric = children.get(key)
+            if metric is None:
+                metric = children[key] = factory()
+        return metric
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get("counter", Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str = "", **labels) -> Gauge:
+        return self._get("gauge", Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str = "", **labels) -> Histogram:
+        return self._get("histogram", Histogram, name, help, labels)
+
+    def collect(self, prefix: str, stats: typing.Callable[[], dict]):
+        """ numbers of `stats()`, nested dicts included, are exported as <prefix>_<key> gauges """
+        self._collectors[prefix] = stats
+
+    def _collected(self) -> typing.Iterator[typing.Tuple[str, float]]:
+        def flatten(prefix: str, stats: dict):
+            for key, value in stats.items():
+                name = f"{prefix}_{_name(str(key))}"
+                if isinstance(value, dict):
+                    yield from flatten(name, value)
+                elif isinstance(value, (bool, int, float)):
+                    yield name, float(value)
+
+        for prefix, stats in list(self._collectors.items()):
+            try:
+                yield from flatten(prefix, stats() or {})
+            except Exception as e:
+                logger.warning(f"cannot collect {prefix}: {e}")
+
+    def render(self) -> str:
+        """ prometheus text exposition format """
+        lines = []
+        with self._lock:
+            metrics = [(name, kind, help, dict(children)) for name, (kind, help, children) in self._metrics.items()]
+        for name, kind, help, children in metrics:
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in children.items():
+                if kind != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {metric.value}")
+                    continue
+                for bound, count in metric.cumulative():
+                    le = "+Inf" if bound == float('inf') else str(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {metric.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {metric.count}")
+        for name, value in self._collected():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """ one line per histogram with observations: count, mean, p50 and p95 """
+        lines = []
+        with self._lock:
+            histograms = [(name, dict(children)) for name, (kind, _, children) in self._metrics.items()
+                          if kind == "histogram"]
+        for name, children in histograms:
+            for labels, h in children.items():
+                if h.count:
+                    lines.append("{}{} n={} mean={:.3f}s p50<={}s p95<={}s".format(
+                        name, _labels(labels), h.count, h.sum / h.count, h.quantile(0.5), h.quantile(0.95)))
+        return "\n".join(lines)
+
+
+registry = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = registry
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scraped every few seconds, not worth a log line
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1", reg: Registry = registry) -> ThreadingHTTPServer:
+    """ serves /metrics from a daemon thread """
+    handler = type("MetricsHandler", (_MetricsHandler,), {'registry': reg})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("serving metrics on http://%s:%d/metrics", host, server.server_port)
+    return server
+
+
+def log_summary(interval: float, reg: Registry = registry) -> threading.Thread:
+    def run():
+        while True:
+            time.sleep(interval)
+            summary = reg.summary()
+            if summary:
+                logger.info("latency summary\n%s", summary)
+
+    thread = threading.Thread(target=run, name="metrics-summary", daemon=True)
+    thread.start()
+    return thread
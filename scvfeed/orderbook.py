@@ -0,0 +1,320 @@
+import time
+import typing
+import logging
+import threading
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from web3 import Web3
+
+from datatypes import Attribute, Type, Horn, Color, Glitter
+from helpers import FilterBuilder
+from utils import get_metadata
+import scvfeed.config as config
+from scvfeed.blocksearch import ScvBlockSearch, NEW_OFFER_TOPIC, fetch_logs, get_bsc_abi, abi_entry, abi_signature
+from scvfeed.exceptions import AbiError
+from scvfeed.decoder import TradeSide, WORD, decode_offer, as_bytes
+
+logger = logging.getLogger(__name__)
+
+# (type, horn, color, glitter), None matches any
+TraitKey = typing.Tuple[typing.Optional[Type], typing.Optional[Horn], typing.Optional[Color],
+                        typing.Optional[Glitter]]
+
+
+def _trait(trait, value):
+    try:
+        return trait.of(value)
+    except NotImplementedError:
+        return None
+
+
+def trait_key(attributes: Attribute) -> TraitKey:
+    return (_trait(Type, attributes.type), _trait(Horn, attributes.horn), _trait(Color, attributes.color),
+            Glitter.of(attributes.glitter))
+
+
+def filter_key(filter_builder: FilterBuilder) -> TraitKey:
+    return filter_builder.type, filter_builder.horn, filter_builder.color, filter_builder.glitter
+
+
+def patterns(key: TraitKey) -> typing.Set[TraitKey]:
+    """ the 16 combinations of known traits and wildcards a listing is found under """
+    return {tuple(value if mask >> i & 1 else None for i, value in enumerate(key)) for mask in range(16)}
+
+
+@dataclass(eq=False)
+class Listing:
+    __slots__ = ('offer_id', 'token_id', 'price', 'key')
+    offer_id: int
+    token_id: int
+    price: int
+    key: TraitKey
+
+
+class OrderBook:
+    """
+    active sell listings, for every trait pattern a list sorted by price
+
+    floor is the head of a list and the n cheapest a slice of it, lookups of a pattern are a dict get.
+    Adding or removing a listing updates the 16 lists it belongs to, by bisection.
+    """
+    def __init__(self):
+        self._listings: typing.Dict[int, Listing] = {}
+        self._books: typing.Dict[TraitKey, list] = {}
+        self._lock = threading.Lock()
+
+    def add(self, offer_id: int, token_id: int, price: int, attributes: Attribute):
+        listing = Listing(offer_id, token_id, price, trait_key(attributes))
+        with self._lock:
+            self._remove(offer_id)
+            self._listings[offer_id] = listing
+            for pattern in patterns(listing.key):
+                insort(self._books.setdefault(pattern, []), (price, offer_id))
+
+    def _remove(self, offer_id: int) -> typing.Optional[Listing]:
+        listing = self._listings.pop(offer_id, None)
+        if listing is None:
+            return None
+        entry = (listing.price, offer_id)
+        for pattern in patterns(listing.key):
+            book = self._books[pattern]
+            del book[bisect_left(book, entry)]
+            if not book:
+                del self._books[pattern]
+        return listing
+
+    def remove(self, offer_id: int) -> typing.Optional[Listing]:
+        with self._lock:
+            return self._remove(offer_id)
+
+    def cheapest(self, key: TraitKey, n: int = 5, exclude: int = None) -> typing.List[Listing]:
+        with self._lock:
+            book = self._books.get(key, ())
+            offer_ids = [offer_id for _, offer_id in book[:n + 1] if offer_id != exclude][:n]
+            return [self._listings[offer_id] for offer_id in offer_ids]
+
+    def floor(self, key: TraitKey, exclude: int = None) -> typing.Optional[Listing]:
+        """ :param exclude: offer id left out, to compare a new listing with the others """
+        listings = self.cheapest(key, 1, exclude)
+        return listings[0] if listings else None
+
+    def __contains__(self, offer_id: int) -> bool:
+        with self._lock:
+            return offer_id in self._listings
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._listings)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'listings': len(self._listings), 'patterns': len(self._books)}
+
+
+@dataclass(frozen=True)
+class OfferIdEvent:
+    """
+    contract event closing an offer and where its offer id is found
+    :param location: "topic:<n>" for an indexed id, "data:<n>" for the n-th data word
+    """
+    signature: str
+    location: str = "data:0"
+
+    @classmethod
+    def from_abi(cls, entry: dict, offer_id_arg: str) -> 'OfferIdEvent':
+        """ :param offer_id_arg: name of the offer id argument in the event """
+        indexed = [i['name'] for i in entry['inputs'] if i['indexed']]
+        data = [i for i in entry['inputs'] if not i['indexed']]
+        if offer_id_arg in indexed:
+            # topic 0 is the signature
+            return cls(abi_signature(entry), f"topic:{indexed.index(offer_id_arg) + 1}")
+        for word, i in enumerate(data):
+            if i['name'] == offer_id_arg:
+                return cls(abi_signature(entry), f"data:{word}")
+            if i['type'] in ('string', 'bytes') or i['type'].endswith(']'):
+                break
+        raise AbiError(f"cannot locate {offer_id_arg} in {entry['name']}")
+
+    @property
+    def topic(self) -> str:
+        return Web3.keccak(text=self.signature).hex()
+
+    def offer_id(self, log) -> int:
+        place, index = self.location.split(":")
+        if place == 'topic':
+            return int.from_bytes(as_bytes(log['topics'][int(index)]), 'big')
+        data = as_bytes(log['data'])
+        return int.from_bytes(data[int(index) * WORD:(int(index) + 1) * WORD], 'big')
+
+
+class OrderBookWatcher:
+    """
+    keeps an OrderBook in sync with the SCV contract: replays the logs from `from_block`,
+    then polls a filter of new, cancelled and filled offers. On replay only the tokens of
+    offers still open are resolved, `resolve_workers` at a time
+    """
+    POLL_INTERVAL = 1
+
+    def __init__(self, provider: str, contract: str, closing_events: typing.Sequence[OfferIdEvent],
+                 resolve: typing.Callable[[int], typing.Optional[Attribute]], from_block: int = None,
+                 sync_blocks: int = 864000, backfill_provider: str = None, order_book: OrderBook = None,
+                 resolve_workers: int = 16):
+        """
+        :param resolve: token id -> traits, None when unknown
+        :param from_block: first block replayed, `sync_blocks` before the head if omitted
+        """
+        if provider.startswith('ws'):
+            self.web3 = Web3(Web3.WebsocketProvider(provider))
+        else:
+            self.web3 = Web3(Web3.HTTPProvider(provider))
+        self.backfill_web3 = Web3(Web3.HTTPProvider(backfill_provider)) if backfill_provider else self.web3
+        self.contract = contract
+        self.closing = {e.topic: e for e in closing_events}
+        self.resolve = resolve
+        self.from_block = from_block
+        self.sync_blocks = sync_blocks
+        self.resolve_workers = resolve_workers
+        self.order_book = order_book if order_book is not None else OrderBook()
+        self.log_filter = {"address": contract, "topics": [[NEW_OFFER_TOPIC] + list(self.closing)]}
+        self.synced = threading.Event()
+        self._stop = threading.Event()
+        self.added = 0
+        self.closed = 0
+        self.unresolved = 0
+
+    def _closing(self, log) -> typing.Optional[OfferIdEvent]:
+        return self.closing.get('0x' + bytes.hex(as_bytes(log['topics'][0])))
+
+    def apply(self, log, resolved: typing.Dict[int, typing.Optional[Attribute]] = None):
+        """ :param resolved: traits of the tokens listed at the end of a replay, other offers are skipped """
+        event = self._closing(log)
+        if event is not None:
+            if self.order_book.remove(event.offer_id(log)) is not None:
+                self.closed += 1
+            return
+        offer = decode_offer(log)
+        if offer is None or offer.side != TradeSide.SELL:
+            return
+        if resolved is None:
+            attributes = self.resolve(offer.token_id)
+        elif offer.token_id in resolved:
+            attributes = resolved[offer.token_id]
+        else:
+            # closed later in the replay
+            return
+        if attributes is None:
+            self.unresolved += 1
+            return
+        self.order_book.add(offer.offer_id, offer.token_id, offer.price, attributes)
+        self.added += 1
+
+    def _apply_all(self, logs, resolved: typing.Dict[int, typing.Optional[Attribute]] = None):
+        for log in logs:
+            try:
+                self.apply(log, resolved)
+            except Exception as e:
+                logger.warning(f"cannot apply {log}: {e}")
+
+    def _listed_tokens(self, logs) -> typing.Set[int]:
+        """ tokens of the sell offers left open by the logs """
+        listed = {}
+        for log in logs:
+            try:
+                event = self._closing(log)
+                if event is not None:
+                    listed.pop(event.offer_id(log), None)
+                    continue
+                offer = decode_offer(log)
+            except Exception:
+                continue
+            if offer is not None and offer.side == TradeSide.SELL:
+                listed[offer.offer_id] = offer.token_id
+        return set(listed.values())
+
+    def _resolve_quietly(self, token_id: int) -> typing.Optional[Attribute]:
+        try:
+            return self.resolve(token_id)
+        except Exception as e:
+            logger.warning(f"cannot resolve token {token_id}: {e}")
+            return None
+
+    def resolve_all(self, token_ids: typing.Iterable[int]) -> typing.Dict[int, typing.Optional[Attribute]]:
+        token_ids = list(token_ids)
+        with ThreadPoolExecutor(max_workers=self.resolve_workers, thread_name_prefix="order-book-resolve") as pool:
+            return dict(zip(token_ids, pool.map(self._resolve_quietly, token_ids)))
+
+    def sync(self):
+        scv_filter = self.web3.eth.filter(self.log_filter)
+        head = self.web3.eth.block_number
+        start = self.from_block if self.from_block is not None else max(0, head - self.sync_blocks)
+        started_at = time.monotonic()
+        logs = fetch_logs(self.backfill_web3.eth.get_logs, self.log_filter, start, head)
+        resolved = self.resolve_all(self._listed_tokens(logs))
+        self._apply_all(logs, resolved)
+        logger.info("order book synced from block %d in %.1fs, %d logs, %d tokens resolved, %d active listings",
+                    start, time.monotonic() - started_at, len(logs), len(resolved), len(self.order_book))
+        self.synced.set()
+        return scv_filter
+
+    def _watch(self):
+        scv_filter = None
+        while not self._stop.is_set():
+            try:
+                if scv_filter is None:
+                    scv_filter = self.sync()
+                self._apply_all(scv_filter.get_new_entries())
+            except Exception as e:
+                # logs are replayed again on a new filter, applying them twice is harmless
+                logger.exception(f"order book watcher: {e}")
+                scv_filter = None
+            self._stop.wait(self.POLL_INTERVAL)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self._watch, name="order-book", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {**self.order_book.stats(), 'synced': self.synced.is_set(),
+                'added': self.added, 'closed': self.closed, 'unresolved': self.unresolved}
+
+
+def metadata_traits(token_id: int) -> typing.Optional[Attribute]:
+    """ traits of an opened monster from the metadata cache or api """
+    metadata = get_metadata(str(token_id))
+    if not metadata or 'attributes' not in metadata:
+        return None
+    return Attribute.from_metadata(metadata)
+
+
+def closing_events(abi: list, names: typing.Sequence[str] = ()) -> typing.List[OfferIdEvent]:
+    """
+    events of the contract abi closing an offer: the given ones, or else every event
+    carrying the offer id of EvNewOffer, its last argument
+    """
+    offer_id_arg = abi_entry(abi, 'event', 'EvNewOffer')['inputs'][-1]['name']
+    if names:
+        entries = [abi_entry(abi, 'event', name) for name in names]
+    else:
+        entries = [e for e in abi if e.get('type') == 'event' and e['name'] != 'EvNewOffer'
+                   and any(i['name'] == offer_id_arg for i in e['inputs'])]
+    if not entries:
+        raise AbiError(f"no event of the contract abi carries the offer id {offer_id_arg}")
+    return [OfferIdEvent.from_abi(e, offer_id_arg) for e in entries]
+
+
+def watcher_from_config() -> OrderBookWatcher:
+    """ :raise AbiError: closing events cannot be read from the contract abi """
+    events = closing_events(get_bsc_abi(ScvBlockSearch.CONTRACT), config.CLOSING_EVTS)
+    logger.info("order book closes offers on %s", ", ".join(f"{e.signature} {e.location}" for e in events))
+    return OrderBookWatcher(config.BSC_PROVIDERS[0], ScvBlockSearch.CONTRACT,
+                            closing_events=events,
+                            resolve=metadata_traits,
+                            from_block=config.ORDERBOOK_FROM_BLOCK,
+                            sync_blocks=config.ORDERBOOK_SYNC_BLOCKS,
+                            backfill_provider=config.BSC_BACKFILL_PROVIDER)
@@ -0,0 +1,139 @@
+import asyncio
+import typing
+import logging
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class DropPolicy(Enum):
+    # wait for room, slowing down the stage before
+    BLOCK = "block"
+    # a full queue refuses the new item
+    DROP_NEW = "drop_new"
+    # a full queue drops its oldest item for the new one, the freshest listings matter most
+    DROP_OLDEST = "drop_oldest"
+
+
+class Stage:
+    """
+    bounded queue worked by `concurrency` tasks, each item goes through `handler`
+    and its result, unless None, is put to the next stage
+    """
+    def __init__(self, name: str, handler: typing.Callable[[typing.Any], typing.Awaitable],
+                 concurrency: int = 1, maxsize: int = 100, drop: DropPolicy = DropPolicy.BLOCK):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self.drop = drop
+        self.next: typing.Optional['Stage'] = None
+        self.queue: typing.Optional[asyncio.Queue] = None
+        self.busy = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    def open(self):
+        # created here so it binds to the running loop
+        self.queue = asyncio.Queue(self.maxsize)
+
+    async def put(self, item) -> bool:
+        """ :return: whether the item was queued, False when dropped """
+        if self.drop == DropPolicy.BLOCK:
+            await self.queue.put(item)
+        elif self.queue.full():
+            self.dropped += 1
+            if self.drop == DropPolicy.DROP_NEW:
+                logger.warning(f"{self.name} queue full, drop new item")
+                return False
+            self.queue.get_nowait()
+            self.queue.task_done()
+            logger.warning(f"{self.name} queue full, drop oldest item")
+            self.queue.put_nowait(item)
+        else:
+            self.queue.put_nowait(item)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    async def work(self):
+        while True:
+            item = await self.queue.get()
+            self.busy += 1
+            try:
+                result = await self.handler(item)
+                self.processed += 1
+                if result is not None and self.next is not None:
+                    await self.next.put(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.exception(f"{self.name}: {e}")
+            finally:
+                self.busy -= 1
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            'depth': self.queue.qsize() if self.queue is not None else 0,
+            'max_depth': self.max_depth,
+            'maxsize': self.maxsize,
+            'busy': self.busy,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+
+class Pipeline:
+    """
+    stages chained in order, items are put to the first one
+
+    usage:
+        pipeline = Pipeline([Stage("enrich", enrich, concurrency=20), Stage("notify", notify)])
+        await pipeline.start()
+        await pipeline.put(item)
+    """
+    def __init__(self, stages: typing.Sequence[Stage]):
+        self.stages = list(stages)
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next = next_stage
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: typing.List[asyncio.Task] = []
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        for stage in self.stages:
+            stage.open()
+            self._tasks.extend(asyncio.create_task(stage.work(), name=f"{stage.name}-{i}")
+                               for i in range(stage.concurrency))
+
+    async def put(self, item) -> bool:
+        return await self.stages[0].put(item)
+
+    def put_threadsafe(self, item, timeout: float = None) -> bool:
+        """ from another thread, which waits while the first stage applies backpressure """
+        return asyncio.run_coroutine_threadsafe(self.put(item), self.loop).result(timeout)
+
+    async def join(self):
+        """ waits until every stage is idle """
+        for stage in self.stages:
+            await stage.queue.join()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def log_stats(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info("pipeline %s", " ".join(
+                f"{s.name}={s.queue.qsize()}/{s.maxsize}(dropped {s.dropped}, errors {s.errors})"
+                for s in self.stages))
+
+    def stats(self) -> dict:
+        return {stage.name: stage.stats() for stage in self.stages}
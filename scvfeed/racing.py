@@ -0,0 +1,180 @@
+import time
+import queue
+import typing
+import logging
+import threading
+from collections import OrderedDict
+
+from scvfeed.checkpoint import Checkpoint
+from scvfeed.dedup import DedupIndex
+from scvfeed.decoder import OfferInfo
+from scvfeed.exceptions import FilterNotFoundError
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderState:
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.search = None
+        self.wins = 0
+        self.copies = 0
+        # moving average of seconds behind the first provider to deliver the same offer
+        self.lag = 0.0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.demoted_until = 0.0
+        self.demotions = 0
+
+    @property
+    def demoted(self) -> bool:
+        return time.monotonic() < self.demoted_until
+
+    def stats(self) -> dict:
+        delivered = self.wins + self.copies
+        return {
+            'wins': self.wins,
+            'win_rate': self.wins / delivered if delivered else 0,
+            'lag': self.lag,
+            'errors': self.errors,
+            'demoted': self.demoted,
+            'demotions': self.demotions,
+        }
+
+
+class ProviderRace:
+    """
+    consumes the same logs from several providers, one thread each, the first copy of an offer wins
+
+    providers lagging more than `max_lag` seconds on average, or failing `max_errors` times in a row,
+    are left out for `cooldown` seconds, the best provider is never demoted. The checkpoint follows
+    the winning offers whichever provider delivered them. Quacks like ScvBlockSearch for the feed loop.
+    """
+    LAG_SMOOTHING = 0.2
+    PUSH_WAIT = 1
+    poll_interval = 0
+
+    def __init__(self, providers: typing.Sequence[str], make_search: typing.Callable,
+                 dedup: DedupIndex = None, checkpoint: Checkpoint = None, max_lag: float = 2,
+                 max_errors: int = 3, cooldown: float = 300, arrivals_size: int = 10000):
+        """
+        :param make_search: provider, index -> ScvBlockSearch, called again after filter errors
+        :param checkpoint: advanced and saved as winning offers are consumed
+        """
+        self.make_search = make_search
+        self.dedup = dedup if dedup is not None else DedupIndex()
+        self.checkpoint = checkpoint if checkpoint is not None else Checkpoint(None)
+        self.max_lag = max_lag
+        self.max_errors = max_errors
+        self.cooldown = cooldown
+        self.states = [ProviderState(p) for p in providers]
+        self.offers = queue.Queue()
+        # first arrival time of recent offers, to measure the lag of later copies
+        self._arrivals: OrderedDict = OrderedDict()
+        self._arrivals_size = arrivals_size
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._consume, args=(i,), name=f"provider-{i}", daemon=True)
+                         for i in range(len(self.states))]
+        for thread in self._threads:
+            thread.start()
+
+    def _arrive(self, state: ProviderState, offer: OfferInfo):
+        key = (offer.tx, offer.log_index)
+        now = time.monotonic()
+        with self._lock:
+            first = not self.dedup.seen(*key)
+            if first:
+                self._arrivals[key] = now
+                if len(self._arrivals) > self._arrivals_size:
+                    self._arrivals.popitem(last=False)
+                state.wins += 1
+                lag = 0.0
+            else:
+                state.copies += 1
+                lag = now - self._arrivals.get(key, now)
+            state.lag += self.LAG_SMOOTHING * (lag - state.lag)
+        if first:
+            self.offers.put(offer)
+
+    def _best(self) -> ProviderState:
+        return min(self.states, key=lambda s: (s.consecutive_errors, s.lag))
+
+    def _demote(self, state: ProviderState, reason: str):
+        if state is self._best() or state.demoted:
+            return
+        state.demoted_until = time.monotonic() + self.cooldown
+        state.demotions += 1
+        logger.warning("demote %s for %ds: %s", state.provider, self.cooldown, reason)
+        if state.search is not None:
+            state.search.close()
+            state.search = None
+
+    def _consume(self, index: int):
+        state = self.states[index]
+        while not self._stop.is_set():
+            if state.demoted:
+                self._stop.wait(1)
+                continue
+            try:
+                if state.search is None:
+                    state.search = self.make_search(state.provider, index)
+                self._stop.wait(state.search.poll_interval)
+                for offer in state.search.get_sell_event():
+                    self._arrive(state, offer)
+                state.consecutive_errors = 0
+            except FilterNotFoundError:
+                self._fail(state, "filter lost")
+                if state.search is not None:
+                    state.search.close()
+                    state.search = None
+            except Exception as e:
+                logger.exception(f"{state.provider}: {e}")
+                self._fail(state, str(e))
+                self._stop.wait(1)
+
+            if state.lag > self.max_lag:
+                self._demote(state, f"{state.lag:.1f}s behind")
+                if state.demoted:
+                    # measured again from scratch on return
+                    state.lag = 0.0
+
+    def _fail(self, state: ProviderState, reason: str):
+        state.errors += 1
+        state.consecutive_errors += 1
+        if state.consecutive_errors >= self.max_errors:
+            self._demote(state, f"{state.consecutive_errors} errors in a row, last: {reason}")
+            state.consecutive_errors = 0
+
+    def get_sell_event(self) -> typing.Generator:
+        """ winning offers, waits for the first one up to PUSH_WAIT seconds """
+        try:
+            offer = self.offers.get(timeout=self.PUSH_WAIT)
+        except queue.Empty:
+            return
+        try:
+            while True:
+                self.checkpoint.advance(offer.block_number, offer.log_index)
+                yield offer
+                try:
+                    offer = self.offers.get_nowait()
+                except queue.Empty:
+                    return
+        finally:
+            self.checkpoint.save()
+
+    def close(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(5)
+        for state in self.states:
+            if state.search is not None:
+                state.search.close()
+
+    def stats(self) -> dict:
+        return {
+            'dedup': self.dedup.stats(),
+            'checkpoint': self.checkpoint.position,
+            'queued': self.offers.qsize(),
+            'providers': {s.provider: s.stats() for s in self.states},
+        }
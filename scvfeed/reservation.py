@@ -0,0 +1,143 @@
+import logging
+import threading
+from typing import Dict, Iterable, Optional
+
+from datatypes import Metadata, Attribute
+from scvfeed.matcher import RuleMatcher
+
+logger = logging.getLogger(__name__)
+
+TOKEN_DECIMAL = 1E18
+# reservation of tokens some rule matches at any price
+ACCEPT_ALL = 2 ** 256
+# prices are compared in wei against a float bound, keep a margin so a matching offer is never rejected
+ROUNDING_MARGIN = 1e-9
+
+
+def _trait_key(meta: Metadata) -> tuple:
+    a = meta.attributes
+    return a.type, a.horn, a.color, bool(a.glitter), bool(a.special)
+
+
+def _thresholds(candidates: tuple) -> tuple:
+    return tuple((max_price_bnb, min_score_per_bnb) for _, max_price_bnb, min_score_per_bnb in candidates)
+
+
+def reservation_price(score: Optional[int], thresholds: tuple) -> int:
+    """
+    :return: wei price from which no rule fires, any offer at or above it can be rejected
+    """
+    if score is None:
+        return 0
+
+    reservation = 0.0
+    for max_price_bnb, min_score_per_bnb in thresholds:
+        bound = float('inf')
+        if max_price_bnb is not None:
+            bound = max_price_bnb
+        if min_score_per_bnb is not None and min_score_per_bnb > 0:
+            # score / price > min_score_per_bnb
+            bound = min(bound, score / min_score_per_bnb)
+        reservation = max(reservation, bound)
+
+    if reservation == float('inf'):
+        return ACCEPT_ALL
+    return int(reservation * TOKEN_DECIMAL * (1 + ROUNDING_MARGIN)) + 1
+
+
+class ReservationIndex:
+    """
+    token id -> highest wei price at which any rule can fire
+
+    tokens are grouped by traits, on rule changes only the groups whose candidate
+    thresholds changed are recomputed. Unknown tokens are never rejected.
+    """
+    def __init__(self, matcher: RuleMatcher):
+        self.matcher = matcher
+        self._prices: Dict[int, int] = {}
+        # trait key -> (thresholds, {token id: score})
+        self._groups: Dict[tuple, tuple] = {}
+        # writers only, may_fire reads without locking
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.unknown = 0
+        self.recomputed = 0
+
+    def _score(self, meta: Metadata) -> Optional[int]:
+        try:
+            return meta.rarity_score
+        except Exception:
+            # such a token never matches
+            return None
+
+    def add(self, meta: Metadata):
+        key = _trait_key(meta)
+        token_id = int(meta.id)
+        score = self._score(meta)
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = (_thresholds(self.matcher.candidates(meta.attributes)), {})
+            thresholds, scores = group
+            scores[token_id] = score
+            self._prices[token_id] = reservation_price(score, thresholds)
+
+    def extend(self, metas: Iterable[Metadata]):
+        for meta in metas:
+            try:
+                self.add(meta)
+            except Exception as e:
+                logger.warning(f"cannot index {meta.id}: {e}")
+
+    def with_rules(self, matcher: RuleMatcher) -> 'ReservationIndex':
+        """
+        :return: a copy for `matcher`, this index keeps serving the rule set in use meanwhile.
+                 Its `recomputed` is the number of tokens whose reservation changed
+        """
+        index = ReservationIndex(matcher)
+        with self._lock:
+            groups = {key: (thresholds, dict(scores)) for key, (thresholds, scores) in self._groups.items()}
+            index._prices = dict(self._prices)
+            index.accepted, index.rejected, index.unknown = self.accepted, self.rejected, self.unknown
+        for key, (thresholds, scores) in groups.items():
+            type_, horn, color, glitter, special = key
+            attributes = Attribute(born=0, type=type_, horn=horn, color=color, glitter=glitter, special=special)
+            new_thresholds = _thresholds(matcher.candidates(attributes))
+            index._groups[key] = (new_thresholds, scores)
+            if new_thresholds == thresholds:
+                continue
+            for token_id, score in scores.items():
+                index._prices[token_id] = reservation_price(score, new_thresholds)
+            index.recomputed += len(scores)
+        return index
+
+    def reservation(self, token_id: int) -> Optional[int]:
+        return self._prices.get(int(token_id))
+
+    def may_fire(self, token_id: int, price: int) -> bool:
+        """ single integer comparison, True for tokens not indexed yet """
+        reservation = self._prices.get(token_id)
+        if reservation is None:
+            self.unknown += 1
+            return True
+        if price < reservation:
+            self.accepted += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def __contains__(self, token_id) -> bool:
+        return int(token_id) in self._prices
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def stats(self) -> dict:
+        return {
+            'tokens': len(self._prices),
+            'groups': len(self._groups),
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'unknown': self.unknown,
+        }
@@ -0,0 +1,185 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, fields
+from typing import Callable, List, Optional
+
+import yaml
+
+from datatypes import Type, Color, Horn
+from scvfeed.models import Rule, SFType, SFColor, SFHorn
+from scvfeed.matcher import RuleMatcher
+from scvfeed.reservation import ReservationIndex
+from scvfeed.exceptions import InvalidRuleError
+
+logger = logging.getLogger(__name__)
+
+# rule field -> (trait, group class)
+TRAIT_FIELDS = {
+    'type': (Type, SFType),
+    'color': (Color, SFColor),
+    'horn': (Horn, SFHorn),
+}
+FLAG_FIELDS = ('special', 'glitter')
+NUMBER_FIELDS = ('max_price_bnb', 'min_score_per_bnb')
+
+
+def _parse_traits(field: str, value) -> tuple:
+    trait, groups = TRAIT_FIELDS[field]
+    members = ()
+    for item in value if isinstance(value, list) else [value]:
+        if not isinstance(item, str):
+            raise InvalidRuleError(f"{field}: expected a name, got {item!r}")
+        if item.isupper() and hasattr(groups, item):
+            members += getattr(groups, item)
+            continue
+        try:
+            members += (trait.of(item),)
+        except NotImplementedError:
+            raise InvalidRuleError(f"{field}: unknown {item!r}")
+    return members
+
+
+def parse_rule(entry: dict) -> Rule:
+    if not isinstance(entry, dict):
+        raise InvalidRuleError(f"expected a mapping, got {entry!r}")
+    unknown = set(entry) - {f.name for f in fields(Rule)}
+    if unknown:
+        raise InvalidRuleError(f"unknown fields {', '.join(sorted(unknown))}")
+    if not entry.get('name'):
+        raise InvalidRuleError("name is required")
+
+    kwargs = {'name': str(entry['name'])}
+    for field, value in entry.items():
+        if value is None or field == 'name':
+            continue
+        if field in TRAIT_FIELDS:
+            kwargs[field] = _parse_traits(field, value)
+        elif field in FLAG_FIELDS:
+            if not isinstance(value, bool):
+                raise InvalidRuleError(f"{field}: expected true/false, got {value!r}")
+            kwargs[field] = value
+        elif field in NUMBER_FIELDS:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise InvalidRuleError(f"{field}: expected a number, got {value!r}")
+            kwargs[field] = value
+    return Rule(**kwargs)
+
+
+def load_rules(path: str) -> tuple:
+    try:
+        with open(path, 'r') as file:
+            entries = yaml.safe_load(file)['rules']
+    except (OSError, yaml.YAMLError, KeyError, TypeError) as e:
+        raise InvalidRuleError(f"cannot read {path}: {e}") from e
+
+    rules = []
+    for i, entry in enumerate(entries or []):
+        try:
+            rules.append(parse_rule(entry))
+        except InvalidRuleError as e:
+            raise InvalidRuleError(f"{path} rule #{i + 1}: {e}") from e
+    if not rules:
+        raise InvalidRuleError(f"{path} has no rules")
+    return tuple(rules)
+
+
+@dataclass(frozen=True)
+class RuleSet:
+    version: int
+    rules: tuple
+    matcher: RuleMatcher
+    source: str
+    loaded_at: float
+    load_seconds: float
+    # reservation prices for these rules, swapped in together with them
+    reservations: ReservationIndex
+
+
+class RuleSetWatcher:
+    """
+    keeps the current compiled rule set, reloaded in background when the rule file changes
+
+    readers take `current` once per offer, a reload swaps the reference so offers
+    in flight finish against the rule set they started with. The reservation index of
+    the new rules is built from the previous one before the swap
+    """
+    def __init__(self, path: str, fallback: tuple = (), interval: float = 5):
+        self.path = path
+        self.interval = interval
+        self.reload_errors = 0
+        self._mtime = None
+        self._listeners: List[Callable[[RuleSet], None]] = []
+        self._stop = threading.Event()
+        self.current = self._compile(tuple(fallback), version=0, source='config', started_at=time.monotonic(),
+                                     previous=None)
+        self.reload()
+
+    @staticmethod
+    def _compile(rules: tuple, version: int, source: str, started_at: float,
+                 previous: Optional[RuleSet]) -> RuleSet:
+        matcher = RuleMatcher(rules)
+        reservations = ReservationIndex(matcher) if previous is None else previous.reservations.with_rules(matcher)
+        return RuleSet(version=version,
+                       rules=rules,
+                       matcher=matcher,
+                       source=source,
+                       loaded_at=time.time(),
+                       load_seconds=time.monotonic() - started_at,
+                       reservations=reservations)
+
+    def on_reload(self, listener: Callable[[RuleSet], None]):
+        """ listeners run in the reloading thread once the new rule set is in use """
+        self._listeners.append(listener)
+
+    def reload(self) -> bool:
+        """ :return: whether a new rule set is in use """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+
+        started_at = time.monotonic()
+        try:
+            rules = load_rules(self.path)
+        except InvalidRuleError as e:
+            self.reload_errors += 1
+            logger.error(f"keep rule set v{self.current.version}: {e}")
+            return False
+
+        rule_set = self._compile(rules, self.current.version + 1, self.path, started_at, previous=self.current)
+        self.current = rule_set
+        logger.info("rule set v%d loaded from %s, %d rules in %.1f ms, %d reservation prices recomputed",
+                    rule_set.version, rule_set.source, len(rules), rule_set.load_seconds * 1000,
+                    rule_set.reservations.recomputed)
+        for listener in self._listeners:
+            try:
+                listener(rule_set)
+            except Exception as e:
+                logger.exception(f"rule set listener failed: {e}")
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            self.reload()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self._watch, name="rules-watcher", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            'version': self.current.version,
+            'rules': len(self.current.rules),
+            'load_seconds': self.current.load_seconds,
+            'loaded_at': self.current.loaded_at,
+            'reload_errors': self.reload_errors,
+        }
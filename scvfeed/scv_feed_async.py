@@ -1,20 +1,33 @@
-from typing import Iterable
+from typing import Any, Callable, Iterable, Optional, Union
 import os
+import asyncio
 import logging
 import time
-import requests
-import backoff
 from datetime import datetime
+from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor
+from web3 import Web3
 
 from datatypes import Metadata, Type, Horn, Color, Glitter
-from utils import get_metadata
+from utils import get_metadata, metadata_flight, warm_metadata_cache
+from aio_utils import AsyncPolkamonClient
+from metadata_cache import get_metadata_cache
+from snapshot import iter_snapshot
 from helpers import SCVFilterBuilder
 import scvfeed.config as config
 from scvfeed.models import Rule
-from scvfeed.blocksearch import OfferInfo
-from scvfeed.exceptions import FilterNotFoundError
-from scvfeed.blocksearch import ScvBlockSearch
+from scvfeed.matcher import RuleMatcher
+from scvfeed.ruleset import RuleSet, RuleSetWatcher
+from scvfeed.exceptions import FilterNotFoundError, AbiError
+from scvfeed.blocksearch import OfferInfo, ScvBlockSearch, BlockClock
+from scvfeed.checkpoint import Checkpoint
+from scvfeed.dedup import DedupIndex
+from scvfeed.racing import ProviderRace
+from scvfeed.mempool import MempoolWatcher, decoder_from_config
+from scvfeed.orderbook import Listing, trait_key, watcher_from_config
+from scvfeed.pipeline import DropPolicy, Pipeline, Stage
+from scvfeed import metrics
+from scvfeed.sender import TelegramSender
 
 # Enable logging
 log_filename = datetime.now().strftime('log/scvfeed_%Y%m%d.log')
@@ -24,8 +37,19 @@ logging.basicConfig(format='%(asctime)s - {%(filename)s:%(lineno)d} - %(levelnam
                     filemode='a+')
 logger = logging.getLogger(__name__)
 
-BOT_INTRO_TEMPLATE = "Start earning money mode\n" \
-                 "Tracking configuration:\n- {}".format("\n- ".join(map(lambda r: str(r), config.rules)))
+
+def stage_timer(stage: str):
+    return metrics.registry.histogram("scv_stage_seconds", "time spent on an offer per step", stage=stage).time()
+
+
+def lag_histogram(name: str, help: str) -> metrics.Histogram:
+    return metrics.registry.histogram(name, help)
+
+
+def get_intro(rule_set: RuleSet) -> str:
+    return "Start earning money mode\n" \
+           "Tracking configuration v{}:\n- {}".format(rule_set.version,
+                                                      "\n- ".join(map(lambda r: str(r), rule_set.rules)))
 
 
 def get_color_by_spb(spb: int) -> str:
@@ -54,91 +78,292 @@ def get_scv_ref(meta: Metadata):
 
 
 # https://core.telegram.org/bots/api#html-style
-def to_html(meta, price, score, matched_rule: Rule):
+def to_html(meta, price, score, matched_rule: Rule, confirmed: bool = True, floor: Listing = None):
     score_per_bnb = int(score / price * 1E18)
     url = f"https://scv.finance/nft/bsc/0x85F0e02cb992aa1F9F47112F815F519EF1A59E2D/{meta.id}"
     desc = "{} <b>{:.3f}</> BNB\n" \
            "<b>SPB {} {:,}</b>\n" \
            "Score: {:,}".format(
         meta.name, price / 1E18, get_color_by_spb(score_per_bnb), score_per_bnb, score)
+    if floor is not None:
+        desc += "\nFloor {:.3f} BNB (x{:.2f})".format(floor.price / 1E18, price / floor.price)
     scv_ref = get_scv_ref(meta)
+    # seen in a pending transaction, the listing may still fail
+    pending = "" if confirmed else "⏳ <b>PENDING</b> "
     msg = f"<a href='{meta.image}'>.</a>" \
-          f"{desc}\n" \
+          f"{pending}{desc}\n" \
           f"{url}\n" \
           f"========================\n" \
           f"{scv_ref}"
     return msg
 
 
-@backoff.on_exception(backoff.constant,
-                      exception=(requests.exceptions.RequestException,
-                                 requests.exceptions.ConnectTimeout),
-                      max_tries=2)
-def send_msg(msg):
-    params = {
-        'chat_id': config.TELEGRAM_CHAT_ID[os.getenv("TID", "scvfeed")],
-        'text': msg,
-        'parse_mode': 'html'
-    }
-    requests.get("https://api.telegram.org/bot{}/sendMessage".format(
-        config.TELEGRAM_BOT_TOKEN), timeout=2, params=params)
+sender = TelegramSender(config.TELEGRAM_BOT_TOKEN,
+                        group_rate=config.TELEGRAM_GROUP_RATE / 60,
+                        burst=config.TELEGRAM_BURST)
+
+
+def send_msg(msg, urgent: bool = False, on_sent: Callable[[float], Any] = None):
+    """ queued to the sender, alerts are urgent and go before other messages """
+    sender.send(config.TELEGRAM_CHAT_ID[os.getenv("TID", "scvfeed")], msg, parse_mode='html',
+                urgent=urgent, on_sent=on_sent)
+
+
+def parse_all(raws: Iterable[dict]) -> Iterable[Metadata]:
+    for raw in raws:
+        try:
+            yield Metadata.from_metadata(raw)
+        except Exception as e:
+            logger.warning(f"skip unparsable metadata {raw.get('id')}: {e}")
+
+
+@dataclass
+class FeedItem:
+    """ an offer on its way through the pipeline """
+    offer: OfferInfo
+    # the offer is matched against the rule set in use when it arrived, even if reloaded meanwhile
+    rule_set: RuleSet
+    # wall clock time the offer was received
+    detected_at: float = 0.0
+    meta: Metadata = None
+    rule: Rule = None
 
 
 class ScvFeed:
     def __init__(self):
-        self.scv_block_search = ScvBlockSearch(config.BSC_PROVIDER)
+        self.rule_sets = RuleSetWatcher(config.RULES_PATH,
+                                        fallback=config.rules,
+                                        interval=config.RULES_RELOAD_INTERVAL)
+        self.rule_sets.on_reload(self.on_rules_reload)
+        self.checkpoint = Checkpoint(config.CHECKPOINT_PATH)
+        self.dedup = DedupIndex(config.DEDUP_SIZE, config.DEDUP_PATH)
+        self.scv_block_search = self.new_block_search()
+        self.mempool = None
+        if config.MEMPOOL_PROVIDER:
+            # refuses to start rather than miss or misread every pending listing
+            self.mempool = MempoolWatcher(config.MEMPOOL_PROVIDER, ScvBlockSearch.CONTRACT,
+                                          decoder_from_config(),
+                                          full_tx=config.MEMPOOL_FULL_TX,
+                                          pending_ttl=config.MEMPOOL_PENDING_TTL,
+                                          lookup_queue=config.MEMPOOL_LOOKUP_QUEUE)
+        self.order_book_watcher = None
+        if config.ORDERBOOK:
+            try:
+                self.order_book_watcher = watcher_from_config()
+            except AbiError as e:
+                # stale listings would be quoted as floors
+                logger.error(f"order book not started: {e}")
+        self.client = AsyncPolkamonClient(max_in_flight=config.ENRICH_CONCURRENCY)
+        self.block_clock = BlockClock(Web3(Web3.HTTPProvider(config.BSC_BACKFILL_PROVIDER)).eth.get_block)
+        # block timestamps are looked up off the alert path
+        self.lag_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="block-lag")
+        # offers are decoded, deduplicated and checkpointed in order by the block search, before the stages
+        self.pipeline = Pipeline([
+            # cheap, a full queue slows down ingestion and the logs wait at the node or the checkpoint
+            Stage("prefilter", self.prefilter_stage, maxsize=config.PIPELINE_QUEUE_SIZE),
+            # a burst degrades to the freshest listings, older ones are likely sold already
+            Stage("enrich", self.enrich_stage, concurrency=config.ENRICH_CONCURRENCY,
+                  maxsize=config.PIPELINE_QUEUE_SIZE, drop=DropPolicy.DROP_OLDEST),
+            Stage("match", self.match_stage, maxsize=config.PIPELINE_QUEUE_SIZE),
+            # queued to the sender, which paces the chats
+            Stage("notify", self.notify_stage, maxsize=config.PIPELINE_QUEUE_SIZE),
+        ])
+        logger.info("warmed %d cached metadata", warm_metadata_cache())
+        self.load_reservations()
+        self.collect_stats()
+
+    def collect_stats(self):
+        registry = metrics.registry
+        registry.collect("scv_pipeline", self.pipeline.stats)
+        registry.collect("scv_block_search", lambda: self.scv_block_search.stats())
+        registry.collect("scv_reservations", lambda: self.rule_sets.current.reservations.stats())
+        registry.collect("scv_rule_sets", self.rule_sets.stats)
+        registry.collect("scv_metadata_cache", get_metadata_cache().stats)
+        registry.collect("scv_metadata_flight", metadata_flight.stats)
+        registry.collect("scv_async_metadata_flight", self.client.metadata_flight.stats)
+        registry.collect("scv_sender", sender.stats)
+        if self.mempool is not None:
+            registry.collect("scv_mempool", self.mempool.stats)
+        if self.order_book_watcher is not None:
+            registry.collect("scv_order_book", self.order_book_watcher.stats)
+
+    def load_reservations(self):
+        started_at = time.time()
+        reservations = self.rule_sets.current.reservations
+        reservations.extend(iter_snapshot())
+        reservations.extend(parse_all(get_metadata_cache().values()))
+        logger.info("indexed reservation prices of %d tokens in %.1fs",
+                    len(reservations), time.time() - started_at)
+
+    def on_rules_reload(self, rule_set: RuleSet):
+        send_msg(get_intro(rule_set))
+
+    def new_block_search(self) -> Union[ScvBlockSearch, ProviderRace]:
+        if len(config.BSC_PROVIDERS) > 1:
+            return ProviderRace(config.BSC_PROVIDERS, self.new_provider_search,
+                                dedup=self.dedup,
+                                checkpoint=self.checkpoint,
+                                max_lag=config.PROVIDER_MAX_LAG,
+                                cooldown=config.PROVIDER_COOLDOWN)
+        return ScvBlockSearch(config.BSC_PROVIDERS[0], config.TOKEN_ALLOWLIST,
+                              checkpoint=self.checkpoint,
+                              backfill_provider=config.BSC_BACKFILL_PROVIDER,
+                              chunk_blocks=config.BACKFILL_CHUNK_BLOCKS,
+                              workers=config.BACKFILL_WORKERS,
+                              max_backfill_blocks=config.BACKFILL_MAX_BLOCKS,
+                              subscribe=config.SUBSCRIBE,
+                              dedup=self.dedup)
+
+    def new_provider_search(self, provider: str, index: int) -> ScvBlockSearch:
+        """
+        raced providers deliver logs out of order between each other, the race saves the checkpoint
+        from the winning offers. The first provider backfills from a copy of it
+        """
+        return ScvBlockSearch(provider, config.TOKEN_ALLOWLIST,
+                              checkpoint=self.checkpoint.detached() if index == 0 else None,
+                              backfill_provider=config.BSC_BACKFILL_PROVIDER,
+                              chunk_blocks=config.BACKFILL_CHUNK_BLOCKS,
+                              workers=config.BACKFILL_WORKERS,
+                              max_backfill_blocks=config.BACKFILL_MAX_BLOCKS,
+                              subscribe=config.SUBSCRIBE)
 
     def reconnect(self):
         logger.info("reconnecting...")
-        self.scv_block_search = ScvBlockSearch(config.BSC_PROVIDER)
+        # offers emitted while the filter was dead are backfilled from the checkpoint
+        self.scv_block_search.close()
+        self.scv_block_search = self.new_block_search()
 
     @classmethod
     def get_matched_rule(
-            cls, price: int, metadata: Metadata, rul3s: Iterable[Rule]) -> Rule:
-        price_in_bnb = price / 1E18
+            cls, price: int, metadata: Metadata, rul3s: Union[RuleMatcher, Iterable[Rule]]) -> Rule:
+        matcher = rul3s if isinstance(rul3s, RuleMatcher) else RuleMatcher(rul3s)
+        rule = matcher.match(price, metadata)
+        if rule:
+            logger.info(f"worth buying monster {rule}")
+        return rule
+
+    def get_floor(self, meta: Metadata, sell_offer: OfferInfo) -> Optional[Listing]:
+        """ cheapest other listing of the same type, horn, color and glitter """
+        if self.order_book_watcher is None or not self.order_book_watcher.synced.is_set():
+            return None
+        return self.order_book_watcher.order_book.floor(trait_key(meta.attributes), exclude=sell_offer.offer_id)
+
+    def prefilter(self, item: FeedItem) -> bool:
+        sell_offer = item.offer
+        # already handled from the pending transaction
+        if sell_offer.confirmed and self.mempool is not None and self.mempool.reconcile(sell_offer):
+            return False
+        # most offers are too expensive for every rule, drop them before fetching metadata.
+        # Checked against the rule set the offer is matched with, even if reloaded meanwhile
+        with stage_timer("prefilter"):
+            return item.rule_set.reservations.may_fire(sell_offer.token_id, sell_offer.price)
+
+    def match(self, meta: Metadata, sell_offer: OfferInfo, rule_set: RuleSet) -> Rule:
+        with stage_timer("get_matched_rule"):
+            # a token indexed after a reload is unknown to the new rule set, which never rejects it
+            rule_set.reservations.add(meta)
+            return self.get_matched_rule(sell_offer.price, meta, rule_set.matcher)
 
-        for rule in rul3s:
+    def notify(self, item: FeedItem):
+        msg = to_html(item.meta, item.offer.price, item.meta.rarity_score, item.rule, item.offer.confirmed,
+                      floor=self.get_floor(item.meta, item.offer))
+        send_msg(msg, urgent=True, on_sent=lambda sent_at: self.notified(item, sent_at))
+
+    def notified(self, item: FeedItem, sent_at: float):
+        metrics.registry.counter("scv_alerts_total", "alerts sent").inc()
+        lag_histogram("scv_detect_to_notify_seconds", "offer received to alert sent") \
+            .observe(sent_at - item.detected_at)
+        self.lag_executor.submit(self.record_lag,
+                                 lag_histogram("scv_block_to_notify_seconds", "block timestamp to alert sent"),
+                                 [item.offer], sent_at)
+
+    def new_item(self, sell_offer: OfferInfo) -> FeedItem:
+        metrics.registry.counter("scv_offers_total", "sell offers received").inc()
+        return FeedItem(sell_offer, self.rule_sets.current, detected_at=time.time())
+
+    def record_lag(self, histogram: metrics.Histogram, offers: Iterable[OfferInfo], at: float):
+        """ blocks are looked up once each """
+        for block_number in {o.block_number for o in offers if o.confirmed}:
             try:
-                if rule.is_worth_buying(price_in_bnb, metadata):
-                    logger.info(f"worth buying monster {rule}")
-                    return rule
+                histogram.observe(self.block_clock.lag(block_number, at))
             except Exception as e:
-                logger.error(f"encountered exception {rule}\n{e}")
-                pass
-        return None
+                logger.debug(f"cannot get timestamp of block {block_number}: {e}")
 
-    @classmethod
-    def handle_sell_offer(cls, sell_offer: OfferInfo):
-        meta = Metadata.from_metadata(get_metadata(str(sell_offer.token_id)))
-        matched_rule = cls.get_matched_rule(sell_offer.price, meta, config.rules)
+    def handle_sell_offer(self, sell_offer: OfferInfo):
+        """ every step of the pipeline for one offer, in the calling thread """
+        item = self.new_item(sell_offer)
+        if not self.prefilter(item):
+            return None, sell_offer, None
+        with stage_timer("get_metadata"):
+            meta = Metadata.from_metadata(get_metadata(str(sell_offer.token_id)))
+        matched_rule = self.match(meta, sell_offer, item.rule_set)
         if matched_rule:
-            msg = to_html(meta, sell_offer.price, meta.rarity_score, matched_rule)
-            send_msg(msg)
+            item.meta, item.rule = meta, matched_rule
+            self.notify(item)
         return meta, sell_offer, matched_rule
 
-    def run(self):
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            while True:
-                try:
-                    time.sleep(0.5)
-                    executor.map(self.handle_sell_offer,
-                                 self.scv_block_search.get_sell_event())
+    async def prefilter_stage(self, item: FeedItem) -> Optional[FeedItem]:
+        return item if self.prefilter(item) else None
+
+    async def enrich_stage(self, item: FeedItem) -> FeedItem:
+        with stage_timer("get_metadata"):
+            item.meta = Metadata.from_metadata(await self.client.get_metadata(str(item.offer.token_id)))
+        return item
 
-                except FilterNotFoundError:
-                    self.reconnect()
-                    continue
+    async def match_stage(self, item: FeedItem) -> Optional[FeedItem]:
+        item.rule = self.match(item.meta, item.offer, item.rule_set)
+        return item if item.rule else None
 
-                except KeyboardInterrupt as e:
-                    raise KeyboardInterrupt from e
+    async def notify_stage(self, item: FeedItem):
+        self.notify(item)
 
-                except Exception as e:
-                    logger.exception(str(e))
-                    continue
+    async def ingest(self):
+        while True:
+            try:
+                await asyncio.sleep(self.scv_block_search.poll_interval)
+                search = self.scv_block_search
+                with stage_timer("ingest"):
+                    offers = await asyncio.to_thread(lambda: list(search.get_sell_event()))
+            except FilterNotFoundError:
+                await asyncio.to_thread(self.reconnect)
+                continue
+            except Exception as e:
+                logger.exception(str(e))
+                continue
+            items = [self.new_item(offer) for offer in offers]
+            if offers:
+                self.lag_executor.submit(
+                    self.record_lag,
+                    lag_histogram("scv_block_to_detect_seconds", "block timestamp to offer received"),
+                    offers, items[0].detected_at)
+            for item in items:
+                await self.pipeline.put(item)
+
+    async def run_async(self):
+        await self.pipeline.start()
+        if self.mempool is not None:
+            self.mempool.start(lambda offer: self.pipeline.put_threadsafe(self.new_item(offer)))
+        stats = asyncio.create_task(self.pipeline.log_stats(config.PIPELINE_STATS_INTERVAL))
+        try:
+            await self.ingest()
+        finally:
+            stats.cancel()
+            await self.pipeline.stop()
+            await self.client.close()
+
+    def run(self):
+        self.rule_sets.start()
+        if self.order_book_watcher is not None:
+            self.order_book_watcher.start()
+        if config.METRICS_PORT:
+            metrics.serve(config.METRICS_PORT)
+        metrics.log_summary(config.METRICS_LOG_INTERVAL)
+        asyncio.run(self.run_async())
 
 
 if __name__ == '__main__':
-    send_msg(BOT_INTRO_TEMPLATE)
     scv_feed_app = ScvFeed()
+    send_msg(get_intro(scv_feed_app.rule_sets.current))
     try:
         scv_feed_app.run()
     except KeyboardInterrupt as exc:
@@ -146,3 +371,4 @@ if __name__ == '__main__':
         logging.info("graceful shutdown")
     finally:
         send_msg(f"BOT IS SHUTTING DOWN...")
+        sender.close(timeout=10)
@@ -0,0 +1,269 @@
+import time
+import heapq
+import typing
+import logging
+import itertools
+import threading
+from dataclasses import dataclass, field
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from scvfeed import metrics
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API = "https://api.telegram.org/bot{token}/sendMessage"
+MAX_MESSAGE_LENGTH = 4096
+URGENT = 0
+NORMAL = 1
+
+
+class TokenBucket:
+    """ `rate` tokens per second, up to `capacity` saved for bursts """
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float = None) -> float:
+        """ seconds until a token is available """
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float = None):
+        self._refill(now if now is not None else time.monotonic())
+        self.tokens -= 1
+
+
+@dataclass(order=True)
+class Message:
+    priority: int
+    seq: int
+    chat_id: typing.Union[int, str] = field(compare=False)
+    text: str = field(compare=False)
+    parse_mode: typing.Optional[str] = field(compare=False, default=None)
+    # called with the wall clock time of delivery
+    on_sent: typing.Optional[typing.Callable[[float], typing.Any]] = field(compare=False, default=None)
+    tries: int = field(compare=False, default=0)
+
+
+class ChatState:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.pending: typing.List[Message] = []
+        # set by a 429 retry_after or a failed attempt
+        self.blocked_until = 0.0
+
+    def ready_at(self, now: float) -> float:
+        return max(self.blocked_until, now + self.bucket.delay(now))
+
+
+class TelegramSender:
+    """
+    sends messages from a background thread over one keep-alive session, within telegram rate limits
+
+    every chat has its own token bucket, about 1 message per second in private chats and 20 per
+    minute in groups, and all chats share a global one. Urgent messages of a chat go first,
+    messages piling up in a saturated chat are coalesced into one. A 429 holds the chat back
+    for its `retry_after`, failed attempts are retried up to `max_tries`.
+
+    usage:
+        sender = TelegramSender(token)
+        sender.send(chat_id, "<b>deal</b>", parse_mode='html', urgent=True)
+    """
+    RETRY_DELAY = 1
+
+    def __init__(self, token: str, chat_rate: float = 1, group_rate: float = 20 / 60, burst: int = 3,
+                 global_rate: float = 30, max_tries: int = 3, timeout: float = 5,
+                 session: requests.Session = None):
+        self.url = TELEGRAM_API.format(token=token)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_tries = max_tries
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session = session
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chats: typing.Dict[typing.Union[int, str], ChatState] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._pending = 0
+        self._in_flight = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _chat(self, chat_id) -> ChatState:
+        state = self.chats.get(chat_id)
+        if state is None:
+            # group and channel ids are negative
+            rate = self.group_rate if int(chat_id) < 0 else self.chat_rate
+            state = self.chats[chat_id] = ChatState(TokenBucket(rate, self.burst))
+        return state
+
+    def send(self, chat_id, text: str, parse_mode: str = None, urgent: bool = False,
+             on_sent: typing.Callable[[float], typing.Any] = None):
+        """ queues the message and returns at once """
+        message = Message(URGENT if urgent else NORMAL, next(self._seq), chat_id, text, parse_mode, on_sent)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("sender is closed")
+            heapq.heappush(self._chat(chat_id).pending, message)
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="telegram-sender", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _next_batch(self) -> typing.Tuple[typing.List[Message], typing.Optional[float]]:
+        """ :return: messages to send now as one, or none and how long to wait """
+        now = time.monotonic()
+        ready = []
+        wait = None
+        for state in self.chats.values():
+            if not state.pending:
+                continue
+            ready_at = state.ready_at(now)
+            if ready_at <= now:
+                ready.append(state)
+            else:
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        if not ready:
+            return [], wait
+        global_delay = self.global_bucket.delay(now)
+        if global_delay > 0:
+            return [], global_delay
+
+        state = min(ready, key=lambda s: s.pending[0])
+        state.bucket.take(now)
+        self.global_bucket.take(now)
+        batch = [heapq.heappop(state.pending)]
+        length = len(batch[0].text)
+        # merged only once the chat is out of tokens, a backlog left while it has some is sent as is
+        saturated = state.bucket.delay(now) > 0
+        while saturated and state.pending and state.pending[0].parse_mode == batch[0].parse_mode \
+                and length + 2 + len(state.pending[0].text) <= MAX_MESSAGE_LENGTH:
+            message = heapq.heappop(state.pending)
+            length += 2 + len(message.text)
+            batch.append(message)
+        self._pending -= len(batch)
+        self._in_flight += len(batch)
+        return batch, None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    batch, wait = self._next_batch()
+                    if batch:
+                        break
+                    self._cond.wait(wait)
+            try:
+                self._deliver(batch)
+            except Exception as e:
+                logger.exception(f"cannot deliver {len(batch)} messages: {e}")
+                self.failed += len(batch)
+            finally:
+                with self._cond:
+                    self._in_flight -= len(batch)
+                    self._cond.notify_all()
+
+    def _deliver(self, batch: typing.List[Message]):
+        first = batch[0]
+        params = {'chat_id': first.chat_id, 'text': "\n\n".join(m.text for m in batch)}
+        if first.parse_mode:
+            params['parse_mode'] = first.parse_mode
+        try:
+            with metrics.registry.histogram("scv_stage_seconds", stage="send_msg").time():
+                res = self.session.post(self.url, data=params, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self._retry(batch, str(e), self.RETRY_DELAY)
+            return
+
+        if res.status_code == 429:
+            self.rate_limited += 1
+            try:
+                retry_after = res.json()['parameters']['retry_after']
+            except (ValueError, KeyError, TypeError):
+                retry_after = self.RETRY_DELAY
+            logger.warning("rate limited in chat %s for %ss", first.chat_id, retry_after)
+            # not a failed attempt, the messages go back first in line
+            self._requeue(batch, retry_after)
+        elif res.status_code >= 500:
+            self._retry(batch, f"{res.status_code} {res.text}", self.RETRY_DELAY)
+        elif not res.ok:
+            self.failed += len(batch)
+            logger.error("cannot send to chat %s: %s %s", first.chat_id, res.status_code, res.text)
+        else:
+            self.sent += 1
+            self.coalesced += len(batch) - 1
+            sent_at = time.time()
+            for message in batch:
+                if message.on_sent is not None:
+                    try:
+                        message.on_sent(sent_at)
+                    except Exception as e:
+                        logger.warning(f"on_sent callback failed: {e}")
+
+    def _retry(self, batch: typing.List[Message], reason: str, delay: float):
+        retried = []
+        for message in batch:
+            message.tries += 1
+            if message.tries < self.max_tries:
+                retried.append(message)
+            else:
+                self.failed += 1
+                logger.error(f"drop message to chat {message.chat_id} after {message.tries} tries: {reason}")
+        self.retried += len(retried)
+        self._requeue(retried, delay)
+
+    def _requeue(self, batch: typing.List[Message], delay: float):
+        if not batch:
+            return
+        with self._cond:
+            state = self._chat(batch[0].chat_id)
+            state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+            for message in batch:
+                heapq.heappush(state.pending, message)
+            self._pending += len(batch)
+            self._cond.notify()
+
+    def flush(self, timeout: float = None) -> bool:
+        """ :return: whether every queued message was handled within timeout """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def close(self, timeout: float = None):
+        """ delivers what is queued, within timeout, and stops """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.session.close()
+
+    def stats(self) -> dict:
+        return {
+            'pending': self._pending,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'rate_limited': self.rate_limited,
+            'retried': self.retried,
+            'failed': self.failed,
+        }
@@ -0,0 +1,151 @@
+import json
+import queue
+import asyncio
+import logging
+import threading
+from typing import List, Optional
+
+import websockets
+
+from datatypes import json_loads
+from scvfeed.exceptions import SubscriptionError
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    eth_subscribe on its own websocket, pushed items are queued for the caller thread
+
+    runs an event loop in a daemon thread, the subscription is renewed after any disconnect
+    with exponential backoff. `subscriptions` counts successful subscribes, items pushed while
+    disconnected are lost so callers catch up by other means when it changes.
+    """
+    def __init__(self, url: str, params: list, max_backoff: float = 30):
+        self.url = url
+        self.params = params
+        self.max_backoff = max_backoff
+        self.items = queue.Queue()
+        self.connected = threading.Event()
+        self.subscriptions = 0
+        self.notifications = 0
+        self.errors = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def _subscribe(self, ws) -> str:
+        await ws.send(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe",
+                                  "params": self.params}))
+        # notifications of a previous subscription may still arrive before the reply
+        while True:
+            reply = json_loads(await ws.recv())
+            if reply.get('id') == 1:
+                break
+        if 'error' in reply:
+            raise SubscriptionError(reply['error'])
+        return reply['result']
+
+    def accept(self, item) -> bool:
+        """ whether a pushed item is queued """
+        return True
+
+    async def _listen(self, ws, subscription_id: str):
+        async for message in ws:
+            params = json_loads(message).get('params') or {}
+            if params.get('subscription') != subscription_id:
+                continue
+            item = params['result']
+            if not self.accept(item):
+                continue
+            self.notifications += 1
+            self.items.put(item)
+
+    async def _run(self):
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(self.url, max_size=None) as ws:
+                    subscription_id = await self._subscribe(ws)
+                    self.subscriptions += 1
+                    self.connected.set()
+                    delay = 1
+                    logger.info("subscribed to %s on %s (%s)", self.params[0], self.url, subscription_id)
+                    await self._listen(ws, subscription_id)
+                    logger.warning("%s subscription closed by %s", self.params[0], self.url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"{self.params[0]} subscription on {self.url} failed: {e}")
+            finally:
+                self.connected.clear()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def _serve(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    def start(self) -> threading.Thread:
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._run())
+        self._thread = threading.Thread(target=self._serve, name=f"{self.params[0]}-subscription", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: float = 5):
+        if self._loop is not None and self._task is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def get_items(self, timeout: float = 0) -> list:
+        """
+        :param timeout: seconds to wait for the first item
+        :return: every queued item, possibly none
+        """
+        try:
+            items = [self.items.get(timeout=timeout) if timeout else self.items.get_nowait()]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                items.append(self.items.get_nowait())
+            except queue.Empty:
+                return items
+
+    def stats(self) -> dict:
+        return {
+            'connected': self.connected.is_set(),
+            'subscriptions': self.subscriptions,
+            'notifications': self.notifications,
+            'errors': self.errors,
+            'queued': self.items.qsize(),
+        }
+
+
+class LogSubscription(Subscription):
+    """ eth_subscribe("logs") """
+    def __init__(self, url: str, log_filter: dict, max_backoff: float = 30):
+        super().__init__(url, ["logs", log_filter], max_backoff)
+        self.log_filter = log_filter
+        self.removed = 0
+
+    def accept(self, log: dict) -> bool:
+        # log of a block dropped by a reorg
+        if log.get('removed'):
+            self.removed += 1
+            return False
+        return True
+
+    def get_logs(self, timeout: float = 0) -> List[dict]:
+        return self.get_items(timeout)
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'removed': self.removed}
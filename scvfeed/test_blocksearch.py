@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+import tempfile
+import unittest
+
+from hexbytes import HexBytes
+
+from scvfeed.blocksearch import NEW_OFFER_TOPIC, PMON_TOKEN_TOPIC, ScvBlockSearch, new_offer_topics, token_topic, \
+    block_ranges, fetch_logs
+from scvfeed.checkpoint import Checkpoint
+from scvfeed.dedup import DedupIndex
+from scvfeed.test_decoder import web3_log
+
+
+def offer_log(block: int, log_index: int) -> dict:
+    return {**web3_log(PMON_TOKEN_TOPIC, block, 10 ** 18, 1, log_index), 'blockNumber': block}
+
+
+class ResubscribingStandIn:
+    """ renewed while a read waits, pushing a log of a later block than the ones missed meanwhile """
+    def __init__(self, pushed: list):
+        self.pushed = pushed
+        self.subscriptions = 1
+        self.connected = threading.Event()
+        self.connected.set()
+
+    def get_logs(self, timeout: float = 0) -> list:
+        if timeout:
+            self.subscriptions += 1
+        pushed, self.pushed = self.pushed, []
+        return pushed
+
+
+class FilterStandIn:
+    def __init__(self, entries: list):
+        self.entries = entries
+
+    def get_new_entries(self) -> list:
+        entries, self.entries = self.entries, []
+        return entries
+
+
+class BlockSearchTest(unittest.TestCase):
+    def test_topics(self):
+        assert new_offer_topics() == [NEW_OFFER_TOPIC, None, PMON_TOKEN_TOPIC]
+        assert new_offer_topics([1, 255])[3] == ['0x' + '0' * 63 + '1', '0x' + '0' * 62 + 'ff']
+        assert token_topic(1234) == HexBytes((1234).to_bytes(32, 'big')).hex()
+
+    def test_block_ranges(self):
+        assert block_ranges(10, 10, 5) == [(10, 10)]
+        assert block_ranges(10, 21, 5) == [(10, 14), (15, 19), (20, 21)]
+        assert block_ranges(10, 9, 5) == []
+
+    def test_fetch_logs_keeps_chain_order(self):
+        def get_logs(log_filter):
+            # later chunks answer first
+            time.sleep((100 - log_filter['fromBlock']) / 1000)
+            return [(b, 0) for b in range(log_filter['fromBlock'], log_filter['toBlock'] + 1) if b % 3 == 0]
+
+        logs = fetch_logs(get_logs, {'address': '0x0'}, 0, 99, chunk_blocks=7, workers=8)
+        assert logs == [(b, 0) for b in range(0, 100, 3)]
+
+
+class SubscriptionGapTest(unittest.TestCase):
+    def test_gap_merged_when_renewed_during_read(self):
+        search = ScvBlockSearch.__new__(ScvBlockSearch)
+        search.__dict__.update(checkpoint=Checkpoint(None), dedup=DedupIndex(), kept=0, discarded=0, duplicates=0,
+                               _backfill_range=None, _polled_at=time.monotonic(), _subscriptions_seen=1)
+        search.subscription = ResubscribingStandIn([offer_log(12, 0)])
+        # missed while renewing, only the filter has it
+        search.scv_filter = FilterStandIn([offer_log(11, 5), offer_log(12, 0)])
+
+        offers = list(search.get_sell_event())
+        assert [(o.block_number, o.log_index) for o in offers] == [(11, 5), (12, 0)]
+        assert search.checkpoint.position == (12, 0) and search.duplicates == 1
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_persist_position(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'feed', 'checkpoint.json')
+            checkpoint = Checkpoint(path)
+            assert checkpoint.position is None and not checkpoint.is_processed(1, 0)
+            checkpoint.advance(10, 2)
+            checkpoint.advance(9, 5)
+            checkpoint.save()
+            restored = Checkpoint(path)
+            assert restored.position == (10, 2)
+            assert restored.is_processed(10, 2) and restored.is_processed(9, 7)
+            assert not restored.is_processed(10, 3)
+
+            with open(path, 'w') as f:
+                f.write('{"block": ')
+            assert Checkpoint(path).position is None
@@ -0,0 +1,46 @@
+import unittest
+
+from hexbytes import HexBytes
+
+from scvfeed.decoder import PMON_TOKEN_TOPIC, OfferInfo, TradeSide, decode_offer, decode_offers
+
+OTHER_NFT_TOPIC = '0x' + '11' * 32
+
+
+def json_rpc_log(nft_topic: str, token_id: int, price: int, side: int, log_index: int = 3) -> dict:
+    return {
+        'topics': ['0x' + 'ee' * 32, '0x' + '00' * 32, nft_topic, '0x{:064x}'.format(token_id)],
+        'data': '0x{:064x}{:064x}{:064x}'.format(price, side, 77),
+        'transactionHash': '0x' + 'ab' * 32,
+        'blockNumber': '0xa',
+        'logIndex': hex(log_index),
+    }
+
+
+def web3_log(nft_topic: str, token_id: int, price: int, side: int, log_index: int = 3) -> dict:
+    log = json_rpc_log(nft_topic, token_id, price, side, log_index)
+    return {**log,
+            'topics': [HexBytes(t) for t in log['topics']],
+            'transactionHash': HexBytes(log['transactionHash']),
+            'blockNumber': 10,
+            'logIndex': log_index}
+
+
+class DecoderTest(unittest.TestCase):
+    def test_decode_web3_and_json_rpc_logs(self):
+        expected = OfferInfo(token_id=42, side=TradeSide.SELL, price=10 ** 18 + 1, tx='0x' + 'ab' * 32,
+                             offer_id=77, block_number=10, log_index=3)
+        for make_log in (web3_log, json_rpc_log):
+            offer = decode_offer(make_log(PMON_TOKEN_TOPIC, 42, 10 ** 18 + 1, 1))
+            assert offer == expected
+            assert (offer.token_id, offer.side, offer.price, offer.offer_id, offer.block_number) == \
+                   (42, TradeSide.SELL, 10 ** 18 + 1, 77, 10)
+            assert decode_offer(make_log(PMON_TOKEN_TOPIC, 42, 1, 2)).side == TradeSide.BUY
+            assert decode_offer(make_log(OTHER_NFT_TOPIC, 42, 1, 1)) is None
+
+    def test_decode_batch_skips_broken_logs(self):
+        truncated = {**web3_log(PMON_TOKEN_TOPIC, 1, 1, 1), 'data': '0x' + '00' * 64}
+        offers = decode_offers([web3_log(PMON_TOKEN_TOPIC, 1, 5, 1, log_index=0), truncated,
+                                web3_log(OTHER_NFT_TOPIC, 2, 5, 1), web3_log(PMON_TOKEN_TOPIC, 3, 5, 1, log_index=1)])
+        assert [o.token_id for o in offers] == [1, 3]
+        assert not hasattr(offers[0], '__dict__')
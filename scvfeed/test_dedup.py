@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from scvfeed.dedup import DedupIndex
+
+
+class DedupIndexTest(unittest.TestCase):
+    def test_let_through_once_and_evict_oldest(self):
+        index = DedupIndex(maxsize=3)
+        assert not index.seen('0xa', 0)
+        assert not index.seen('0xa', 1)
+        assert index.seen('0xa', 0)
+        index.seen('0xb', 0)
+        index.seen('0xc', 0)
+        assert ('0xa', 0) not in index and len(index) == 3
+        stats = index.stats()
+        assert stats['hits'] == 1 and stats['evicted'] == 1 and stats['bytes'] > 0
+        assert stats['hit_rate'] == 1 / 5
+
+    def test_persisted_keys_survive_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'offers.txt')
+            index = DedupIndex(maxsize=2, path=path)
+            for i in range(5):
+                index.seen(f'0x{i}', i)
+            index.close()
+            with open(path, 'a') as f:
+                f.write('0xbroken')
+
+            restored = DedupIndex(maxsize=2, path=path)
+            assert restored.seen('0x4', 4) and restored.seen('0x3', 3)
+            assert not restored.seen('0x0', 0)
+            restored.close()
+            with open(path) as f:
+                assert f.read().splitlines() == ['0x3 3', '0x4 4', '0x0 0']
+
+            # a cut line is dropped even when it parses
+            with open(path, 'a') as f:
+                f.write('0x5 1')
+            restored = DedupIndex(maxsize=4, path=path)
+            assert ('0x5', 1) not in restored and ('0x0', 0) in restored
+            assert not restored.seen('0x6', 6)
+            restored.close()
+
+            restored = DedupIndex(maxsize=4, path=path)
+            assert ('0x6', 6) in restored and len(restored) == 4
+            restored.close()
@@ -0,0 +1,93 @@
+import random
+import unittest
+
+from datatypes import Metadata, Attribute, Rarity, Type, Horn, Color
+from scvfeed.models import Rule, SFType, SFColor, SFHorn
+from scvfeed.matcher import RuleMatcher
+from scvfeed.reservation import ReservationIndex
+from scvfeed.config import rules as configured_rules
+
+PROBABILITIES = (1, 0.99, 0.2, 0.16, 0.06, 0.05, 0.015, 0.01, 0.0005, 0)
+
+
+def naive_match(price: int, metadata: Metadata, rules):
+    for rule in rules:
+        try:
+            if rule.is_worth_buying(price / 1E18, metadata):
+                return rule
+        except Exception:
+            pass
+    return None
+
+
+def random_rule(rnd: random.Random, i: int) -> Rule:
+    def maybe(*values):
+        return rnd.choice((None,) + values)
+
+    return Rule(name=f"RULE {i}",
+                special=maybe(True, False),
+                type=maybe(SFType.ALL, SFType.RARE, SFType.SUPER_RARE, SFType.BABY, SFType.RARE + SFType.BABY),
+                color=maybe(SFColor.RARE, SFColor.SUPER_RARE, SFColor.BLACK),
+                horn=maybe(SFHorn.RARE, SFHorn.SUPER_RARE, SFHorn.DIAMOND),
+                glitter=maybe(True, False),
+                max_price_bnb=maybe(1, 5, 10, 20),
+                min_score_per_bnb=maybe(500, 1500, 3000, 7000))
+
+
+def random_meta(rnd: random.Random) -> Metadata:
+    return Metadata(id="1", name="", image="",
+                    attributes=Attribute(born=1630645436,
+                                         type=str(rnd.choice(list(Type) + ["Unicorn"])),
+                                         horn=str(rnd.choice(list(Horn))),
+                                         color=str(rnd.choice(list(Color))),
+                                         glitter=rnd.random() < 0.3,
+                                         special=rnd.random() < 0.1),
+                    rarity=Rarity(*(rnd.choice(PROBABILITIES) for _ in range(5))))
+
+
+class RuleMatcherTest(unittest.TestCase):
+    def test_same_first_rule_as_naive(self):
+        rnd = random.Random(11)
+        rule_sets = [configured_rules] + [tuple(random_rule(rnd, i) for i in range(50)) for _ in range(5)]
+        for rules in rule_sets:
+            matcher = RuleMatcher(rules)
+            for _ in range(2000):
+                meta = random_meta(rnd)
+                price = rnd.choice((0, 1, int(0.05 * 1E18), int(rnd.uniform(0, 25) * 1E18)))
+                assert matcher.match(price, meta) is naive_match(price, meta, rules)
+
+    def test_candidates_are_filtered_by_traits(self):
+        rules = (Rule(name='ALL BLACKS', color=SFColor.BLACK, max_price_bnb=10),
+                 Rule(name='ONLY SPECIAL', special=True, max_price_bnb=15))
+        meta = random_meta(random.Random(1))
+        meta.attributes = Attribute(1630645436, "Uniturtle", "Candy Cane", "Black", False, False)
+        assert [c[0].name for c in RuleMatcher(rules).candidates(meta.attributes)] == ['ALL BLACKS']
+
+
+class ReservationIndexTest(unittest.TestCase):
+    def test_never_rejects_a_matching_offer(self):
+        rnd = random.Random(5)
+        rules = tuple(random_rule(rnd, i) for i in range(30))
+        metas = [random_meta(rnd) for _ in range(500)]
+        for i, meta in enumerate(metas):
+            meta.id = str(i)
+        index = ReservationIndex(RuleMatcher(rules))
+        index.extend(metas)
+
+        new_rules = rules[:10] + tuple(random_rule(rnd, i) for i in range(10))
+        old_index = index
+        for rule_set in (rules, new_rules):
+            if rule_set is new_rules:
+                index = old_index.with_rules(RuleMatcher(new_rules))
+                assert index.recomputed > 0 and len(index) == len(old_index)
+                # the index in use is left untouched
+                assert [old_index.reservation(i) for i in range(500)] != [index.reservation(i) for i in range(500)]
+            matcher = RuleMatcher(rule_set)
+            for meta in metas:
+                for _ in range(20):
+                    price = int(rnd.uniform(0.001, 25) * 1E18)
+                    if matcher.match(price, meta) is not None:
+                        assert index.may_fire(int(meta.id), price), (meta, price)
+                    else:
+                        index.may_fire(int(meta.id), price)
+        assert index.stats()['rejected'] > 0
@@ -0,0 +1,108 @@
+import time
+import threading
+import unittest
+
+from eth_abi import encode_abi
+from hexbytes import HexBytes
+
+from scvfeed.decoder import OfferInfo, TradeSide
+from scvfeed.exceptions import AbiError
+from scvfeed.mempool import ListingDecoder, MempoolWatcher, PMON_TOKEN_ADDRESS, listing_decoder
+
+CONTRACT = '0x9437E3E2337a78D324c581A4bFD9fe22a1aDBf04'
+SIGNATURE = 'newOffer(address,uint256,uint256,uint8)'
+
+
+def listing_tx(decoder: ListingDecoder, nft: str, token_id: int, price: int, side: int = 1, to: str = CONTRACT):
+    return {'hash': HexBytes(b'\x01' * 32), 'to': to,
+            'input': '0x' + (decoder.selector + encode_abi(decoder.types, [nft, token_id, price, side])).hex()}
+
+
+def function(name: str, *inputs) -> dict:
+    return {'type': 'function', 'name': name, 'inputs': [{'name': n, 'type': t} for n, t in inputs]}
+
+
+ABI = [
+    function('newOffer', ('_nft', 'address'), ('_tokenId', 'uint256'), ('_price', 'uint256'), ('_side', 'uint8')),
+    function('cancelOffer', ('_offerId', 'uint256')),
+    {'type': 'event', 'name': 'EvNewOffer', 'inputs': [{'name': 'tokenId', 'type': 'uint256'},
+                                                       {'name': 'price', 'type': 'uint256'}]},
+]
+
+
+class ListingAbiTest(unittest.TestCase):
+    def test_read_from_abi(self):
+        for decoder in (listing_decoder(ABI), listing_decoder(ABI, 'newOffer'),
+                        listing_decoder(ABI, 'newOffer', ['nft', 'token_id', 'price', 'side'])):
+            assert decoder.signature == SIGNATURE and decoder.roles == ('nft', 'token_id', 'price', 'side')
+            assert decoder.selector == ListingDecoder(SIGNATURE, decoder.roles).selector
+        assert listing_decoder(ABI, 'newOffer', ['_', 'token_id', 'price', '_']).roles[0] == '_'
+
+    def test_refuse_missing_method(self):
+        self.assertRaises(AbiError, listing_decoder, ABI, 'createOffer')
+        self.assertRaises(AbiError, listing_decoder, ABI[1:])
+        self.assertRaises(AbiError, listing_decoder, ABI, 'cancelOffer')
+        self.assertRaises(AbiError, listing_decoder, ABI, 'newOffer', ['nft', 'token_id', 'price'])
+        twice = function('newOffers', ('tokenId', 'uint256'), ('price', 'uint256'), ('id', 'uint256'))
+        self.assertRaises(AbiError, listing_decoder, [twice])
+        self.assertRaises(AbiError, listing_decoder, ABI + [twice])
+
+
+class MempoolTest(unittest.TestCase):
+    def setUp(self):
+        self.decoder = ListingDecoder(SIGNATURE, ['nft', 'token_id', 'price', 'side'])
+
+    def test_decode_listing_call(self):
+        offer = self.decoder.decode('0xab', listing_tx(self.decoder, PMON_TOKEN_ADDRESS, 42, 10 ** 18)['input'])
+        assert (offer.token_id, offer.side, offer.price, offer.tx) == (42, TradeSide.SELL, 10 ** 18, '0xab')
+        assert not offer.confirmed
+        other_nft = '0x' + '12' * 20
+        assert self.decoder.decode('0xab', listing_tx(self.decoder, other_nft, 42, 1)['input']) is None
+        assert self.decoder.decode('0xab', '0xdeadbeef') is None
+        self.assertRaises(ValueError, ListingDecoder, SIGNATURE, ['nft', 'token_id', 'price'])
+        self.assertRaises(ValueError, ListingDecoder, SIGNATURE, ['nft', 'token_id', 'cost', 'side'])
+
+    def test_hand_over_once_and_reconcile(self):
+        watcher = MempoolWatcher('ws://127.0.0.1:1', CONTRACT, self.decoder)
+        handed = []
+        watcher._on_offer = handed.append
+        tx = listing_tx(self.decoder, PMON_TOKEN_ADDRESS, 42, 10 ** 18)
+        assert watcher.inspect(tx) is not None
+        assert watcher.inspect(tx) is None
+        assert watcher.inspect({**tx, 'to': '0x' + '00' * 20}) is None
+        assert watcher.inspect(listing_tx(self.decoder, PMON_TOKEN_ADDRESS, 43, 1, side=2)) is None
+        assert len(handed) == 1
+
+        mined = OfferInfo(token_id=42, side=TradeSide.SELL, price=10 ** 18, tx=handed[0].tx, offer_id=7,
+                          block_number=100, log_index=3)
+        assert mined.confirmed
+        assert watcher.reconcile(mined)
+        assert not watcher.reconcile(mined)
+        assert watcher.stats()['confirmed'] == 1
+
+    def test_lookups_bounded_under_load(self):
+        gate = threading.Event()
+        looked_up = []
+
+        class Eth:
+            @staticmethod
+            def get_transaction(tx_hash):
+                gate.wait(5)
+                looked_up.append(tx_hash)
+                return {'hash': tx_hash, 'to': None}
+
+        watcher = MempoolWatcher('ws://127.0.0.1:1', CONTRACT, self.decoder, lookup_workers=1, lookup_queue=3)
+        watcher.web3 = type('Web3', (), {'eth': Eth})
+        watcher.enqueue_lookup('0x0')
+        # the worker holds 0x0, the queue keeps the newest hashes
+        while watcher.stats()['lookups_queued']:
+            time.sleep(0.001)
+        for i in range(1, 10):
+            watcher.enqueue_lookup(f'0x{i}')
+        assert watcher.stats()['lookups_dropped'] == 6 and watcher.stats()['lookups_queued'] == 3
+        gate.set()
+        deadline = time.monotonic() + 5
+        while len(looked_up) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert looked_up == ['0x0', '0x7', '0x8', '0x9']
+        watcher.stop()
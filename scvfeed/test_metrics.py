@@ -0,0 +1,57 @@
+import unittest
+import urllib.request
+
+from scvfeed.blocksearch import BlockClock
+from scvfeed.metrics import Histogram, Registry, serve
+
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram_buckets_and_quantiles(self):
+        h = Histogram(buckets=(0.1, 1, 10))
+        for value in (0.05, 0.5, 0.5, 5, 50):
+            h.observe(value)
+        assert h.count == 5 and h.sum == 56.05
+        assert h.cumulative() == [(0.1, 1), (1, 3), (10, 4), (float('inf'), 5)]
+        assert h.quantile(0.5) == 1 and h.quantile(0.8) == 10 and h.quantile(1) == float('inf')
+        assert Histogram().quantile(0.5) == 0.0
+
+    def test_render_and_collect_stats(self):
+        registry = Registry()
+        registry.counter("scv_alerts_total", "alerts sent").inc()
+        registry.histogram("scv_stage_seconds", stage="enrich").observe(0.2)
+        registry.histogram("scv_stage_seconds", "time per step", stage="notify").observe(2)
+        registry.collect("scv_dedup", lambda: {'hits': 3, 'hit_rate': 0.5, 'checkpoint': (1, 2),
+                                               'providers': {'wss://a:443': {'lag': 1.5}}})
+        registry.collect("broken", lambda: 1 / 0)
+
+        text = registry.render()
+        assert "# HELP scv_stage_seconds time per step" in text
+        assert 'scv_stage_seconds_bucket{stage="enrich",le="0.25"} 1' in text
+        assert 'scv_stage_seconds_bucket{stage="notify",le="+Inf"} 1' in text
+        assert 'scv_stage_seconds_count{stage="notify"} 1' in text
+        assert "scv_alerts_total 1" in text
+        assert "scv_dedup_hits 3.0" in text and "scv_dedup_providers_wss___a_443_lag 1.5" in text
+        assert "checkpoint" not in text
+        assert 'scv_stage_seconds{stage="notify"} n=1 mean=2.000s p50<=2.5s' in registry.summary()
+
+    def test_serve_metrics(self):
+        registry = Registry()
+        registry.counter("scv_offers_total").inc(2)
+        server = serve(0, reg=registry)
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/metrics"
+            with urllib.request.urlopen(url, timeout=5) as res:
+                assert "scv_offers_total 2" in res.read().decode()
+        finally:
+            server.shutdown()
+
+    def test_block_clock_looks_up_blocks_once(self):
+        lookups = []
+
+        def get_block(number):
+            lookups.append(number)
+            return {'timestamp': 1000 + number}
+
+        clock = BlockClock(get_block)
+        assert clock.lag(5, at=1010) == 5 and clock.lag(5, at=1020) == 15
+        assert lookups == [5]
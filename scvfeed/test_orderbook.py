@@ -0,0 +1,150 @@
+import threading
+import unittest
+
+from datatypes import Attribute, Type, Horn, Color, Glitter
+from helpers import SCVFilterBuilder
+from scvfeed.decoder import PMON_TOKEN_TOPIC
+from scvfeed.exceptions import AbiError
+from scvfeed.orderbook import OrderBook, OrderBookWatcher, OfferIdEvent, closing_events, filter_key, patterns, \
+    trait_key
+from scvfeed.test_decoder import web3_log
+
+
+def attributes(type: str, horn: str, color: str, glitter: bool = False) -> Attribute:
+    return Attribute(born=0, type=type, horn=horn, color=color, glitter=glitter, special=False)
+
+
+CHICK = attributes("Unichick", "Baby Horn", "Black")
+GLITTER_CHICK = attributes("Unichick", "Baby Horn", "Black", glitter=True)
+SHEEP = attributes("Unisheep", "Baby Horn", "Red")
+
+
+class OrderBookTest(unittest.TestCase):
+    def test_floor_and_top_n_of_any_filter(self):
+        book = OrderBook()
+        book.add(1, 100, 30, CHICK)
+        book.add(2, 101, 10, GLITTER_CHICK)
+        book.add(3, 102, 20, SHEEP)
+        book.add(4, 103, 40, CHICK)
+
+        assert [l.offer_id for l in book.cheapest((None, None, None, None), 3)] == [2, 3, 1]
+        assert book.floor(filter_key(SCVFilterBuilder(type=Type.CHICK))).offer_id == 2
+        black = filter_key(SCVFilterBuilder(type=Type.CHICK, color=Color.BLACK, glitter=Glitter.NO))
+        assert [l.price for l in book.cheapest(black)] == [30, 40]
+        assert book.floor(black, exclude=1).offer_id == 4
+        assert book.floor(filter_key(SCVFilterBuilder(horn=Horn.BABY_HORN, color=Color.RED))).token_id == 102
+        assert book.floor((Type.DRAGON, None, None, None)) is None
+
+    def test_cancel_and_relist(self):
+        book = OrderBook()
+        book.add(1, 100, 30, CHICK)
+        book.add(2, 101, 20, CHICK)
+        assert book.remove(2).token_id == 101 and book.remove(2) is None
+        book.add(1, 100, 50, CHICK)
+        assert len(book) == 1 and book.floor(trait_key(CHICK)).price == 50
+        book.remove(1)
+        assert book.stats() == {'listings': 0, 'patterns': 0}
+
+    def test_patterns(self):
+        key = trait_key(CHICK)
+        assert key == (Type.CHICK, Horn.BABY_HORN, Color.BLACK, Glitter.NO)
+        assert len(patterns(key)) == 16 and key in patterns(key) and (None, None, None, None) in patterns(key)
+
+
+def event(name: str, *inputs) -> dict:
+    return {'type': 'event', 'name': name,
+            'inputs': [{'name': n, 'type': t, 'indexed': indexed} for n, t, indexed in inputs]}
+
+
+ABI = [
+    event('EvNewOffer', ('user', 'address', True), ('nft', 'address', True), ('tokenId', 'uint256', True),
+          ('price', 'uint256', False), ('side', 'uint8', False), ('offerId', 'uint256', False)),
+    event('EvCancelOffer', ('offerId', 'uint256', False)),
+    event('EvSwap', ('buyer', 'address', True), ('offerId', 'uint256', True), ('amount', 'uint256', False)),
+    event('EvNote', ('note', 'string', False), ('offerId', 'uint256', False)),
+    event('Transfer', ('from', 'address', True), ('to', 'address', True)),
+    {'type': 'function', 'name': 'cancelOffer', 'inputs': [{'name': 'offerId', 'type': 'uint256'}]},
+]
+
+
+class ClosingEventsTest(unittest.TestCase):
+    def test_read_from_abi(self):
+        events = closing_events(ABI, ['EvCancelOffer', 'EvSwap'])
+        assert events == [OfferIdEvent("EvCancelOffer(uint256)", "data:0"),
+                          OfferIdEvent("EvSwap(address,uint256,uint256)", "topic:2")]
+
+    def test_discovered_without_names(self):
+        with self.assertRaises(AbiError):
+            # the offer id follows a dynamic argument
+            closing_events(ABI)
+        assert [e.signature for e in closing_events(ABI[:3])] == \
+               ["EvCancelOffer(uint256)", "EvSwap(address,uint256,uint256)"]
+
+    def test_refuse_missing_events(self):
+        with self.assertRaises(AbiError):
+            closing_events(ABI, ['EvAcceptOffer'])
+        with self.assertRaises(AbiError):
+            closing_events([ABI[0], ABI[4]])
+        with self.assertRaises(AbiError):
+            closing_events(ABI[1:])
+
+
+class OrderBookWatcherTest(unittest.TestCase):
+    def test_apply_offer_cancel_fill(self):
+        cancel = OfferIdEvent("EvCancelOffer(uint256)")
+        fill = OfferIdEvent("EvAcceptOffer(uint256)", "topic:1")
+        traits = {42: CHICK, 43: SHEEP}
+        watcher = OrderBookWatcher("http://localhost:0", "0x0", (cancel, fill), resolve=traits.get)
+
+        def offer_log(token_id: int, offer_id: int, side: int = 1) -> dict:
+            log = web3_log(PMON_TOKEN_TOPIC, token_id, 10 ** 18, side)
+            return {**log, 'data': log['data'][:-64] + '{:064x}'.format(offer_id)}
+
+        for log in (offer_log(42, 7), offer_log(43, 8), offer_log(44, 9), offer_log(42, 10, side=2)):
+            watcher.apply(log)
+        assert 7 in watcher.order_book and 8 in watcher.order_book and len(watcher.order_book) == 2
+        assert watcher.unresolved == 1
+
+        watcher.apply({'topics': [cancel.topic], 'data': '0x{:064x}'.format(7)})
+        watcher.apply({'topics': [fill.topic, '0x{:064x}'.format(8)], 'data': '0x'})
+        watcher.apply({'topics': [cancel.topic], 'data': '0x{:064x}'.format(99)})
+        assert len(watcher.order_book) == 0 and watcher.stats()['closed'] == 2
+
+    def test_sync_resolves_open_listings_only(self):
+        cancel = OfferIdEvent("EvCancelOffer(uint256)")
+        traits = {42: CHICK, 43: SHEEP, 44: CHICK}
+        resolved = []
+        lock = threading.Lock()
+
+        def resolve(token_id: int):
+            with lock:
+                resolved.append(token_id)
+            if token_id == 44:
+                raise ConnectionError("down")
+            return traits.get(token_id)
+
+        def offer_log(token_id: int, offer_id: int) -> dict:
+            log = web3_log(PMON_TOKEN_TOPIC, token_id, 10 ** 18, 1)
+            return {**log, 'data': log['data'][:-64] + '{:064x}'.format(offer_id)}
+
+        logs = [offer_log(42, 7), offer_log(43, 8), offer_log(44, 9), offer_log(45, 10), offer_log(42, 11),
+                {'topics': [cancel.topic], 'data': '0x{:064x}'.format(7)},
+                {'topics': [cancel.topic], 'data': '0x{:064x}'.format(8)}]
+
+        class Eth:
+            block_number = 100
+
+            @staticmethod
+            def filter(log_filter):
+                return None
+
+            @staticmethod
+            def get_logs(log_filter):
+                return logs if log_filter['fromBlock'] == 0 else []
+
+        watcher = OrderBookWatcher("http://localhost:0", "0x0", (cancel,), resolve=resolve, from_block=0)
+        watcher.web3 = watcher.backfill_web3 = type('Web3', (), {'eth': Eth})
+        watcher.sync()
+        assert sorted(resolved) == [42, 44, 45]
+        assert 11 in watcher.order_book and len(watcher.order_book) == 1
+        assert watcher.synced.is_set() and watcher.unresolved == 2
@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+
+from scvfeed.pipeline import DropPolicy, Pipeline, Stage
+
+
+class PipelineTest(unittest.IsolatedAsyncioTestCase):
+    async def test_items_flow_through_stages(self):
+        delivered = []
+
+        async def double(x):
+            if x == 3:
+                raise ValueError("broken item")
+            return x * 2
+
+        async def keep_big(x):
+            return x if x > 2 else None
+
+        async def deliver(x):
+            delivered.append(x)
+
+        pipeline = Pipeline([Stage("double", double, concurrency=2), Stage("filter", keep_big),
+                             Stage("deliver", deliver)])
+        await pipeline.start()
+        for i in range(5):
+            await pipeline.put(i)
+        await pipeline.join()
+        await pipeline.stop()
+
+        assert sorted(delivered) == [4, 8]
+        stats = pipeline.stats()
+        assert stats['double']['errors'] == 1 and stats['double']['processed'] == 4
+        assert stats['filter']['processed'] == 4 and stats['deliver']['processed'] == 2
+        assert all(s['depth'] == 0 and s['busy'] == 0 for s in stats.values())
+
+    async def test_drop_policies_bound_the_queue(self):
+        release = asyncio.Event()
+        seen = []
+
+        async def slow(x):
+            await release.wait()
+            seen.append(x)
+
+        for drop, expected in ((DropPolicy.DROP_OLDEST, [0, 3, 4]), (DropPolicy.DROP_NEW, [0, 1, 2])):
+            release.clear()
+            seen.clear()
+            stage = Stage("slow", slow, maxsize=2, drop=drop)
+            pipeline = Pipeline([stage])
+            await pipeline.start()
+            await pipeline.put(0)
+            # the worker holds 0, the queue has room for two more
+            await asyncio.sleep(0)
+            queued = [await pipeline.put(i) for i in range(1, 5)]
+            assert stage.stats()['depth'] == 2 and stage.stats()['dropped'] == 2
+            assert queued == ([True] * 4 if drop == DropPolicy.DROP_OLDEST else [True, True, False, False])
+            release.set()
+            await pipeline.join()
+            await pipeline.stop()
+            assert seen == expected
+
+    async def test_block_policy_applies_backpressure(self):
+        release = asyncio.Event()
+
+        async def slow(x):
+            await release.wait()
+
+        pipeline = Pipeline([Stage("slow", slow, maxsize=1)])
+        await pipeline.start()
+        await pipeline.put(0)
+        await asyncio.sleep(0)
+        await pipeline.put(1)
+        blocked = asyncio.create_task(pipeline.put(2))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        release.set()
+        assert await blocked
+        await pipeline.join()
+        await pipeline.stop()
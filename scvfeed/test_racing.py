@@ -0,0 +1,99 @@
+import os
+import time
+import tempfile
+import unittest
+
+from scvfeed.checkpoint import Checkpoint
+from scvfeed.decoder import OfferInfo, TradeSide
+from scvfeed.exceptions import FilterNotFoundError
+from scvfeed.racing import ProviderRace
+
+
+def offer(i: int) -> OfferInfo:
+    return OfferInfo(token_id=i, side=TradeSide.SELL, price=1, tx=f'0x{i}', offer_id=i,
+                     block_number=i, log_index=0)
+
+
+class FakeSearch:
+    """ delivers offers 0..count-1 once, `delay` seconds after they are due """
+    poll_interval = 0.01
+
+    def __init__(self, started_at: float, delay: float, count: int = 10, fail: bool = False):
+        self.started_at = started_at
+        self.delay = delay
+        self.count = count
+        self.fail = fail
+        self.next = 0
+
+    def get_sell_event(self):
+        if self.fail:
+            raise FilterNotFoundError()
+        elapsed = time.monotonic() - self.started_at - self.delay
+        while self.next < self.count and self.next * 0.02 <= elapsed:
+            yield offer(self.next)
+            self.next += 1
+
+    def close(self):
+        pass
+
+
+def collect(race: ProviderRace, count: int, timeout: float = 5) -> list:
+    offers = []
+    deadline = time.monotonic() + timeout
+    while len(offers) < count and time.monotonic() < deadline:
+        offers.extend(race.get_sell_event())
+    return offers
+
+
+class ProviderRaceTest(unittest.TestCase):
+    def test_first_copy_wins_and_slow_provider_is_demoted(self):
+        started_at = time.monotonic()
+        delays = {'fast': 0, 'slow': 0.3}
+        race = ProviderRace(['fast', 'slow'], lambda p, i: FakeSearch(started_at, delays[p]),
+                            max_lag=0.1, cooldown=60)
+        try:
+            offers = collect(race, 10)
+            assert [o.token_id for o in offers] == list(range(10))
+            time.sleep(0.5)
+            assert race.offers.empty()
+            providers = race.stats()['providers']
+            assert providers['fast']['wins'] == 10 and providers['fast']['lag'] == 0
+            assert providers['slow']['wins'] == 0 and providers['slow']['demoted']
+        finally:
+            race.close()
+
+    def test_failing_provider_is_demoted(self):
+        started_at = time.monotonic()
+        race = ProviderRace(['ok', 'broken'], lambda p, i: FakeSearch(started_at, 0, fail=p == 'broken'),
+                            max_errors=3, cooldown=60)
+        try:
+            assert len(collect(race, 10)) == 10
+            time.sleep(0.2)
+            broken = race.stats()['providers']['broken']
+            assert broken['demoted'] and broken['errors'] == 3
+        finally:
+            race.close()
+
+    def test_checkpoint_follows_winners(self):
+        started_at = time.monotonic()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoint.json')
+            # the first provider never delivers
+            race = ProviderRace(['broken', 'ok'], lambda p, i: FakeSearch(started_at, 0, fail=p == 'broken'),
+                                checkpoint=Checkpoint(path), max_errors=1, cooldown=60)
+            try:
+                assert len(collect(race, 10)) == 10
+                assert race.stats()['checkpoint'] == (9, 0)
+                assert Checkpoint(path).position == (9, 0)
+            finally:
+                race.close()
+
+    def test_detached_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = Checkpoint(os.path.join(tmp, 'checkpoint.json'))
+            checkpoint.advance(10, 2)
+            copy = checkpoint.detached()
+            copy.advance(12, 0)
+            copy.save()
+            assert copy.is_processed(10, 2) and checkpoint.position == (10, 2)
+            assert Checkpoint(checkpoint.path).position is None
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from scvfeed.config import rules
+from scvfeed.exceptions import InvalidRuleError
+from scvfeed.models import SFType
+from scvfeed.ruleset import RuleSetWatcher, load_rules, parse_rule
+
+
+class RuleSetTest(unittest.TestCase):
+    def test_conf_rules_match_config(self):
+        assert load_rules('conf/rules.yml') == rules
+
+    def test_parse_traits(self):
+        rule = parse_rule({'name': 'X', 'type': ['RARE', 'Baby Unichick'], 'glitter': True})
+        assert rule.type == SFType.RARE + (SFType.BABY[2],)
+        self.assertRaises(InvalidRuleError, parse_rule, {'name': 'X', 'type': 'Unicorn'})
+        self.assertRaises(InvalidRuleError, parse_rule, {'name': 'X', 'max_price': 1})
+        self.assertRaises(InvalidRuleError, parse_rule, {'name': 'X', 'glitter': 'yes'})
+
+    def test_reload_swaps_and_keeps_last_valid(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rules.yml')
+            with open(path, 'w') as f:
+                f.write("rules:\n  - name: CHEAP\n    max_price_bnb: 1\n")
+            watcher = RuleSetWatcher(path, fallback=rules)
+            reloaded = []
+            # listeners see the new rule set in use
+            watcher.on_reload(lambda rule_set: reloaded.append((rule_set, watcher.current)))
+            first = watcher.current
+            assert first.version == 1 and first.rules[0].name == 'CHEAP'
+            assert first.reservations.matcher is first.matcher
+
+            with open(path, 'w') as f:
+                f.write("rules:\n  - name: BROKEN\n    max_price_bnb: cheap\n")
+            os.utime(path, (0, 0))
+            assert not watcher.reload()
+            assert watcher.current is first
+            assert watcher.stats()['reload_errors'] == 1
+
+            with open(path, 'w') as f:
+                f.write("rules:\n  - name: CHEAPER\n    max_price_bnb: 0.5\n")
+            os.utime(path, (1, 1))
+            assert watcher.reload()
+            assert watcher.current.version == 2
+            assert reloaded == [(watcher.current, watcher.current)]
+            assert watcher.current.reservations is not first.reservations
+            assert watcher.current.reservations.matcher is watcher.current.matcher
@@ -0,0 +1,37 @@
+import os
+import random
+import tempfile
+import unittest
+
+from datatypes import Attribute
+from scvfeed.decoder import OfferInfo, TradeSide
+from scvfeed.ruleset import RuleSetWatcher
+from scvfeed.scv_feed_async import ScvFeed
+from scvfeed.test_matcher import random_meta
+
+
+class ReloadInFlightTest(unittest.TestCase):
+    def test_offer_in_flight_finishes_against_its_rule_set(self):
+        meta = random_meta(random.Random(1))
+        meta.attributes = Attribute(1630645436, "Uniturtle", "Candy Cane", "Black", False, False)
+        offer = OfferInfo(token_id=1, side=TradeSide.SELL, price=5 * 10 ** 18, tx='0xab', offer_id=7,
+                          block_number=100, log_index=0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rules.yml')
+            with open(path, 'w') as f:
+                f.write("rules:\n  - name: CHEAP\n    max_price_bnb: 10\n")
+            feed = ScvFeed.__new__(ScvFeed)
+            feed.mempool = None
+            feed.rule_sets = RuleSetWatcher(path)
+            feed.rule_sets.current.reservations.add(meta)
+
+            item = feed.new_item(offer)
+            with open(path, 'w') as f:
+                f.write("rules:\n  - name: CHEAPER\n    max_price_bnb: 1\n")
+            os.utime(path, (0, 0))
+            assert feed.rule_sets.reload()
+            assert not feed.rule_sets.current.reservations.may_fire(offer.token_id, offer.price)
+
+            assert feed.prefilter(item)
+            assert feed.match(meta, offer, item.rule_set).name == 'CHEAP'
+            assert not feed.prefilter(feed.new_item(offer))
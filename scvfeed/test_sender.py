@@ -0,0 +1,113 @@
+import time
+import threading
+import unittest
+
+import requests
+
+from scvfeed.sender import TelegramSender, TokenBucket
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: dict = None):
+        self.status_code = status_code
+        self.body = body or {'ok': status_code == 200}
+        self.text = str(self.body)
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self) -> dict:
+        return self.body
+
+
+class FakeSession:
+    """ records posted messages, answers with the queued responses then 200 """
+    def __init__(self, responses=(), gate: threading.Event = None):
+        self.responses = list(responses)
+        self.gate = gate
+        self.posts = []
+
+    def post(self, url, data=None, timeout=None):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.posts.append((time.monotonic(), data))
+        response = self.responses.pop(0) if self.responses else FakeResponse(200)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        pass
+
+
+class TelegramSenderTest(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        now = bucket.updated
+        bucket.take(now)
+        bucket.take(now)
+        assert bucket.delay(now) == 0.5
+        assert bucket.delay(now + 0.5) == 0
+
+    def test_urgent_first_and_coalesced_when_saturated(self):
+        gate = threading.Event()
+        session = FakeSession(gate=gate)
+        sent = []
+        # the intro takes the only token of the group
+        sender = TelegramSender("token", session=session, group_rate=10, burst=1)
+        sender.send(-1, "intro")
+        # the first post is held, the next messages pile up
+        time.sleep(0.05)
+        sender.send(-1, "later", parse_mode='html')
+        sender.send(-1, "deal", parse_mode='html', urgent=True, on_sent=sent.append)
+        sender.send(-1, "other deal", parse_mode='html', urgent=True)
+        gate.set()
+        assert sender.flush(5)
+        sender.close(5)
+
+        assert [data['text'] for _, data in session.posts] == ["intro", "deal\n\nother deal\n\nlater"]
+        assert session.posts[1][1]['parse_mode'] == 'html' and 'parse_mode' not in session.posts[0][1]
+        assert len(sent) == 1
+        assert sender.stats()['sent'] == 2 and sender.stats()['coalesced'] == 2
+
+    def test_not_coalesced_while_tokens_left(self):
+        gate = threading.Event()
+        session = FakeSession(gate=gate)
+        sender = TelegramSender("token", session=session, burst=10)
+        sender.send(-1, "intro")
+        time.sleep(0.05)
+        sender.send(-1, "later")
+        sender.send(-1, "deal", urgent=True)
+        gate.set()
+        assert sender.flush(5)
+        sender.close(5)
+
+        assert [data['text'] for _, data in session.posts] == ["intro", "deal", "later"]
+        assert sender.stats()['sent'] == 3 and sender.stats()['coalesced'] == 0
+
+    def test_rate_limits(self):
+        session = FakeSession([FakeResponse(429, {'ok': False, 'parameters': {'retry_after': 0.2}})])
+        sender = TelegramSender("token", session=session, group_rate=10, burst=1)
+        sender.send(-1, "first")
+        assert sender.flush(5)
+        sender.send(-1, "second")
+        assert sender.flush(5)
+        sender.close(5)
+
+        (first_at, first), (retried_at, retried), (_, second) = session.posts
+        assert first['text'] == retried['text'] == "first" and second['text'] == "second"
+        assert retried_at - first_at >= 0.2
+        assert sender.stats()['rate_limited'] == 1 and sender.stats()['failed'] == 0
+
+    def test_drop_after_max_tries(self):
+        session = FakeSession([requests.exceptions.ConnectionError("down")] * 2 + [FakeResponse(400)])
+        sender = TelegramSender("token", session=session, max_tries=2, burst=10)
+        sender.RETRY_DELAY = 0.01
+        sender.send(1, "lost")
+        assert sender.flush(5)
+        sender.send(1, "rejected")
+        assert sender.flush(5)
+        sender.close(5)
+        assert [data['text'] for _, data in session.posts] == ["lost", "lost", "rejected"]
+        assert sender.stats()['failed'] == 2 and sender.stats()['retried'] == 1
@@ -0,0 +1,133 @@
+import json
+import time
+import asyncio
+import threading
+import unittest
+
+import websockets
+
+from scvfeed.blocksearch import ScvBlockSearch
+from scvfeed.decoder import PMON_TOKEN_TOPIC, TradeSide
+from scvfeed.subscription import LogSubscription
+
+
+def rpc_log(token_id: int, block_number: int, log_index: int = 0, price: int = 10 ** 18, removed=False) -> dict:
+    return {
+        'address': ScvBlockSearch.CONTRACT.lower(),
+        'topics': ['0x' + 'ee' * 32, '0x' + '00' * 32, PMON_TOKEN_TOPIC, '0x{:064x}'.format(token_id)],
+        'data': '0x{:064x}{:064x}{:064x}'.format(price, 1, 9),
+        'blockNumber': hex(block_number),
+        'blockHash': '0x' + '0b' * 32,
+        'transactionHash': '0x{:064x}'.format(block_number * 100 + log_index),
+        'transactionIndex': '0x0',
+        'logIndex': hex(log_index),
+        'removed': removed,
+    }
+
+
+class JsonRpcStandIn:
+    """ websocket json-rpc node answering the few calls ScvBlockSearch makes """
+    def __init__(self):
+        self.filter_changes = []
+        self.subscribers = set()
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+        self.started.wait(5)
+
+    def _serve(self):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(websockets.serve(self._handle, '127.0.0.1', 0))
+        self.url = 'ws://127.0.0.1:%d' % self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        self.loop.run_forever()
+
+    async def _handle(self, ws, path=None):
+        async for message in ws:
+            request = json.loads(message)
+            method = request['method']
+            if method == 'eth_subscribe':
+                result = '0x5b'
+                self.subscribers.add(ws)
+            elif method == 'eth_getFilterChanges':
+                result, self.filter_changes = self.filter_changes, []
+            else:
+                result = {'eth_newFilter': '0xf1', 'eth_blockNumber': '0x10'}.get(method, True)
+            await ws.send(json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': result}))
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(5)
+
+    def push(self, log: dict):
+        async def send():
+            for ws in list(self.subscribers):
+                await ws.send(json.dumps({'jsonrpc': '2.0', 'method': 'eth_subscription',
+                                          'params': {'subscription': '0x5b', 'result': log}}))
+        self._call(send())
+
+    def drop_subscribers(self):
+        async def close():
+            for ws in list(self.subscribers):
+                await ws.close()
+            self.subscribers.clear()
+        self._call(close())
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+
+
+def wait_for(predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class LogSubscriptionTest(unittest.TestCase):
+    def setUp(self):
+        self.node = JsonRpcStandIn()
+
+    def tearDown(self):
+        self.node.close()
+
+    def test_push_and_resubscribe(self):
+        subscription = LogSubscription(self.node.url, {'address': ScvBlockSearch.CONTRACT})
+        subscription.start()
+        try:
+            wait_for(subscription.connected.is_set)
+            self.node.push(rpc_log(1, 20))
+            self.node.push(rpc_log(2, 20, removed=True))
+            self.node.push(rpc_log(3, 21))
+            wait_for(lambda: subscription.notifications == 2)
+            assert [int(log['blockNumber'], 16) for log in subscription.get_logs(timeout=1)] == [20, 21]
+            assert subscription.get_logs() == []
+
+            self.node.drop_subscribers()
+            wait_for(lambda: subscription.subscriptions == 2)
+            self.node.push(rpc_log(4, 22))
+            assert len(subscription.get_logs(timeout=2)) == 1
+            assert subscription.stats()['removed'] == 1
+        finally:
+            subscription.stop()
+
+    def test_block_search_takes_pushed_logs_and_polls_on_resubscribe(self):
+        block_search = ScvBlockSearch(self.node.url, subscribe=True)
+        try:
+            wait_for(block_search.subscription.connected.is_set)
+            # first read after subscribing catches up from the filter
+            self.node.filter_changes = [rpc_log(5, 18)]
+            assert [o.token_id for o in block_search.get_sell_event()] == [5]
+            assert block_search.poll_interval == 0
+
+            self.node.push(rpc_log(6, 19))
+            offers = list(block_search.get_sell_event())
+            assert [(o.token_id, o.side, o.block_number) for o in offers] == [(6, TradeSide.SELL, 19)]
+
+            # missed while resubscribing, the polled filter overlaps what was pushed
+            self.node.drop_subscribers()
+            wait_for(lambda: block_search.subscription.subscriptions == 2)
+            self.node.filter_changes = [rpc_log(6, 19), rpc_log(7, 20)]
+            assert [o.token_id for o in block_search.get_sell_event()] == [7]
+            assert block_search.stats()['duplicates'] == 1
+        finally:
+            block_search.close()
@@ -0,0 +1,108 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Iterable, List
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+SHARE_MODEL_INTERVAL = int(os.getenv("SHARE_MODEL_INTERVAL", "300"))
+# relative difference with rankAndShare above which drift is logged as a warning
+SHARE_MODEL_MAX_DRIFT = float(os.getenv("SHARE_MODEL_MAX_DRIFT", "0.01"))
+
+
+class ShareModel:
+    """
+    local model of the collector staking pool, fitted on rankAndShare answers
+
+    rankAndShare gives the share a score would get against the staked total,
+    it is modelled as share(s) = s / (a * s + T), a and T fitted from two probe scores
+    (a is 1 when the probed score is added to the total, 0 when it is not).
+    A third score is only used to check the model against upstream, the relative
+    difference is kept as the drift.
+    """
+    def __init__(self,
+                 fetch_share: Callable[[int], float] = utils.get_share_on_score,
+                 probes: tuple = (100_000, 10_000_000),
+                 check_score: int = 1_000_000):
+        self.fetch_share = fetch_share
+        self.probes = probes
+        self.check_score = check_score
+        self._fit = None
+        self._lock = threading.Lock()
+        self.fitted_at = None
+        self.drift = None
+        self.max_drift = 0.0
+        self.refresh_errors = 0
+
+    @staticmethod
+    def _solve(s1: int, share1: float, s2: int, share2: float) -> tuple:
+        # 1 / share = a + T / s, linear in 1 / s
+        slope = (1 / share1 - 1 / share2) / (1 / s1 - 1 / s2)
+        return 1 / share1 - slope / s1, slope
+
+    @staticmethod
+    def _share(fit: tuple, score: int) -> float:
+        a, total = fit
+        return score / (a * score + total) if score > 0 else 0.0
+
+    def refresh(self):
+        try:
+            (s1, s2), check = self.probes, self.check_score
+            fit = self._solve(s1, self.fetch_share(s1), s2, self.fetch_share(s2))
+            remote = self.fetch_share(check)
+            if remote <= 0:
+                raise ValueError(f"rankAndShare answered {remote} for {check}")
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.warning(f"cannot refresh share model: {e}")
+            return
+
+        previous = self._fit
+        # drift of the model in use until now, or fitting error on the first refresh
+        self.drift = abs(self._share(previous or fit, check) - remote) / remote
+        self.max_drift = max(self.max_drift, self.drift)
+        if self.drift > SHARE_MODEL_MAX_DRIFT:
+            logger.warning("share model drifted %.2f%% from rankAndShare", self.drift * 100)
+
+        with self._lock:
+            self._fit = fit
+            self.fitted_at = time.time()
+
+    def _ensure_fitted(self) -> tuple:
+        if self._fit is None:
+            self.refresh()
+        if self._fit is None:
+            raise ValueError("share model is not fitted")
+        return self._fit
+
+    def share(self, score: int) -> float:
+        return self._share(self._ensure_fitted(), score)
+
+    def shares(self, scores: Iterable[int]) -> List[float]:
+        fit = self._ensure_fitted()
+        return [self._share(fit, s) for s in scores]
+
+    def reward(self, score: int, pool: float) -> float:
+        return pool * self.share(score)
+
+    def total_scores(self) -> int:
+        return round(self._ensure_fitted()[1])
+
+    def schedule(self, scheduler, interval: int = SHARE_MODEL_INTERVAL):
+        scheduler.add_job(self.refresh, 'interval', seconds=interval,
+                          id='share_model_refresh', max_instances=1, coalesce=True)
+
+    def stats(self) -> dict:
+        return {
+            'total_scores': round(self._fit[1]) if self._fit else None,
+            'drift': self.drift,
+            'max_drift': self.max_drift,
+            'refresh_errors': self.refresh_errors,
+            'age': time.time() - self.fitted_at if self.fitted_at else None,
+        }
+
+
+share_model = ShareModel()
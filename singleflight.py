@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    coalesces concurrent calls: callers asking for a key while a call for it is in flight
+    wait for that call and share its result or exception
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'shared': self.shared}
+
+
+class AsyncSingleFlight:
+    """ asyncio counterpart of SingleFlight, to be used from a single event loop """
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # shield, a cancelled follower must not cancel the leader's call
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = self._calls[key] = asyncio.get_event_loop().create_future()
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # retrieved here so an exception nobody waited for is not reported as unhandled
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'shared': self.shared}
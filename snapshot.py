@@ -0,0 +1,109 @@
+import os
+import json
+import logging
+import threading
+from typing import Iterator, Set
+
+from datatypes import Metadata, json_loads
+from metadata_cache import is_opened
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.getenv("METADATA_SNAPSHOT_PATH", "snapshot/metadata.jsonl")
+
+
+def failures_path(path: str) -> str:
+    return f"{path}.failed"
+
+
+def iter_raw_snapshot(path: str = SNAPSHOT_PATH) -> Iterator[dict]:
+    """ raw metadata stored in a snapshot, a truncated last line left by a crash is skipped """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                yield json_loads(line)
+            except ValueError:
+                logger.warning(f"skip broken snapshot line in {path}")
+
+
+def iter_snapshot(path: str = SNAPSHOT_PATH) -> Iterator[Metadata]:
+    """ opened monsters of a snapshot """
+    for raw in iter_raw_snapshot(path):
+        if not is_opened(raw):
+            continue
+        try:
+            yield Metadata.from_metadata(raw)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"skip unparsable metadata {raw.get('id')}: {e}")
+
+
+def snapshot_ids(path: str = SNAPSHOT_PATH) -> Set[int]:
+    return {int(m['id']) for m in iter_raw_snapshot(path)}
+
+
+def failed_ids(path: str = SNAPSHOT_PATH) -> Set[int]:
+    """ ids recorded as failed and still missing from the snapshot """
+    failed = set()
+    for record in iter_raw_snapshot(failures_path(path)):
+        failed.add(int(record['id']))
+    return failed - snapshot_ids(path)
+
+
+def truncate_partial_line(path: str, chunk: int = 4096):
+    """ cuts a last line left without its newline by a crash, so the next record starts on its own line """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - chunk)
+            f.seek(start)
+            data = f.read(position - start)
+            newline = data.rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            logger.warning(f"drop truncated last line of {path}")
+            f.truncate(position)
+
+
+class SnapshotWriter:
+    """ append-only writer, every record is flushed so a crash loses at most one line """
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        for p in (path, failures_path(path)):
+            truncate_partial_line(p)
+        self._snapshot = open(path, 'a')
+        self._failures = open(failures_path(path), 'a')
+
+    @staticmethod
+    def _append(f, record: dict):
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+
+    def write(self, metadata: dict):
+        with self._lock:
+            self._append(self._snapshot, metadata)
+
+    def write_failure(self, m_id: int, error: str):
+        with self._lock:
+            self._append(self._failures, {'id': m_id, 'error': error})
+
+    def close(self):
+        with self._lock:
+            self._snapshot.close()
+            self._failures.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
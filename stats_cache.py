@@ -0,0 +1,178 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Callable, Dict, Hashable, Optional
+
+from cachetools import TTLCache
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+# seconds an entry is served without refetching, per endpoint
+LEADERBOARD_TTL = int(os.getenv("LEADERBOARD_TTL", "60"))
+RANK_AND_SHARE_TTL = int(os.getenv("RANK_AND_SHARE_TTL", "300"))
+OVERALL_TTL = int(os.getenv("OVERALL_TTL", "1800"))
+REFRESH_INTERVAL = int(os.getenv("STATS_REFRESH_INTERVAL", "10"))
+
+_refresh_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def refresh_executor() -> ThreadPoolExecutor:
+    """ worker threads refetching entries, started on first use rather than at import """
+    global _refresh_executor
+    with _executor_lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="stats-refresh")
+        return _refresh_executor
+
+
+class RefreshingCache:
+    """
+    ttl cache in front of a slow endpoint
+
+    - fresh entries are served from memory
+    - entries accessed since the last refresh are refetched by `refresh_due` ahead of expiry
+    - an expired entry is revalidated, if upstream does not answer within `revalidate_timeout`
+      the stale value is served and the refetch finishes in background
+    - stale entries are dropped after `ttl + stale_ttl`
+    """
+    def __init__(self, name: str, fetch: Callable, ttl: float, stale_ttl: float = None,
+                 refresh_ahead: float = 0.2, revalidate_timeout: float = 1, maxsize: int = 1024,
+                 timer: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.revalidate_timeout = revalidate_timeout
+        self.timer = timer
+        stale_ttl = stale_ttl if stale_ttl is not None else ttl * 10
+        # entries are (value, fetched_at)
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl + stale_ttl, timer=timer)
+        self._accessed = set()
+        self._refreshing: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    def _fetch_and_store(self, key: tuple):
+        try:
+            value = self.fetch(*key)
+            with self._lock:
+                self._entries[key] = (value, self.timer())
+            return value
+        except Exception:
+            with self._lock:
+                self.refresh_errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._refreshing[key]
+
+    def _refresh(self, key: tuple) -> Future:
+        """ at most one refetch per key in flight, must hold the lock """
+        future = self._refreshing.get(key)
+        if future is None:
+            future = self._refreshing[key] = refresh_executor().submit(self._fetch_and_store, key)
+        return future
+
+    def get(self, *key):
+        with self._lock:
+            self._accessed.add(key)
+            entry = self._entries.get(key)
+            if entry is not None and self.timer() - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0]
+            future = self._refresh(key)
+
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return future.result()
+
+        try:
+            value = future.result(timeout=self.revalidate_timeout)
+            with self._lock:
+                self.hits += 1
+            return value
+        except Exception as e:
+            if not isinstance(e, TimeoutError):
+                logger.warning(f"{self.name}: serving stale entry, revalidation failed: {e}")
+            with self._lock:
+                self.stale_hits += 1
+            return entry[0]
+
+    def refresh_due(self):
+        """ refetch entries accessed since their last refresh that are about to expire """
+        refresh_before = self.ttl * (1 - self.refresh_ahead)
+        now = self.timer()
+        with self._lock:
+            for key in list(self._accessed):
+                entry = self._entries.get(key)
+                if entry is None or now - entry[1] >= refresh_before:
+                    self._accessed.discard(key)
+                    self._refresh(key).add_done_callback(self._log_refresh_error)
+
+    def _log_refresh_error(self, future: Future):
+        if future.exception() is not None:
+            logger.warning(f"{self.name}: background refresh failed: {future.exception()}")
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refresh_errors': self.refresh_errors,
+            'size': len(self._entries),
+        }
+
+
+leaderboard_cache = RefreshingCache("leaderboard", utils.fetch_leaderboard, ttl=LEADERBOARD_TTL)
+share_cache = RefreshingCache("rankAndShare", utils.get_share_on_score, ttl=RANK_AND_SHARE_TTL)
+overall_cache = RefreshingCache("overall", utils.get_overall_stats, ttl=OVERALL_TTL)
+CACHES = (leaderboard_cache, share_cache, overall_cache)
+
+
+def get_leaderboard(anchor_rank: int = 10):
+    if anchor_rank > 100:
+        raise NotImplementedError(f"not support over {100}")
+    # the top 100 is cached once, any anchor is a slice of it
+    top = leaderboard_cache.get(100)
+    return utils.cut_leaderboard(top[:anchor_rank + 3], anchor_rank)
+
+
+def get_share_on_score(score: int) -> float:
+    return share_cache.get(score)
+
+
+def get_total_scores() -> int:
+    foo_score = 1_000_000
+    return int(foo_score / get_share_on_score(foo_score))
+
+
+def get_overall_stats():
+    return overall_cache.get()
+
+
+def get_weekly_birthday_snapshot():
+    return utils.get_weekly_birthday_snapshot(get_overall_stats())
+
+
+def refresh_all():
+    for cache in CACHES:
+        cache.refresh_due()
+
+
+def start_refresher(interval: int = REFRESH_INTERVAL) -> BackgroundScheduler:
+    refresh_executor()
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(refresh_all, 'interval', seconds=interval,
+                      id='stats_cache_refresh', max_instances=1, coalesce=True)
+    scheduler.start()
+    return scheduler
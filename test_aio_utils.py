@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from aio_utils import AsyncPolkamonClient
+
+
+class AsyncPolkamonClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.requests = []
+        self.in_flight = 0
+        self.peak = 0
+        self.failures = {}
+
+        async def handler(request: web.Request):
+            path = request.match_info['path']
+            self.requests.append((path, request.transport.get_extra_info('peername')))
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            try:
+                if path == 'slow':
+                    await asyncio.sleep(1)
+                else:
+                    await asyncio.sleep(0.02)
+                status = self.failures.get(path, [])
+                if status:
+                    return web.Response(status=status.pop(0))
+                return web.json_response({'path': path})
+            finally:
+                self.in_flight -= 1
+
+        app = web.Application()
+        app.router.add_get('/{path}', handler)
+        self.server = TestServer(app)
+        await self.server.start_server()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    def url(self, path: str) -> str:
+        return str(self.server.make_url(f'/{path}'))
+
+    async def test_keep_alive_pool_and_in_flight_limit(self):
+        async with AsyncPolkamonClient(max_in_flight=2, use_cache=False) as client:
+            for _ in range(3):
+                assert await client.get_json(self.url('one')) == {'path': 'one'}
+            # sequential requests reuse one pooled connection
+            assert len({peer for _, peer in self.requests}) == 1
+
+            await asyncio.gather(*(client.get_json(self.url(f'many{i}')) for i in range(6)))
+            assert self.peak == 2
+
+    async def test_retry_throttling_only(self):
+        self.failures = {'throttled': [429], 'missing': [404, 404], 'broken': [503, 503, 503]}
+        async with AsyncPolkamonClient(use_cache=False) as client:
+            assert await client.get_json(self.url('throttled')) == {'path': 'throttled'}
+            with self.assertRaises(aiohttp.ClientResponseError) as missing:
+                await client.get_json(self.url('missing'))
+            assert missing.exception.status == 404
+            with self.assertRaises(aiohttp.ClientResponseError):
+                await client.get_json(self.url('broken'))
+        attempts = [path for path, _ in self.requests]
+        assert attempts.count('throttled') == 2 and attempts.count('missing') == 1
+        assert attempts.count('broken') == 3
+
+    async def test_timeout(self):
+        async with AsyncPolkamonClient(timeout=0.1, use_cache=False) as client:
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.fetch_json(self.url('slow'))
+        assert [path for path, _ in self.requests] == ['slow']
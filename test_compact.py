@@ -0,0 +1,27 @@
+import random
+import unittest
+
+from compact import MetadataStore
+from test_scoring import random_meta
+
+
+class MetadataStoreTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(3)
+        self.metas = [random_meta(rnd, special=rnd.random() < 0.1) for _ in range(1000)]
+        for i, meta in enumerate(self.metas):
+            meta.id = str(10001000000 + rnd.randrange(1_000_000))
+            meta.image = f"https://assets.polkamon.com/images/Unimons_T04C05H08B04G{i % 7:02d}.jpg"
+        self.store = MetadataStore()
+        self.store.extend(self.metas)
+
+    def test_lossless(self):
+        assert list(self.store) == self.metas
+        assert self.store.get(int(self.metas[42].id)) == self.metas[42]
+        assert self.store.get(1) is None
+
+    def test_scores(self):
+        assert self.store.rarity_scores().tolist() == [m.rarity_score for m in self.metas]
+
+    def test_compact(self):
+        assert self.store.bytes_per_token() < 100
@@ -0,0 +1,31 @@
+import unittest
+
+from datatypes import Type, Horn, Color, Traits
+
+
+def scan(cls, i: str):
+    for mem in cls.__members__.values():
+        if i in mem.value or i in mem.value.lower().replace(" ", ""):
+            return mem
+    raise NotImplementedError(f"not found {i}")
+
+
+class TraitsOfTest(unittest.TestCase):
+    def inputs(self, cls: Traits):
+        for mem in cls:
+            for value in (mem.value, mem.value.lower(), mem.value.lower().replace(" ", ""), mem.value.upper()):
+                yield value
+                yield from (value[:n] for n in range(len(value)))
+                yield from (value[n:] for n in range(len(value)))
+        yield from ("", " ", "uni", "baby", "glitter", "Unicorn", "spear ")
+
+    def test_same_as_scan(self):
+        for cls in (Type, Horn, Color):
+            for i in self.inputs(cls):
+                for _ in range(2):  # indexed, then remembered
+                    try:
+                        expected = scan(cls, i)
+                    except NotImplementedError:
+                        self.assertRaises(NotImplementedError, cls.of, i)
+                        continue
+                    assert cls.of(i) is expected, (cls, i)
@@ -0,0 +1,35 @@
+import unittest
+from metadata_cache import MetadataCache
+
+METADATA = {"id": "10001290268", "name": "Uniturtle", "image": "",
+            "attributes": [{"trait_type": "Type", "value": "Uniturtle"}]}
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def test_read_through(self):
+        cache = MetadataCache(path=':memory:', maxsize=2)
+        fetched = []
+
+        def fetch(m_id):
+            fetched.append(m_id)
+            return METADATA
+
+        assert cache.get_or_fetch("10001290268", fetch) == METADATA
+        assert cache.get_or_fetch("10001290268", fetch) == METADATA
+        assert fetched == ["10001290268"]
+        assert cache.stats()['memory_hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_disk_tier_and_warm(self):
+        cache = MetadataCache(path=':memory:', maxsize=1)
+        cache.put("1", {**METADATA, "id": "1"})
+        cache.put("2", {**METADATA, "id": "2"})
+        assert cache.get("1")['id'] == "1"
+        assert cache.stats()['disk_hits'] == 1
+        assert cache.warm(["2", "3"]) == 1
+        assert len(cache) == 2
+
+    def test_unopened_is_not_cached(self):
+        cache = MetadataCache(path=':memory:')
+        cache.put("1", {"id": "1"})
+        assert "1" not in cache
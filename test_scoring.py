@@ -0,0 +1,41 @@
+import random
+import unittest
+
+import numpy as np
+
+from datatypes import Metadata, Rarity, Attribute, Horn
+from scoring import rarity_scores, rarity_scores_of, to_columns
+
+PROBABILITIES = (1, 0.99, 0.2, 0.16, 0.06, 0.05, 0.015, 0.01, 0.0005, 0.0001)
+
+
+def random_meta(rnd: random.Random, special: bool) -> Metadata:
+    return Metadata(
+        id="1", name="", image="",
+        attributes=Attribute(born=1630645436, type="Uniturtle",
+                             horn=rnd.choice(list(Horn)).value, color="Red",
+                             glitter=False, special=special),
+        rarity=Rarity(*(rnd.choice(PROBABILITIES) for _ in range(5))))
+
+
+class RarityScoresTest(unittest.TestCase):
+    def test_same_as_scalar(self):
+        rnd = random.Random(7)
+        metas = [random_meta(rnd, special=rnd.random() < 0.3) for _ in range(5000)]
+        # Colchian Unidragon has no probabilities
+        metas.append(Metadata(id="2", name="", image="",
+                              attributes=Attribute(1630645436, "Unidragon", "Dragon Claw", "Red", False, True),
+                              rarity=Rarity(0, 0, 0, 0, 0)))
+
+        scores = rarity_scores_of(metas)
+        assert scores.dtype == np.int64
+        assert scores.tolist() == [m.rarity_score for m in metas]
+        assert scores.max() == 1_000_000
+
+    def test_baby_horn_flags(self):
+        probabilities, special, horn = to_columns([random_meta(random.Random(i), False) for i in range(100)])
+        assert (rarity_scores(probabilities, special, horn)
+                == rarity_scores(probabilities, special, horn == Horn.BABY_HORN.value)).all()
+
+    def test_non_special_without_probability_raises(self):
+        self.assertRaises(ZeroDivisionError, rarity_scores, [[0, 0, 0, 0, 0]], [False], ["Dragon Claw"])
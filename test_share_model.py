@@ -0,0 +1,59 @@
+import unittest
+
+from share_model import ShareModel
+from scvfeed.metrics import Registry
+
+
+class PoolStub:
+    """ rankAndShare of a pool holding `total` scores, the probed score added when `a` is 1 """
+    def __init__(self, total: float, a: float = 1):
+        self.total = total
+        self.a = a
+        self.calls = []
+
+    def __call__(self, score: int) -> float:
+        self.calls.append(score)
+        return score / (self.a * score + self.total)
+
+
+class ShareModelTest(unittest.TestCase):
+    def test_solve_synthetic_probes(self):
+        for a, total in ((1, 5e8), (0, 2e9)):
+            stub = PoolStub(total, a)
+            fit = ShareModel._solve(100_000, stub(100_000), 10_000_000, stub(10_000_000))
+            assert abs(fit[0] - a) < 1e-9 and abs(fit[1] - total) / total < 1e-9
+
+    def test_answers_match_upstream(self):
+        stub = PoolStub(5e8)
+        model = ShareModel(fetch_share=stub)
+        for score in (1, 12_345, 1_000_000, 3e8):
+            assert abs(model.share(score) - stub(score)) < 1e-12
+        assert abs(model.reward(1_000_000, 70_000) - 70_000 * stub(1_000_000)) < 1e-6
+        assert model.total_scores() == 500_000_000
+        assert model.shares([0, 1_000_000]) == [0.0, model.share(1_000_000)]
+        assert model.stats()['drift'] < 1e-9
+
+    def test_zero_answer_keeps_refreshing(self):
+        stub = PoolStub(5e8)
+        answers = {1_000_000: 0.0}
+        model = ShareModel(fetch_share=lambda s: answers.get(s, stub(s)))
+        model.refresh()
+        assert model.stats()['refresh_errors'] == 1 and model.stats()['total_scores'] is None
+
+        answers.clear()
+        model.refresh()
+        assert model.total_scores() == 500_000_000
+
+    def test_drift_is_exported(self):
+        stub = PoolStub(5e8)
+        model = ShareModel(fetch_share=stub)
+        model.refresh()
+        stub.total = 6e8
+        model.refresh()
+        # the previous model against the new upstream answer
+        assert 0.15 < model.stats()['drift'] < 0.25
+        assert model.total_scores() == 600_000_000
+
+        registry = Registry()
+        registry.collect("share_model", model.stats)
+        assert f"share_model_drift {model.drift}" in registry.render()
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from singleflight import SingleFlight, AsyncSingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_concurrent_calls_share_one_request(self):
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def fetch(m_id):
+            calls.append(m_id)
+            started.set()
+            time.sleep(0.1)
+            return {'id': m_id}
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(lambda _: flight.do("1", fetch, "1"), range(5)))
+
+        assert calls == ["1"]
+        assert all(r == {'id': "1"} for r in results)
+        assert flight.stats() == {'calls': 1, 'shared': 4}
+
+    def test_error_is_shared_and_not_cached(self):
+        flight = SingleFlight()
+
+        def fail():
+            time.sleep(0.05)
+            raise ValueError("upstream down")
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(flight.do, "1", fail) for _ in range(3)]
+        for f in futures:
+            self.assertRaises(ValueError, f.result)
+        assert flight.do("1", lambda: 1) == 1
+
+    def test_async(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fetch(m_id):
+            calls.append(m_id)
+            await asyncio.sleep(0.05)
+            return m_id
+
+        async def main():
+            return await asyncio.gather(*(flight.do("1", fetch, "1") for _ in range(10)))
+
+        assert asyncio.run(main()) == ["1"] * 10
+        assert calls == ["1"]
@@ -0,0 +1,108 @@
+import threading
+import unittest
+
+from stats_cache import RefreshingCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeFetcher:
+    """ answers `value` per call, optionally held on `gate` or raising `error` """
+    def __init__(self):
+        self.calls = []
+        self.value = 0
+        self.error = None
+        self.gate = None
+
+    def __call__(self, *key):
+        self.calls.append(key)
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return (*key, self.value)
+
+
+def settle(cache: RefreshingCache):
+    """ wait for the refetches in flight """
+    with cache._lock:
+        refreshing = list(cache._refreshing.values())
+    for future in refreshing:
+        future.exception(5)
+
+
+class RefreshingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.fetch = FakeFetcher()
+
+    def cache(self, ttl: float, **kwargs) -> RefreshingCache:
+        return RefreshingCache("test", self.fetch, ttl=ttl, timer=self.clock, **kwargs)
+
+    def test_ttl_per_endpoint(self):
+        leaderboard, overall = self.cache(10), self.cache(100)
+        assert leaderboard.get(100) == overall.get(100) == (100, 0)
+        self.fetch.value = 1
+        self.clock.now += 11
+        assert overall.get(100) == (100, 0)
+        assert leaderboard.get(100) == (100, 1)
+        assert len(self.fetch.calls) == 3
+        assert overall.stats()['hits'] == 1 and leaderboard.stats()['misses'] == 1
+
+    def test_refresh_ahead_of_expiry(self):
+        cache = self.cache(10, refresh_ahead=0.2)
+        cache.get(1)
+        cache.get(2)
+        self.fetch.value = 1
+        self.clock.now += 7
+        cache.refresh_due()
+        assert len(self.fetch.calls) == 2
+
+        self.clock.now += 1.5
+        cache.refresh_due()
+        settle(cache)
+        # refreshed once while accessed, not again until read
+        cache.refresh_due()
+        assert self.fetch.calls.count((1,)) == 2
+
+        self.clock.now += 3
+        calls = len(self.fetch.calls)
+        assert cache.get(1) == (1, 1) and len(self.fetch.calls) == calls
+        assert cache.stats()['stale_hits'] == 0
+
+    def test_stale_while_revalidate(self):
+        cache = self.cache(10, revalidate_timeout=0.05)
+        cache.get(1)
+        self.fetch.value = 1
+        self.fetch.gate = threading.Event()
+        self.clock.now += 11
+        # upstream is slow, the stale value is served
+        assert cache.get(1) == (1, 0)
+        # the second read joins the refetch in flight
+        assert cache.get(1) == (1, 0)
+        assert len(self.fetch.calls) == 2 and cache.stats()['stale_hits'] == 2
+
+        self.fetch.gate.set()
+        settle(cache)
+        assert cache.get(1) == (1, 1) and len(self.fetch.calls) == 2
+
+    def test_error_fallback(self):
+        cache = self.cache(10, stale_ttl=20)
+        cache.get(1)
+        self.fetch.error = ConnectionError("down")
+        self.clock.now += 11
+        assert cache.get(1) == (1, 0)
+        with self.assertRaises(ConnectionError):
+            cache.get(2)
+        assert cache.stats()['refresh_errors'] == 2
+
+        # dropped after ttl + stale_ttl
+        self.clock.now += 20
+        with self.assertRaises(ConnectionError):
+            cache.get(1)
@@ -4,6 +4,9 @@ from functools import reduce
 from datetime import datetime, timedelta, date
 import backoff
 
+from metadata_cache import get_metadata_cache
+from singleflight import SingleFlight
+
 METADATA_URL = "http://meta.polkamon.com/meta?id={id}"
 RANK_AND_SHARE = "https://pkm-collectorstaking.herokuapp.com/rankAndShare/{score}"
 LEADERBOARD = "https://pkm-collectorstaking.herokuapp.com/leaderboard?limit={limit}"
@@ -21,7 +24,7 @@ OVERALL = "https://nft-tracker.net/_next/data/x_eT6Y4CJosc-z5sXkI21/collections/
 @backoff.on_exception(backoff.expo,
                       requests.exceptions.RequestException,
                       max_tries=2)
-def get_metadata(m_id: str) -> dict:
+def fetch_metadata(m_id: str) -> dict:
     url = METADATA_URL.format(id=m_id)
     res = requests.get(url)
     if res.status_code == 200:
@@ -30,16 +33,37 @@ def get_metadata(m_id: str) -> dict:
     raise RequestException
 
 
-@backoff.on_exception(backoff.expo,
-                      requests.exceptions.RequestException,
-                      max_tries=2)
-async def get_metadata_async(m_id: str) -> dict:
-    url = METADATA_URL.format(id=m_id)
-    res = await requests.get(url)
-    if res.status_code == 200:
-        return res.json()
+# shared by every metadata lookup of the process, concurrent lookups of one token make one request
+metadata_flight = SingleFlight()
 
-    raise RequestException
+
+def _fetch_and_cache_metadata(m_id: str) -> dict:
+    metadata = fetch_metadata(m_id)
+    get_metadata_cache().put(m_id, metadata)
+    return metadata
+
+
+def get_metadata(m_id: str, use_cache: bool = True) -> dict:
+    m_id = str(m_id)
+    if not use_cache:
+        return metadata_flight.do(m_id, fetch_metadata, m_id)
+
+    metadata = get_metadata_cache().get(m_id)
+    if metadata is not None:
+        return metadata
+    return metadata_flight.do(m_id, _fetch_and_cache_metadata, m_id)
+
+
+def warm_metadata_cache(ids=None, fetch_missing: bool = False) -> int:
+    return get_metadata_cache().warm(ids, fetch=fetch_metadata if fetch_missing else None)
+
+
+async def get_metadata_async(m_id: str, client) -> dict:
+    """
+    :param client: AsyncPolkamonClient kept open by the caller, a session per call
+                   would throw away its keep-alive connections
+    """
+    return await client.get_metadata(m_id)
 
 
 def get_share_on_score(score: int) -> float:
@@ -60,16 +84,24 @@ def get_leaderboard(anchor_rank: int = 10):
     if anchor_rank > 100:
         raise NotImplementedError(f"not support over {100}")
 
-    url = LEADERBOARD.format(limit=min(100, anchor_rank + 3))
+    return cut_leaderboard(fetch_leaderboard(min(100, anchor_rank + 3)), anchor_rank)
+
+
+def fetch_leaderboard(limit: int = 100) -> list:
+    url = LEADERBOARD.format(limit=limit)
     res = requests.get(url)
     if res.status_code == 200:
-        leaderboard = [{**u, 'rank': i + 1} for i, u in enumerate(res.json())]
-        cutoff_from = anchor_rank - 3
-        return leaderboard[cutoff_from:]
+        return res.json()
 
     raise RequestException("")
 
 
+def cut_leaderboard(users: list, anchor_rank: int) -> list:
+    leaderboard = [{**u, 'rank': i + 1} for i, u in enumerate(users)]
+    cutoff_from = anchor_rank - 3
+    return leaderboard[cutoff_from:]
+
+
 def transform_displayed_info(info: dict) -> str:
     return "\n".join([f"{k}: {v}" for k, v in info.items()])
 
@@ -91,8 +123,9 @@ def get_overall_stats():
     raise RequestException
 
 
-def get_birthday_stats():
+def get_birthday_stats(overall: dict = None):
     """
+    :param overall: already fetched overall stats, fetched when omitted
     :return:
     [
       {
@@ -114,19 +147,20 @@ def get_birthday_stats():
     ]
     """
     try:
-        birthday = get_overall_stats()['pageProps']['initialCollection']['attributes']['Birthday']
+        overall = overall if overall is not None else get_overall_stats()
+        birthday = overall['pageProps']['initialCollection']['attributes']['Birthday']
     except IndexError:
         raise IndexError("overall API has changed")
     return birthday
 
 
-def get_weekly_birthday_snapshot():
+def get_weekly_birthday_snapshot(overall: dict = None):
     def transform_bdate(b: dict):
         v = b['value']
         s = f"{v['year']}-{v['month']}-{v['day']}"
         date = datetime.strptime(s, "%Y-%m-%d").date()
         return {**b, 'value': date}
-    birthday = get_birthday_stats()
+    birthday = get_birthday_stats(overall)
     today = date.today()
     offset = (today.weekday() - 2) % 7
     last_date_after_snapshot = today - timedelta(days=offset)